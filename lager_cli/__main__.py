@@ -3,10 +3,23 @@
 
     Main entry point when running as a module
 """
+import os
 import sys
 
-from .cli import cli
+
+def main():
+    """
+        Console entry point. Shell completion requests are answered from local caches
+        before the CLI itself is imported.
+    """
+    from .completion import COMPLETE_VAR  # pylint: disable=import-outside-toplevel
+    if COMPLETE_VAR in os.environ:
+        from .completion import complete  # pylint: disable=import-outside-toplevel
+        return complete(os.environ[COMPLETE_VAR])
+
+    from .cli import main as cli_main  # pylint: disable=import-outside-toplevel
+    return cli_main()
 
 
 if __name__ == "__main__":
-    sys.exit(cli())
+    sys.exit(main())
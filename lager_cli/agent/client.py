@@ -0,0 +1,181 @@
+"""
+    lager.agent.client
+
+    Thin client that forwards an invocation to a running `lager agent`
+"""
+import os
+import sys
+import json
+import socket
+
+from .. import __version__
+from ..cache import get_cache_dir
+
+AGENT_SOCKET_NAME = 'agent.sock'
+
+# Short request/response commands. Anything long-running or streaming (flash, erase,
+# connect, canbus dump, ...), bound to a local port, relying on Ctrl-C or touching
+# credentials always runs in-process: the agent serves one invocation at a time and
+# can't be interrupted from the client.
+FORWARDED_COMMANDS = frozenset((
+    'adc',
+    'canbus',
+    'disconnect',
+    'gateway',
+    'gpio',
+    'list',
+    'reset',
+    'serial-ports',
+    'set',
+    'wifi',
+))
+
+# Groups of which only these subcommands are forwarded
+FORWARDED_SUBCOMMANDS = {
+    'canbus': frozenset(('down', 'list', 'send', 'up')),
+}
+
+def describe_forwarded():
+    """
+        The forwarded commands, for help and status output
+    """
+    names = []
+    for command in sorted(FORWARDED_COMMANDS):
+        if command in FORWARDED_SUBCOMMANDS:
+            names.extend(f'{command} {sub}' for sub in sorted(FORWARDED_SUBCOMMANDS[command]))
+        else:
+            names.append(command)
+    return ', '.join(names)
+
+
+def get_socket_path():
+    """
+        Path of the agent's unix socket; override with LAGER_AGENT_SOCKET
+    """
+    if 'LAGER_AGENT_SOCKET' in os.environ:
+        return os.getenv('LAGER_AGENT_SOCKET')
+    return os.path.join(get_cache_dir(), AGENT_SOCKET_NAME)
+
+def send_message(stream, message):
+    """
+        Write one newline-delimited JSON message
+    """
+    stream.write(json.dumps(message).encode() + b'\n')
+    stream.flush()
+
+def receive_message(stream):
+    """
+        Read one newline-delimited JSON message, or None at EOF
+    """
+    line = stream.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+def encode_output(data):
+    """
+        Bytes -> JSON-safe text, losslessly
+    """
+    return data.decode('utf-8', 'surrogateescape')
+
+def decode_output(text):
+    """
+        Inverse of `encode_output`
+    """
+    return text.encode('utf-8', 'surrogateescape')
+
+def connect(path=None, timeout=None):
+    """
+        Connect to the agent, or return None if it is not running
+    """
+    if path is None:
+        path = get_socket_path()
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+def agent_request(message, path=None, timeout=5):
+    """
+        Send a control message to the agent and return its reply, or None if
+        the agent is not running
+    """
+    sock = connect(path, timeout)
+    if sock is None:
+        return None
+    with sock, sock.makefile('rwb') as stream:
+        send_message(stream, message)
+        return receive_message(stream)
+
+def _is_forwarded(argv):
+    # All top-level `lager` options, and the options of the forwarded groups, are flags,
+    # so the first positionals are the command and its subcommand
+    positionals = [arg for arg in argv if not arg.startswith('-')]
+    if not positionals or positionals[0] not in FORWARDED_COMMANDS:
+        return False
+    subcommands = FORWARDED_SUBCOMMANDS.get(positionals[0])
+    return subcommands is None or (len(positionals) > 1 and positionals[1] in subcommands)
+
+def _write(name, data):
+    stream = getattr(sys, name)
+    stream = getattr(stream, 'buffer', stream)
+    stream.write(decode_output(data))
+    stream.flush()
+
+def forward(argv):
+    """
+        Run `argv` in the agent, relaying output and stdin.
+        Returns the exit code, or None if the invocation should run in-process.
+    """
+    if os.getenv('LAGER_NO_AGENT') or not _is_forwarded(argv):
+        return None
+    if '--help' in argv:
+        return None
+
+    sock = connect()
+    if sock is None:
+        return None
+
+    request = {
+        'type': 'run',
+        'version': __version__,
+        'argv': list(argv),
+        'cwd': os.getcwd(),
+        'env': dict(os.environ),
+        'isatty': {
+            'stdout': sys.stdout.isatty(),
+            'stderr': sys.stderr.isatty(),
+        },
+    }
+    started = False
+    with sock, sock.makefile('rwb') as stream:
+        try:
+            send_message(stream, request)
+            while True:
+                message = receive_message(stream)
+                if message is None:
+                    break
+                kind = message['type']
+                if kind == 'reject':
+                    return None
+                started = True
+                if kind in ('stdout', 'stderr'):
+                    _write(kind, message['data'])
+                elif kind == 'read':
+                    line = sys.stdin.buffer.readline(message['size'])
+                    send_message(stream, {'type': 'stdin', 'data': encode_output(line)})
+                elif kind == 'exit':
+                    return message['code']
+        except OSError:
+            pass
+
+    if not started:
+        return None
+    print('Lost connection to lager agent', file=sys.stderr)
+    return 1
@@ -0,0 +1,89 @@
+"""
+    lager.agent.commands
+
+    Background agent commands
+"""
+import os
+import sys
+import time
+import subprocess
+import click
+from ..cache import get_cache_dir
+from .client import get_socket_path, agent_request, describe_forwarded
+
+_STARTUP_TIMEOUT = 10
+
+
+@click.group()
+def agent():
+    """
+        Keep a background process with warm API sessions to speed up repeated commands
+    """
+    pass
+
+@agent.command(help=f"""
+    Start the agent. While it runs, these commands are served by it:
+    {describe_forwarded()}. Set LAGER_NO_AGENT=1 to bypass it.
+""")
+@click.option('--foreground', is_flag=True, default=False, help='Run the agent in this process')
+@click.option('--idle-timeout', type=click.IntRange(min=1), default=1800, show_default=True,
+              help='Exit after this many seconds without a command')
+def start(foreground, idle_timeout):
+    path = get_socket_path()
+    status = agent_request({'type': 'status'}, path)
+    if status is not None:
+        click.echo(f'Agent already running (pid {status["pid"]})')
+        return
+
+    if foreground:
+        from .server import serve  # pylint: disable=import-outside-toplevel
+        serve(path, idle_timeout)
+        return
+
+    os.makedirs(get_cache_dir(), exist_ok=True)
+    log_path = os.path.join(get_cache_dir(), 'agent.log')
+    args = [
+        sys.executable, '-m', 'lager_cli', '--no-version-check',
+        'agent', 'start', '--foreground', '--idle-timeout', str(idle_timeout),
+    ]
+    with open(log_path, 'ab') as log:
+        subprocess.Popen(
+            args, stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+            start_new_session=True, env={**os.environ, 'LAGER_AGENT_SOCKET': path},
+        )
+
+    deadline = time.monotonic() + _STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        status = agent_request({'type': 'status'}, path)
+        if status is not None:
+            click.echo(f'Agent started (pid {status["pid"]})')
+            return
+        time.sleep(0.05)
+    click.secho(f'Agent did not start; see {log_path}', fg='red', err=True)
+    click.get_current_context().exit(1)
+
+@agent.command()
+def stop():
+    """
+        Stop the agent
+    """
+    if agent_request({'type': 'stop'}) is None:
+        click.echo('Agent is not running')
+        return
+    click.echo('Agent stopped')
+
+@agent.command()
+def status():
+    """
+        Show whether the agent is running
+    """
+    reply = agent_request({'type': 'status'})
+    if reply is None:
+        click.echo('Agent is not running')
+        click.get_current_context().exit(1)
+    click.echo(f'pid: {reply["pid"]}')
+    click.echo(f'version: {reply["version"]}')
+    click.echo(f'uptime: {reply["uptime"]:.0f}s')
+    click.echo(f'invocations: {reply["invocations"]}')
+    click.echo(f'socket: {get_socket_path()}')
+    click.echo(f'forwarded commands: {describe_forwarded()}')
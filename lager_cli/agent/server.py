@@ -0,0 +1,231 @@
+"""
+    lager.agent.server
+
+    Long-lived process that runs forwarded CLI invocations with warm state
+"""
+import io
+import os
+import sys
+import time
+import socket
+import traceback
+import socketserver
+
+from .. import __version__
+from ..config import get_global_config_file_path
+from ..context import keep_sessions_warm, drop_warm_sessions
+from ..history.store import flush as flush_history
+from .client import send_message, receive_message, encode_output, decode_output
+
+# Environment that is baked into a LagerSession when it is created
+_SESSION_ENV_PREFIXES = ('LAGER_',)
+_SESSION_ENV_KEYS = ('NOVERIFY', 'CI', 'DRONE', 'GITHUB_RUN_ID', 'BITBUCKET_BUILD_NUMBER')
+
+
+def session_fingerprint(env):
+    """
+        Everything a warm session depends on: the config file holding the auth
+        tokens and defaults, and the environment the session was built from
+    """
+    try:
+        stat = os.stat(get_global_config_file_path())
+        config_stamp = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    except FileNotFoundError:
+        config_stamp = None
+    session_env = sorted(
+        (key, value) for key, value in env.items()
+        if key.startswith(_SESSION_ENV_PREFIXES) or key in _SESSION_ENV_KEYS
+    )
+    return (config_stamp, tuple(session_env))
+
+
+class _RemoteOutput(io.RawIOBase):
+    """
+        Raw stream that forwards writes to the client
+    """
+    def __init__(self, stream, name, isatty):
+        super().__init__()
+        self._stream = stream
+        self._name = name
+        self._isatty = isatty
+
+    def writable(self):
+        return True
+
+    def isatty(self):
+        return self._isatty
+
+    def write(self, b):
+        data = bytes(b)
+        send_message(self._stream, {'type': self._name, 'data': encode_output(data)})
+        return len(data)
+
+
+class _RemoteInput(io.RawIOBase):
+    """
+        Raw stream that asks the client for a line of its stdin on each read
+    """
+    def __init__(self, stream):
+        super().__init__()
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        send_message(self._stream, {'type': 'read', 'size': len(b)})
+        message = receive_message(self._stream)
+        if message is None or message['type'] != 'stdin':
+            return 0
+        data = decode_output(message['data'])[:len(b)]
+        b[:len(data)] = data
+        return len(data)
+
+
+def _text_stream(raw, writable):
+    if writable:
+        return io.TextIOWrapper(io.BufferedWriter(raw), encoding='utf-8', errors='surrogateescape',
+                                line_buffering=True, write_through=True)
+    return io.TextIOWrapper(io.BufferedReader(raw), encoding='utf-8', errors='surrogateescape')
+
+
+class AgentServer(socketserver.UnixStreamServer):
+    """
+        Serves one invocation at a time; commands share process-wide state
+        (cwd, environ, std streams), so they must not overlap.
+    """
+    def __init__(self, path, idle_timeout):
+        self.path = path
+        self.timeout = idle_timeout
+        self.started_at = time.time()
+        self.invocations = 0
+        self.fingerprint = None
+        self.stopping = False
+        old_umask = os.umask(0o077)
+        try:
+            super().__init__(path, AgentHandler)
+        finally:
+            os.umask(old_umask)
+
+    def handle_timeout(self):
+        self.stopping = True
+
+    def serve(self):
+        """
+            Handle requests until stopped or idle for `timeout` seconds
+        """
+        keep_sessions_warm()
+        try:
+            while not self.stopping:
+                self.handle_request()
+        finally:
+            drop_warm_sessions()
+            self.server_close()
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+    def status(self):
+        """
+            Summary for `lager agent status`
+        """
+        return {
+            'type': 'status',
+            'pid': os.getpid(),
+            'version': __version__,
+            'uptime': time.time() - self.started_at,
+            'invocations': self.invocations,
+        }
+
+    def check_fingerprint(self, env):
+        """
+            Drop warm sessions if the config file or session environment changed
+            since the last invocation finished
+        """
+        fingerprint = session_fingerprint(env)
+        if fingerprint != self.fingerprint:
+            drop_warm_sessions()
+        self.fingerprint = fingerprint
+
+    def run(self, request, stream):
+        """
+            Run one forwarded invocation with the client's argv, cwd, environment and streams
+        """
+        from ..cli import cli  # pylint: disable=import-outside-toplevel
+
+        saved = (os.getcwd(), dict(os.environ), sys.argv, sys.stdin, sys.stdout, sys.stderr)
+        code = 0
+        try:
+            os.chdir(request['cwd'])
+            os.environ.clear()
+            os.environ.update(request['env'])
+            self.check_fingerprint(os.environ)
+            sys.argv = ['lager', *request['argv']]
+            sys.stdin = _text_stream(_RemoteInput(stream), writable=False)
+            sys.stdout = _text_stream(_RemoteOutput(stream, 'stdout', request['isatty']['stdout']), writable=True)
+            sys.stderr = _text_stream(_RemoteOutput(stream, 'stderr', request['isatty']['stderr']), writable=True)
+            try:
+                cli.main(args=request['argv'], prog_name='lager')
+            except SystemExit as exc:
+                code = exc.code
+            except Exception:  # pylint: disable=broad-except
+                traceback.print_exc()
+                code = 1
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            self.fingerprint = session_fingerprint(os.environ)
+            cwd, environ, sys.argv, sys.stdin, sys.stdout, sys.stderr = saved
+            os.environ.clear()
+            os.environ.update(environ)
+            os.chdir(cwd)
+            self.invocations += 1
+            # Nothing else flushes the history before the agent is killed
+            flush_history()
+
+        if code is None:
+            code = 0
+        elif not isinstance(code, int):
+            send_message(stream, {'type': 'stderr', 'data': f'{code}\n'})
+            code = 1
+        send_message(stream, {'type': 'exit', 'code': code})
+
+
+class AgentHandler(socketserver.StreamRequestHandler):
+    """
+        One client connection
+    """
+    def handle(self):
+        stream = self.connection.makefile('rwb')
+        try:
+            request = receive_message(stream)
+            if request is None:
+                return
+            kind = request.get('type')
+            if kind == 'status':
+                send_message(stream, self.server.status())
+            elif kind == 'stop':
+                self.server.stopping = True
+                send_message(stream, {'type': 'stopping'})
+            elif kind == 'run':
+                if request.get('version') != __version__:
+                    # Client was upgraded; let it run in-process and retire this agent
+                    self.server.stopping = True
+                    send_message(stream, {'type': 'reject', 'reason': 'version'})
+                    return
+                self.server.run(request, stream)
+        except (BrokenPipeError, ConnectionResetError, socket.timeout):
+            pass
+        finally:
+            stream.close()
+
+
+def serve(path, idle_timeout):
+    """
+        Run the agent in the foreground until stopped or idle
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    AgentServer(path, idle_timeout).serve()
@@ -9,7 +9,6 @@ import json
 import time
 import datetime
 import urllib.parse
-import requests
 from ..config import read_config_file, write_config_file
 
 _DEFAULT_CLIENT_ID = 'N2NcC4UplFLlxiIPzDDa5K1PKbTrRVec'
@@ -30,6 +29,7 @@ def get_audience():
     return os.getenv('LAGER_AUDIENCE', _DEFAULT_AUDIENCE)
 
 def _get_jwks(jwk_url):
+    import requests  # pylint: disable=import-outside-toplevel
     resp = requests.get(jwk_url)
     resp.raise_for_status()
     return resp.json()
@@ -50,6 +50,7 @@ def _refresh(refresh_token):
         'refresh_token': refresh_token,
     }
     token_url = urllib.parse.urljoin(get_auth_url(), '/oauth/token')
+    import requests  # pylint: disable=import-outside-toplevel
     resp = requests.post(token_url, data=data)
     resp.raise_for_status()
     return resp.json()
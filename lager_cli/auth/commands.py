@@ -14,6 +14,7 @@ from . import (
     read_config_file, write_config_file,
 )
 from ..context import LagerContext
+from ..gateways import invalidate_gateway_cache
 
 SCOPE = 'read:gateway flash:duck offline_access'
 
@@ -94,6 +95,7 @@ def login(ctx):
         'refresh': payload['refresh_token'],
     }
     write_config_file(config)
+    invalidate_gateway_cache()
 
     ctx = LagerContext(
         ctx=ctx,
@@ -123,3 +125,4 @@ def logout():
         del config['AUTH']
 
     write_config_file(config)
+    invalidate_gateway_cache()
@@ -0,0 +1,170 @@
+"""
+    lager.batch.commands
+
+    Run many lager commands in one process
+"""
+import json
+import time
+import shlex
+import concurrent.futures
+import click
+from ..invoke import run_command
+
+# Commands that prompt, take over the terminal, run until interrupted or change credentials
+_NOT_BATCHABLE = frozenset((
+    'agent', 'batch', 'devenv', 'exec', 'gdbserver', 'login', 'logout', 'openocd', 'tunnel', 'uart',
+))
+_NOT_BATCHABLE_SUBCOMMANDS = {
+    'canbus': frozenset(('dump',)),
+}
+
+
+class Step:  # pylint: disable=too-few-public-methods
+    """
+        One command in a batch script
+    """
+    def __init__(self, index, argv, name=None, parallel=False):
+        self.index = index
+        self.argv = argv
+        self.name = name or ' '.join(argv)
+        self.parallel = parallel
+
+
+def _split(command):
+    argv = shlex.split(command) if isinstance(command, str) else [str(arg) for arg in command]
+    if argv and argv[0] == 'lager':
+        argv = argv[1:]
+    return argv
+
+def parse_lines(text):
+    """
+        One command per line; lines starting with `#` are comments. A trailing `&`
+        marks the step as parallel, i.e. it may run concurrently with adjacent
+        parallel steps.
+    """
+    steps = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parallel = line.endswith('&')
+        if parallel:
+            line = line[:-1].rstrip()
+        steps.append(Step(len(steps), _split(line), parallel=parallel))
+    return steps
+
+def parse_yaml(text):
+    """
+        Either a list of steps or a mapping with a `steps` list. A step is a command
+        string / argv list, or a mapping with `run` and optional `name` and `parallel`.
+    """
+    from ..util import yaml_safe_load  # pylint: disable=import-outside-toplevel
+
+    document = yaml_safe_load(text) or []
+    if isinstance(document, dict):
+        document = document.get('steps', [])
+    if not isinstance(document, list):
+        raise click.UsageError('Batch script must be a list of steps or contain a `steps` list')
+
+    steps = []
+    for entry in document:
+        if isinstance(entry, dict):
+            if 'run' not in entry:
+                raise click.UsageError(f'Step {len(steps) + 1} is missing `run`')
+            step = Step(len(steps), _split(entry['run']), entry.get('name'), bool(entry.get('parallel')))
+        else:
+            step = Step(len(steps), _split(entry))
+        steps.append(step)
+    return steps
+
+def group_steps(steps):
+    """
+        Split steps into stages: each run of consecutive parallel steps is one stage,
+        every other step is a stage of its own
+    """
+    stages = []
+    for step in steps:
+        if step.parallel and stages and stages[-1][0].parallel:
+            stages[-1].append(step)
+        else:
+            stages.append([step])
+    return stages
+
+def _validate(steps):
+    for step in steps:
+        if not step.argv:
+            raise click.UsageError(f'Step {step.index + 1} is empty')
+        command = step.argv[0]
+        if command in _NOT_BATCHABLE:
+            raise click.UsageError(f'Step {step.index + 1}: `lager {command}` cannot run in a batch')
+        subcommand = next((arg for arg in step.argv[1:] if not arg.startswith('-')), None)
+        if subcommand in _NOT_BATCHABLE_SUBCOMMANDS.get(command, ()):
+            raise click.UsageError(f'Step {step.index + 1}: `lager {command} {subcommand}` cannot run in a batch')
+
+def _step_result(step, result, batch_started):
+    output = result.as_dict()
+    output.update({
+        'index': step.index,
+        'name': step.name,
+        'parallel': step.parallel,
+        'start_ms': round((result.started - batch_started) * 1000, 3),
+    })
+    return output
+
+@click.command()
+@click.pass_context
+@click.argument('script', type=click.File('r'), default='-')
+@click.option('--format', 'format_', type=click.Choice(('auto', 'yaml', 'lines')), default='auto',
+              help='Script format. auto: YAML for .yaml/.yml files, one command per line otherwise')
+@click.option('--jobs', '-j', type=click.IntRange(min=1), default=8, show_default=True,
+              help='Maximum number of parallel steps running at once')
+@click.option('--keep-going', is_flag=True, default=False, help='Run remaining steps after a failure')
+@click.option('--output', 'output', type=click.File('w'), default='-', help='Write JSON results here')
+def batch(ctx, script, format_, jobs, keep_going, output):
+    """
+        Run a sequence of lager commands sharing one session
+
+        SCRIPT is a YAML file or a text file with one command per line (`-` for stdin).
+        Steps marked parallel run concurrently with adjacent parallel steps.
+        Per-step exit codes, output and timing are written as JSON.
+    """
+    if format_ == 'auto':
+        name = str(getattr(script, 'name', ''))
+        format_ = 'yaml' if name.endswith(('.yaml', '.yml')) else 'lines'
+    text = script.read()
+    steps = parse_yaml(text) if format_ == 'yaml' else parse_lines(text)
+    _validate(steps)
+
+    # Build the session up front so parallel steps share it instead of racing to create one.
+    # Steps only send requests through it, which is thread-safe (see invoke.run_command);
+    # with more than 10 jobs, urllib3 opens extra connections beyond its pool and closes them.
+    ctx.obj.session  # pylint: disable=pointless-statement
+
+    results = []
+    failed = False
+    batch_started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        for stage in group_steps(steps):
+            if failed and not keep_going:
+                break
+            if len(stage) == 1:
+                stage_results = [run_command(ctx, stage[0].argv)]
+            else:
+                futures = [executor.submit(run_command, ctx, step.argv) for step in stage]
+                stage_results = [future.result() for future in futures]
+            for step, result in zip(stage, stage_results):
+                results.append(_step_result(step, result, batch_started))
+                failed = failed or not result.ok
+
+    report = {
+        'duration_ms': round((time.perf_counter() - batch_started) * 1000, 3),
+        'steps': len(steps),
+        'completed': len(results),
+        'failed': sum(1 for result in results if result['exit_code'] != 0),
+        'results': results,
+    }
+    json.dump(report, output, indent=2)
+    output.write('\n')
+    output.flush()
+    if failed:
+        ctx.exit(1)
@@ -0,0 +1,5 @@
+"""
+    lager.bench
+
+    Offline benchmarks for lager-cli
+"""
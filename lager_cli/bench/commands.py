@@ -0,0 +1,19 @@
+"""
+    lager.bench.commands
+
+    Benchmark commands
+"""
+import click
+from ..cli import LazyGroup
+
+_BENCHMARKS = {
+    'load': ('.bench.load', 'load'),
+    'startup': ('.bench.startup', 'main'),
+    'tunnel': ('.bench.tunnel', 'main'),
+}
+
+@click.group(cls=LazyGroup, lazy_subcommands=_BENCHMARKS)
+def bench():
+    """
+        Benchmark lager-cli against a local mock API
+    """
@@ -0,0 +1,434 @@
+"""
+    lager.bench.load
+
+    Concurrent-client load generator.
+
+    Runs N simulated clients, each repeatedly running a mix of uart streams, python
+    runs and flashes against a Lager endpoint (by default a local mock API), and
+    reports throughput, tail latencies and per-client CPU and memory. Clients are
+    either separate `lager` processes, which is what a build host running many CI
+    jobs looks like, or trio tasks sharing one AsyncLagerClient process:
+
+        lager bench load --clients 16 --duration 30 --mix uart=2,python=1,flash=1
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+import itertools
+import click
+from texttable import Texttable
+from .mockapi import MockLagerAPI, python_output, text_lines
+from .process import isolated_environment, measure_command, max_rss_bytes
+from .stats import percentile
+
+WORKLOADS = ('uart', 'python', 'flash')
+MODES = ('subprocess', 'trio')
+DEFAULT_MIX = 'uart=1,python=1,flash=1'
+FLASH_ADDRESS = 0x08000000
+SERIAL_DEVICE = '/dev/ttyACM0'
+PYTHON_SCRIPT = b'print("hello from lager bench load")\n'
+PERCENTILES = (50, 95, 99)
+
+
+def parse_mix(value):
+    """
+        Parse 'uart=2,python=1' into {'uart': 2, 'python': 1}
+    """
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.strip().partition('=')
+        if name not in WORKLOADS:
+            raise ValueError(f'Unknown workload {name!r}; expected one of {", ".join(WORKLOADS)}')
+        try:
+            mix[name] = int(weight or 1)
+        except ValueError:
+            raise ValueError(f'Invalid weight for {name}: {weight!r}') from None
+        if mix[name] < 0:
+            raise ValueError(f'Invalid weight for {name}: {weight!r}')
+    if not any(mix.values()):
+        raise ValueError('At least one workload needs a positive weight')
+    return mix
+
+def schedule(mix, client_index):
+    """
+        Endless sequence of workloads for one client. Every client cycles through the
+        same weighted order, starting at a different offset so that the mix is spread
+        across clients from the first operation.
+    """
+    order = [name for name in WORKLOADS for _ in range(mix.get(name, 0))]
+    return itertools.islice(itertools.cycle(order), client_index % len(order), None)
+
+
+class Target:  # pylint: disable=too-few-public-methods
+    """
+        Endpoint under load: REST host, websocket host, auth token and gateway
+    """
+    def __init__(self, host, ws_host, token, gateway):
+        self.host = host
+        self.ws_host = ws_host
+        self.token = token
+        self.gateway = gateway
+
+    def env(self):
+        return {'LAGER_HOST': self.host, 'LAGER_WS_HOST': self.ws_host, 'LAGER_SECRET_TOKEN': self.token}
+
+
+class Operation:  # pylint: disable=too-few-public-methods
+    """
+        One completed workload run
+    """
+    def __init__(self, client, kind, started, elapsed, sent, received, error=None, cpu=None, rss=None):
+        self.client = client
+        self.kind = kind
+        self.started = started
+        self.elapsed = elapsed
+        self.sent = sent
+        self.received = received
+        self.error = error
+        self.cpu = cpu
+        self.rss = rss
+
+
+class _Budget:
+    """
+        Stop condition shared by all clients: a deadline and/or a per-client op count
+    """
+    def __init__(self, duration, iterations):
+        self.deadline = time.monotonic() + duration if duration else None
+        self.iterations = iterations
+
+    def more(self, done):
+        if self.iterations is not None and done >= self.iterations:
+            return False
+        return self.deadline is None or time.monotonic() < self.deadline
+
+
+def _write_fixtures(workdir, image_size):
+    script = os.path.join(workdir, 'script.py')
+    with open(script, 'wb') as f:
+        f.write(PYTHON_SCRIPT)
+    image = os.path.join(workdir, 'image.bin')
+    with open(image, 'wb') as f:
+        f.write(os.urandom(image_size))
+    return script, image
+
+
+def _uploaded(kind, image_size):
+    if kind == 'flash':
+        return image_size
+    if kind == 'python':
+        return len(PYTHON_SCRIPT)
+    return 0
+
+def _command(kind, target, script, image):
+    if kind == 'uart':
+        return ['uart', '--gateway', target.gateway, '--serial-device', SERIAL_DEVICE]
+    if kind == 'python':
+        return ['python', '--gateway', target.gateway, script]
+    # Always upload, so every flash moves the image like the trio clients do
+    return ['flash', '--gateway', target.gateway, '--binfile', f'{image},{hex(FLASH_ADDRESS)}', '--always-upload']
+
+def _run_subprocess_client(index, target, mix, budget, env, script, image, record):  # pylint: disable=too-many-arguments
+    done = 0
+    for kind in schedule(mix, index):
+        if not budget.more(done):
+            break
+        argv = [sys.executable, '-m', 'lager_cli', *_command(kind, target, script, image)]
+        started = time.monotonic()
+        result = measure_command(argv, env)
+        error = None
+        if result.exit_code != 0:
+            last_line = (result.stderr.strip().splitlines() or [''])[-1]
+            error = f'exit {result.exit_code}: {last_line}'
+        record(Operation(index, kind, started, result.elapsed, _uploaded(kind, os.path.getsize(image)),
+                         result.stdout_bytes, error, result.cpu, result.rss))
+        done += 1
+
+def run_subprocess_clients(target, clients, mix, budget, workdir, image_size):
+    """
+        One thread per client, each running `python -m lager_cli` commands back to back
+    """
+    env = isolated_environment(workdir, target.env())
+    script, image = _write_fixtures(workdir, image_size)
+    operations = []
+    lock = threading.Lock()
+
+    def record(operation):
+        with lock:
+            operations.append(operation)
+
+    threads = [
+        threading.Thread(target=_run_subprocess_client,
+                         args=(index, target, mix, budget, env, script, image, record), daemon=True)
+        for index in range(clients)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return operations
+
+
+async def _trio_uart(client, target):
+    import bson
+    import lager_trio_websocket as trio_websocket
+
+    resp = await client.uart_gateway(target.gateway, {'device': SERIAL_DEVICE, 'baudrate': 115200}, None)
+    job_id = resp.json()['test_run']['id']
+    uri = f'{target.ws_host}/ws/job/{job_id}'
+    headers = [(b'authorization', client.headers['Authorization'].encode())]
+    received = 0
+    async with trio_websocket.open_websocket_url(uri, extra_headers=headers, disconnect_timeout=1) as websocket:
+        try:
+            while True:
+                message = await websocket.get_message()
+                for item in bson.loads(message).get('data', []):
+                    received += len(item['entry']['payload'])
+        except trio_websocket.ConnectionClosed:
+            pass
+    return received
+
+async def _trio_stream(resp):
+    received = 0
+    async for chunk in resp.aiter_bytes():
+        received += len(chunk)
+    return received
+
+async def _trio_operation(client, kind, target, image):
+    if kind == 'uart':
+        return await _trio_uart(client, target)
+    if kind == 'python':
+        files = [
+            ('image', ''), ('stdout_is_stderr', False), ('detach', '0'),
+            ('script', ('script.py', PYTHON_SCRIPT)),
+        ]
+        return await _trio_stream(await client.run_python(target.gateway, files=files))
+    files = [
+        ('binfile', ('image.bin', image)), ('binfile_address', hex(FLASH_ADDRESS)),
+        ('preverify', False), ('verify', False), ('force', False),
+    ]
+    return await _trio_stream(await client.flash_dut(target.gateway, files=files))
+
+async def _run_trio_client(index, target, mix, budget, image, operations):
+    from ..client import AsyncLagerClient  # pylint: disable=import-outside-toplevel
+
+    done = 0
+    async with AsyncLagerClient({'type': 'secret', 'token': target.token}, host=target.host) as client:
+        for kind in schedule(mix, index):
+            if not budget.more(done):
+                break
+            started = time.monotonic()
+            error = None
+            received = 0
+            try:
+                received = await _trio_operation(client, kind, target, image)
+            except Exception as exc:  # pylint: disable=broad-except
+                error = f'{type(exc).__name__}: {exc}'
+            operations.append(Operation(index, kind, started, time.monotonic() - started,
+                                        _uploaded(kind, len(image)), received, error))
+            done += 1
+
+def run_trio_clients(target, clients, mix, budget, image_size):
+    """
+        One trio task per client, all in this process. CPU and memory can only be
+        measured for the process as a whole, so per-client figures are left empty.
+    """
+    import trio
+
+    image = os.urandom(image_size)
+    operations = []
+
+    async def main():
+        async with trio.open_nursery() as nursery:
+            for index in range(clients):
+                nursery.start_soon(_run_trio_client, index, target, mix, budget, image, operations)
+
+    trio.run(main)
+    return operations
+
+
+def _latencies(operations):
+    elapsed = [op.elapsed for op in operations if op.error is None]
+    summary = {f'p{pct}_ms': percentile(elapsed, pct) * 1000 if elapsed else None for pct in PERCENTILES}
+    summary['max_ms'] = max(elapsed) * 1000 if elapsed else None
+    return summary
+
+def build_report(operations, mode, clients, mix, wall, process_cpu, process_rss):
+    """
+        Aggregate operations into throughput, per-workload latency and per-client figures
+    """
+    ok = [op for op in operations if op.error is None]
+    transferred = sum(op.sent + op.received for op in ok)
+    workloads = {}
+    for kind in WORKLOADS:
+        of_kind = [op for op in operations if op.kind == kind]
+        if of_kind:
+            workloads[kind] = {
+                'ops': len(of_kind),
+                'errors': sum(op.error is not None for op in of_kind),
+                'sent_mb': sum(op.sent for op in of_kind) / 2 ** 20,
+                'received_mb': sum(op.received for op in of_kind) / 2 ** 20,
+                **_latencies(of_kind),
+            }
+
+    per_client = []
+    for index in range(clients):
+        mine = [op for op in operations if op.client == index]
+        cpu = [op.cpu for op in mine if op.cpu is not None]
+        rss = [op.rss for op in mine if op.rss is not None]
+        per_client.append({
+            'client': index,
+            'ops': len(mine),
+            'errors': sum(op.error is not None for op in mine),
+            'cpu_s': sum(cpu) if cpu else None,
+            'peak_rss_mb': max(rss) / 2 ** 20 if rss else None,
+            **_latencies(mine),
+        })
+
+    errors = [op for op in operations if op.error is not None]
+    return {
+        'mode': mode,
+        'clients': clients,
+        'mix': mix,
+        'wall_s': wall,
+        'ops': len(operations),
+        'errors': len(errors),
+        'error_samples': sorted({op.error for op in errors})[:5],
+        'ops_per_s': len(ok) / wall if wall else 0,
+        'mb_per_s': transferred / 2 ** 20 / wall if wall else 0,
+        'process': {'cpu_s': process_cpu, 'peak_rss_mb': process_rss / 2 ** 20 if process_rss else None},
+        'workloads': workloads,
+        'per_client': per_client,
+    }
+
+def run_load(target, clients=8, mix=None, duration=None, iterations=None, mode='subprocess', image_size=64 * 1024):
+    """
+        Run the load and return the report. Stops when `duration` seconds have passed
+        or every client has run `iterations` operations, whichever comes first.
+    """
+    mix = mix or parse_mix(DEFAULT_MIX)
+    budget = _Budget(duration, iterations)
+    cpu_before = time.process_time()
+    started = time.monotonic()
+    if mode == 'trio':
+        operations = run_trio_clients(target, clients, mix, budget, image_size)
+    else:
+        with tempfile.TemporaryDirectory(prefix='lager-load-') as workdir:
+            operations = run_subprocess_clients(target, clients, mix, budget, workdir, image_size)
+    wall = time.monotonic() - started
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+        process_rss = max_rss_bytes(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    except ImportError:
+        process_rss = None
+    return build_report(operations, mode, clients, mix, wall, time.process_time() - cpu_before, process_rss)
+
+
+def _ms(value):
+    return '-' if value is None else f'{value:.1f}'
+
+def _mb(value):
+    return '-' if value is None else f'{value:.1f}'
+
+def render_report(report):
+    """
+        Render a load report as text tables
+    """
+    lines = [
+        f'{report["clients"]} {report["mode"]} clients, {report["wall_s"]:.1f}s: '
+        f'{report["ops"]} ops, {report["errors"]} errors, '
+        f'{report["ops_per_s"]:.2f} ops/s, {report["mb_per_s"]:.2f} MB/s',
+        f'load generator: {report["process"]["cpu_s"]:.2f}s CPU, {_mb(report["process"]["peak_rss_mb"])} MB peak RSS',
+        '',
+    ]
+
+    table = Texttable(max_width=0)
+    table.set_deco(Texttable.HEADER)
+    table.set_cols_dtype(['t'] * 9)
+    table.set_cols_align(['l', 'r', 'r', 'r', 'r', 'r', 'r', 'r', 'r'])
+    table.add_row(['workload', 'ops', 'errors', 'sent MB', 'received MB', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'])
+    for kind, stats in report['workloads'].items():
+        table.add_row([kind, stats['ops'], stats['errors'], f'{stats["sent_mb"]:.3f}', f'{stats["received_mb"]:.3f}',
+                       _ms(stats['p50_ms']),
+                       _ms(stats['p95_ms']), _ms(stats['p99_ms']), _ms(stats['max_ms'])])
+    lines.extend([table.draw(), ''])
+
+    table = Texttable(max_width=0)
+    table.set_deco(Texttable.HEADER)
+    table.set_cols_dtype(['t'] * 6)
+    table.set_cols_align(['r', 'r', 'r', 'r', 'r', 'r'])
+    table.add_row(['client', 'ops', 'errors', 'CPU s', 'peak RSS MB', 'p99 ms'])
+    for client in report['per_client']:
+        table.add_row([
+            client['client'], client['ops'], client['errors'],
+            '-' if client['cpu_s'] is None else f'{client["cpu_s"]:.2f}',
+            _mb(client['peak_rss_mb']),
+            _ms(client['p99_ms']),
+        ])
+    lines.append(table.draw())
+
+    for sample in report['error_samples']:
+        lines.append(f'error: {sample}')
+    return '\n'.join(lines)
+
+
+def _parse_mix_option(_ctx, _param, value):
+    try:
+        return parse_mix(value)
+    except ValueError as exc:
+        raise click.BadParameter(str(exc))
+
+@click.command()
+@click.option('--clients', type=click.IntRange(min=1), default=8, show_default=True, help='Number of simulated clients')
+@click.option('--duration', type=click.FLOAT, help='Seconds to run for. Default: 10 unless --iterations is given')
+@click.option('--iterations', type=click.IntRange(min=1), help='Operations per client')
+@click.option('--mix', default=DEFAULT_MIX, show_default=True, callback=_parse_mix_option,
+              help='Relative weights of the uart, python and flash workloads')
+@click.option('--mode', type=click.Choice(MODES), default='subprocess', show_default=True,
+              help='Run each client as `lager` processes or as trio tasks in one process')
+@click.option('--host', help='Lager API to load. Default: start a local mock API')
+@click.option('--ws-host', help='Websocket host of the API given with --host')
+@click.option('--token', envvar='LAGER_SECRET_TOKEN', help='Secret token for --host')
+@click.option('--gateway', default='mock-gateway', show_default=True, help='Gateway to run workloads on')
+@click.option('--latency', type=click.FLOAT, default=0.0, show_default=True, help='Mock API latency in seconds')
+@click.option('--bandwidth', type=click.INT, help='Mock API bandwidth in bytes per second')
+@click.option('--lines', type=click.IntRange(min=1), default=200, show_default=True,
+              help='Lines of mock output per uart stream and python run')
+@click.option('--image-size', type=click.IntRange(min=0), default=64 * 1024, show_default=True,
+              help='Size of the flashed image in bytes')
+@click.option('--json-output', type=click.Path(dir_okay=False, writable=True), help='Also write results as JSON to this file')
+def load(clients, duration, iterations, mix, mode, host, ws_host, token, gateway, latency, bandwidth, lines,
+         image_size, json_output):
+    """
+        Run concurrent simulated clients against a Lager API
+    """
+    if duration is None and iterations is None:
+        duration = 10.0
+
+    if host:
+        if not ws_host or not token:
+            raise click.UsageError('--ws-host and --token are required with --host')
+        report = run_load(Target(host, ws_host, token, gateway), clients, mix, duration, iterations, mode, image_size)
+    else:
+        api = MockLagerAPI(
+            latency=latency, bandwidth=bandwidth,
+            python_output_factory=lambda: python_output(stdout=text_lines(lines, prefix='stdout')),
+            job_output_factory=lambda: text_lines(lines),
+        )
+        with api:
+            env = api.env()
+            target = Target(env['LAGER_HOST'], env['LAGER_WS_HOST'], env['LAGER_SECRET_TOKEN'], gateway)
+            report = run_load(target, clients, mix, duration, iterations, mode, image_size)
+
+    click.echo(render_report(report))
+    if json_output:
+        with open(json_output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if report['errors']:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    load()  # pylint: disable=no-value-for-parameter
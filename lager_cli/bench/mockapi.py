@@ -0,0 +1,539 @@
+"""
+    lager.bench.mockapi
+
+    A local stand-in for the Lager API and its websockets, for offline integration tests
+    and benchmarks. It answers the ``gateway/*`` REST endpoints, streams ``run-python``
+    output in the v1 framed format, serves BSON job output on ``/ws/job/<id>`` and a
+    gdbserver stub on the gdb-tunnel and tunnel-mux websockets. Latency, bandwidth and
+    the streamed payloads are configurable.
+
+    Point the CLI at it with LAGER_HOST and LAGER_WS_HOST:
+
+        with MockLagerAPI(latency=0.02) as api:
+            subprocess.run(['lager', 'gpio', 'output', '3', 'HIGH'], env={**os.environ, **api.env()})
+
+    or run it standalone and export the variables it prints:
+
+        python -m lager_cli.bench.mockapi --latency 0.05
+"""
+import re
+import json
+import time
+import hashlib
+import urllib.parse
+import random
+import itertools
+import threading
+import http.server
+import click
+import trio
+import bson
+import lager_trio_websocket as trio_websocket
+from ..gdbserver.mux import MuxConnection
+from .rsp import GdbserverStub
+
+DEFAULT_GATEWAYS = (
+    {'id': 1, 'name': 'mock-gateway'},
+    {'id': 2, 'name': 'mock-gateway-2'},
+)
+
+STDOUT_FILENO = 1
+STDERR_FILENO = 2
+OUTPUT_CHANNEL_FILENO = 3
+
+_LOOPBACK = '127.0.0.1'
+_GATEWAY_PATH = re.compile(r'^/api/v1/gateway/(?P<gateway>[^/]+)/(?P<action>[^?]+)')
+_JOB_PATH = re.compile(r'^/ws/job/(?P<job_id>[^/?]+)')
+
+
+# Payload generators. Each returns an iterable of chunks, so large payloads are
+# produced lazily while they are streamed.
+
+def text_lines(count=10, width=64, prefix='line'):
+    """
+        `count` lines of text, each `width` bytes including the newline
+    """
+    for i in range(count):
+        line = f'{prefix} {i} '
+        yield (line + 'x' * max(width - len(line) - 1, 0) + '\n').encode()
+
+def random_bytes(total, chunk_size=4096, seed=0):
+    """
+        `total` pseudo-random bytes in chunks of `chunk_size`
+    """
+    rng = random.Random(seed)
+    sent = 0
+    while sent < total:
+        size = min(chunk_size, total - sent)
+        yield rng.getrandbits(size * 8).to_bytes(size, 'little')
+        sent += size
+
+def unity_output(passed=3, failed=0, ignored=0):
+    """
+        Results in the format printed by the Unity test framework
+    """
+    results = ['PASS'] * passed + ['FAIL: Expected 1 Was 0'] * failed + ['IGNORE'] * ignored
+    for i, result in enumerate(results):
+        yield f'test/test_main.c:{10 + i}:test_case_{i}:{result}\n'.encode()
+    yield b'\n-----------------------\n'
+    yield f'{len(results)} Tests {failed} Failures {ignored} Ignored\n'.encode()
+    yield b'FAIL\n' if failed else b'OK\n'
+
+def flash_log(size=64 * 1024, step=8 * 1024):
+    """
+        Progress lines resembling a flash programming log for an image of `size` bytes
+    """
+    yield b'Erasing flash\n'
+    for written in range(step, size + step, step):
+        yield f'Programming: {min(written, size)}/{size} bytes\n'.encode()
+    yield b'Verified OK\n'
+
+def python_output(stdout=None, stderr=None, exit_code=0):
+    """
+        Frames of a `lager python` run: (fileno, chunk) pairs followed by the exit code
+    """
+    for chunk in stdout if stdout is not None else text_lines(3, prefix='stdout'):
+        yield STDOUT_FILENO, chunk
+    for chunk in stderr or ():
+        yield STDERR_FILENO, chunk
+    yield None, str(exit_code).encode()
+
+def encode_python_frame(fileno, chunk):
+    """
+        Encode one frame of the v1 run-python stream; fileno None is the exit code
+    """
+    marker = b'-' if fileno is None else str(fileno).encode()
+    return marker + b' ' + str(len(chunk)).encode() + b' ' + chunk
+
+
+class Link:
+    """
+        One-way delay and bandwidth applied to everything the mock sends or receives
+    """
+    def __init__(self, latency=0.0, bandwidth=None, chunk_size=16 * 1024):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.chunk_size = chunk_size
+
+    def pace(self, started, transferred):
+        """
+            Seconds to wait so that `transferred` bytes since `started` stay within bandwidth
+        """
+        if not self.bandwidth:
+            return 0
+        return max(started + transferred / self.bandwidth - time.monotonic(), 0)
+
+
+class RecordedRequest:  # pylint: disable=too-few-public-methods
+    """
+        A request received by the mock
+    """
+    def __init__(self, method, path, headers, body):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+    def query(self):
+        """
+            Query string parameters, as {name: [values]}
+        """
+        return urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+
+    def form(self):
+        """
+            multipart/form-data fields in order, as [(name, bytes)]
+        """
+        from requests_toolbelt.multipart.decoder import MultipartDecoder  # pylint: disable=import-outside-toplevel
+
+        content_type = self.headers.get('Content-Type', '')
+        if not content_type.startswith('multipart/form-data'):
+            return []
+        fields = []
+        for part in MultipartDecoder(self.body, content_type).parts:
+            disposition = part.headers[b'Content-Disposition'].decode()
+            name = re.search(r'name="([^"]*)"', disposition).group(1)
+            fields.append((name, part.content))
+        return fields
+
+
+class Reply:  # pylint: disable=too-few-public-methods
+    """
+        A route handler's response. `body` may be bytes, a JSON-serializable dict/list,
+        or an iterable of byte chunks, which is streamed with chunked encoding.
+    """
+    def __init__(self, body=b'', status=200, headers=None):
+        self.body = body
+        self.status = status
+        self.headers = headers or {}
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MockLagerAPI'
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def _read_body(self):
+        link = self.server.api.link
+        started = time.monotonic()
+        body = bytearray()
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                body += self.rfile.read(size)
+                self.rfile.readline()
+                time.sleep(link.pace(started, len(body)))
+                if size == 0:
+                    break
+        else:
+            remaining = int(self.headers.get('Content-Length', 0))
+            while remaining:
+                chunk = self.rfile.read(min(remaining, link.chunk_size))
+                if not chunk:
+                    break
+                body += chunk
+                remaining -= len(chunk)
+                time.sleep(link.pace(started, len(body)))
+        return bytes(body)
+
+    def _write(self, data, started, sent):
+        link = self.server.api.link
+        for offset in range(0, len(data), link.chunk_size):
+            piece = data[offset:offset + link.chunk_size]
+            self.wfile.write(piece)
+            sent += len(piece)
+            time.sleep(link.pace(started, sent))
+        return sent
+
+    def _send(self, reply):
+        body = reply.body
+        headers = dict(reply.headers)
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+            headers.setdefault('Content-Type', 'application/json')
+        self.send_response(reply.status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+
+        started = time.monotonic()
+        if isinstance(body, bytes):
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self._write(body, started, 0)
+            return
+
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        sent = 0
+        for chunk in body:
+            if chunk:
+                self.wfile.write(f'{len(chunk):x}\r\n'.encode())
+                sent = self._write(chunk, started, sent)
+                self.wfile.write(b'\r\n')
+                self.wfile.flush()
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _dispatch(self, method):
+        api = self.server.api
+        body = self._read_body()
+        request = RecordedRequest(method, self.path, dict(self.headers), body)
+        api.record(request)
+        time.sleep(api.link.latency)
+        self._send(api.handle(request))
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self._dispatch('GET')
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        self._dispatch('POST')
+
+
+async def _gdbserver_stream(stream, _remote_port):
+    """
+        Gateway side of one multiplexed tunnel stream: a gdbserver stub per stream
+    """
+    stub = GdbserverStub()
+    async for data in stream:
+        reply = stub.feed(data)
+        if reply:
+            await stream.send_all(reply)
+
+
+class MockLagerAPI:
+    """
+        REST server (threads) plus websocket server (trio) standing in for the Lager API.
+
+        Routes are keyed by (method, action), where action is the part of the path after
+        ``gateway/<gateway>/``, and can be replaced through `routes`. Handlers take
+        (mock, gateway, request) and return a Reply. The payload factories are called
+        once per request to produce the streamed output.
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, gateways=DEFAULT_GATEWAYS, latency=0.0, bandwidth=None, *,
+                 python_output_factory=python_output, job_output_factory=text_lines,
+                 flash_output_factory=flash_log, host=_LOOPBACK, port=0, ws_port=0):
+        self.gateways = [dict(gateway) for gateway in gateways]
+        self.link = Link(latency, bandwidth)
+        self.python_output_factory = python_output_factory
+        self.job_output_factory = job_output_factory
+        self.flash_output_factory = flash_output_factory
+        self.routes = dict(DEFAULT_ROUTES)
+        self.requests = []
+        self.jobs = {}
+        self.blobs = {}
+        self.host = host
+        self.port = port
+        self._ws_port = ws_port
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._http_server = None
+        self._http_thread = None
+        self._ws_thread = None
+        self._trio_token = None
+        self._cancel_scope = None
+
+    @property
+    def url(self):
+        host, port = self._http_server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def ws_url(self):
+        return f'ws://{self.host}:{self._ws_port}'
+
+    def env(self):
+        """
+            Environment variables that point lager at this server
+        """
+        return {'LAGER_HOST': self.url, 'LAGER_WS_HOST': self.ws_url, 'LAGER_SECRET_TOKEN': 'mock-token'}
+
+    def has_gateway(self, gateway):
+        return self.gateway_id(gateway) is not None
+
+    def gateway_id(self, gateway):
+        """
+            Id (as a string) of the gateway with id or name `gateway`, or None
+        """
+        for entry in self.gateways:
+            if gateway in (str(entry['id']), entry['name']):
+                return str(entry['id'])
+        return None
+
+    def gateway_blobs(self, gateway):
+        """
+            {sha256: bytes} of the images stored on `gateway`
+        """
+        with self._lock:
+            return self.blobs.setdefault(self.gateway_id(gateway), {})
+
+    def record(self, request):
+        with self._lock:
+            self.requests.append(request)
+
+    def create_job(self, output):
+        """
+            Register a job whose websocket will stream `output` (an iterable of bytes)
+        """
+        with self._lock:
+            job_id = str(next(self._job_ids))
+            self.jobs[job_id] = output
+        return job_id
+
+    def handle(self, request):
+        """
+            Route a REST request to its handler
+        """
+        path = request.path.split('?')[0]
+        if path == '/api/v1/gateway/list':
+            return Reply({'gateways': list(self.gateways)})
+        match = _GATEWAY_PATH.match(path)
+        if not match:
+            return Reply({}, status=404)
+        gateway = match.group('gateway')
+        if not self.has_gateway(gateway):
+            return Reply({}, status=404)
+        handler = self.routes.get((request.method, match.group('action')))
+        if handler is None:
+            return Reply({})
+        return handler(self, gateway, request)
+
+    async def _send_paced(self, websocket, message, started, sent):
+        await websocket.send_message(message)
+        sent += len(message)
+        await trio.sleep(self.link.pace(started, sent))
+        return sent
+
+    async def _serve_job(self, websocket, job_id):
+        output = self.jobs.pop(job_id)
+        started = time.monotonic()
+        sent = 0
+        for chunk in output:
+            await trio.sleep(self.link.latency)
+            message = bson.dumps({'data': [{'entry': {'payload': chunk}}]})
+            sent = await self._send_paced(websocket, message, started, sent)
+        await websocket.aclose(reason='EOF')
+
+    async def _serve_gdbserver(self, websocket):
+        stub = GdbserverStub()
+        started = time.monotonic()
+        sent = 0
+        try:
+            while True:
+                message = await websocket.get_message()
+                reply = stub.feed(message)
+                if reply:
+                    await trio.sleep(self.link.latency)
+                    sent = await self._send_paced(websocket, reply, started, sent)
+        except trio_websocket.ConnectionClosed:
+            pass
+
+    async def handle_websocket(self, request):
+        """
+            serve_websocket handler for job output, gdb-tunnel and tunnel-mux websockets
+        """
+        path = request.path
+        job = _JOB_PATH.match(path)
+        if job and job.group('job_id') not in self.jobs:
+            await request.reject(404)
+            return
+        websocket = await request.accept()
+        if job:
+            await self._serve_job(websocket, job.group('job_id'))
+        elif path.endswith('/tunnel-mux'):
+            await MuxConnection(websocket, accept_handler=_gdbserver_stream).run()
+        elif '/gdb-tunnel/' in path:
+            await self._serve_gdbserver(websocket)
+        else:
+            await websocket.aclose(code=4004, reason='Not found')
+
+    async def serve_websockets(self, port=0, *, task_status=trio.TASK_STATUS_IGNORED):
+        """
+            Run the websocket server in the current trio run
+        """
+        async with trio.open_nursery() as nursery:
+            server = await nursery.start(
+                trio_websocket.serve_websocket, self.handle_websocket, self.host, port, None,
+            )
+            self._ws_port = server.port
+            task_status.started(server)
+
+    def _run_websockets(self, started):
+        async def main():
+            self._trio_token = trio.lowlevel.current_trio_token()
+            with trio.CancelScope() as cancel_scope:
+                self._cancel_scope = cancel_scope
+                async with trio.open_nursery() as nursery:
+                    await nursery.start(self.serve_websockets, self._ws_port)
+                    started.set()
+        trio.run(main)
+
+    def start(self):
+        self._http_server = http.server.ThreadingHTTPServer((self.host, self.port), _Handler)
+        self._http_server.daemon_threads = True
+        self._http_server.api = self
+        self._http_thread = threading.Thread(target=self._http_server.serve_forever, daemon=True)
+        self._http_thread.start()
+
+        started = threading.Event()
+        self._ws_thread = threading.Thread(target=self._run_websockets, args=(started,), daemon=True)
+        self._ws_thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        self._http_server.shutdown()
+        self._http_server.server_close()
+        self._trio_token.run_sync_soon(self._cancel_scope.cancel)
+        self._ws_thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _json(body, status=200):
+    return lambda mock, gateway, request: Reply(body, status)
+
+def _run_python(mock, gateway, request):
+    frames = (encode_python_frame(fileno, chunk) for fileno, chunk in mock.python_output_factory())
+    return Reply(frames, headers={'Lager-Output-Version': '1'})
+
+def _error(code, description):
+    return Reply({'error': {'code': code, 'description': description}}, status=422)
+
+def _stream_flash(mock, gateway, request):
+    blobs = mock.gateway_blobs(gateway)
+    for name, value in request.form():
+        if name.endswith('_sha256') and value.decode() not in blobs:
+            return _error('blob_not_found', f'No image with sha256 {value.decode()} on gateway')
+    return Reply(mock.flash_output_factory(), headers={'Content-Type': 'text/plain'})
+
+def _query_blobs(mock, gateway, request):
+    blobs = mock.gateway_blobs(gateway)
+    return Reply({'present': [digest for digest in request.json()['sha256'] if digest in blobs]})
+
+def _store_blob(mock, gateway, request):
+    digest = request.query()['sha256'][0]
+    if hashlib.sha256(request.body).hexdigest() != digest:
+        return _error('blob_digest_mismatch', f'Image does not match sha256 {digest}')
+    mock.gateway_blobs(gateway)[digest] = request.body
+    return Reply({'sha256': digest, 'size': len(request.body)})
+
+def _start_job(mock, gateway, request):
+    return Reply({'test_run': {'id': mock.create_job(mock.job_output_factory())}})
+
+DEFAULT_ROUTES = {
+    ('GET', 'hello'): lambda mock, gateway, request: Reply(f'Hello from gateway {gateway}\n'.encode()),
+    ('GET', 'status'): _json({'running': False, 'cmdline': '', 'logfile': ''}),
+    ('GET', 'serial-ports'): _json({'serial_ports': [
+        {'device': '/dev/ttyACM0', 'description': 'Mock debug probe'},
+    ]}),
+    ('GET', 'serial-numbers'): _json({'devices': [
+        {'vendor': 'Mock', 'model': 'probe', 'serial': '0001'},
+    ]}),
+    ('POST', 'gpio/input'): _json({'level': 0}),
+    ('POST', 'adc/read'): _json({'value': 1.65}),
+    ('POST', 'reset-duck'): lambda mock, gateway, request: Reply(b'Reset complete\n'),
+    ('POST', 'run-duck'): lambda mock, gateway, request: Reply(b'Running\n'),
+    ('POST', 'flash-duck'): _stream_flash,
+    ('POST', 'erase-duck'): _stream_flash,
+    ('POST', 'blobs/query'): _query_blobs,
+    ('POST', 'blobs'): _store_blob,
+    ('POST', 'run-python'): _run_python,
+    ('POST', 'uart-duck'): _start_job,
+    ('POST', 'canbus/dump'): _start_job,
+}
+
+
+@click.command()
+@click.option('--port', type=click.INT, default=0, help='REST port (LAGER_HOST). Default: any free port')
+@click.option('--ws-port', type=click.INT, default=0, help='Websocket port (LAGER_WS_HOST). Default: any free port')
+@click.option('--latency', type=click.FLOAT, default=0.0, show_default=True, help='Seconds added to each response and message')
+@click.option('--bandwidth', type=click.INT, help='Bytes per second for request and response bodies')
+@click.option('--lines', type=click.INT, default=10, show_default=True, help='Lines of output per job and python run')
+def main(port, ws_port, latency, bandwidth, lines):
+    """
+        Run the mock Lager API until interrupted
+    """
+    api = MockLagerAPI(
+        latency=latency, bandwidth=bandwidth, port=port, ws_port=ws_port,
+        python_output_factory=lambda: python_output(stdout=text_lines(lines, prefix='stdout')),
+        job_output_factory=lambda: text_lines(lines),
+    )
+    with api:
+        for name, value in api.env().items():
+            click.echo(f'export {name}={value}')
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,93 @@
+"""
+    lager.bench.process
+
+    Run a command and measure its wall time, CPU time, peak RSS and output size
+"""
+import os
+import sys
+import json
+import time
+import subprocess
+
+# Runs the command given in argv and prints its measurements as JSON. A child's peak
+# RSS includes the memory of the process it was forked from, so commands are started
+# from this small interpreter rather than from a (possibly large) benchmark process.
+_MEASURE_WRAPPER = """
+import os, sys, json, time, subprocess
+started = time.perf_counter()
+proc = subprocess.Popen(sys.argv[1:], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+stdout_bytes = 0
+while True:
+    chunk = proc.stdout.read1(65536)
+    if not chunk:
+        break
+    stdout_bytes += len(chunk)
+_pid, status, rusage = os.wait4(proc.pid, 0)
+print(json.dumps({
+    'exit_code': os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status),
+    'elapsed': time.perf_counter() - started,
+    'cpu': rusage.ru_utime + rusage.ru_stime,
+    'ru_maxrss': rusage.ru_maxrss,
+    'stdout_bytes': stdout_bytes,
+}))
+"""
+
+
+class ProcessResult:  # pylint: disable=too-few-public-methods
+    """
+        Measurements of one finished command. `cpu` and `rss` are None where the
+        platform can't report them.
+    """
+    def __init__(self, exit_code, elapsed, cpu, rss, stdout_bytes, stderr):
+        self.exit_code = exit_code
+        self.elapsed = elapsed
+        self.cpu = cpu
+        self.rss = rss
+        self.stdout_bytes = stdout_bytes
+        self.stderr = stderr
+
+
+def isolated_environment(workdir, overrides=None):
+    """
+        Environment for running lager against a test endpoint: the current environment
+        without any LAGER_ settings, with config and caches in `workdir`, plus `overrides`
+    """
+    env = {
+        key: value for key, value in os.environ.items()
+        if not key.startswith('LAGER_') and key not in ('PYTHONPYCACHEPREFIX', 'PYTHONDONTWRITEBYTECODE')
+    }
+    env.update(overrides or {})
+    env.update({
+        'LAGER_CONFIG_FILE_DIR': workdir,
+        'LAGER_CACHE_DIR': os.path.join(workdir, 'cache'),
+        'LAGER_NO_AGENT': '1',
+        'LAGER_NO_VERSION_CHECK': '1',
+    })
+    return env
+
+
+def max_rss_bytes(ru_maxrss):
+    """
+        Convert getrusage's ru_maxrss to bytes: it is kilobytes on Linux and bytes on macOS
+    """
+    if sys.platform == 'darwin':
+        return ru_maxrss
+    return ru_maxrss * 1024
+
+def measure_command(args, env=None):
+    """
+        Run `args` to completion with stdin closed, counting (and discarding) its stdout
+        and capturing its stderr
+    """
+    if not hasattr(os, 'wait4'):
+        started = time.perf_counter()
+        proc = subprocess.run(args, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE, check=False)
+        return ProcessResult(proc.returncode, time.perf_counter() - started, None, None,
+                             len(proc.stdout), proc.stderr.decode(errors='replace'))
+
+    proc = subprocess.run([sys.executable, '-S', '-c', _MEASURE_WRAPPER, *args], env=env,
+                          stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    stats = json.loads(proc.stdout)
+    return ProcessResult(stats['exit_code'], stats['elapsed'], stats['cpu'], max_rss_bytes(stats['ru_maxrss']),
+                         stats['stdout_bytes'], proc.stderr.decode(errors='replace'))
@@ -0,0 +1,125 @@
+"""
+    lager.bench.rsp
+
+    Minimal GDB remote serial protocol (RSP) framing and a stub gdbserver
+"""
+import collections
+
+_ESCAPE = ord('}')
+_NEEDS_ESCAPE = frozenset(b'#$}*')
+
+def checksum(payload):
+    """
+        RSP checksum: modulo 256 sum of payload bytes
+    """
+    return sum(payload) & 0xff
+
+def make_packet(payload):
+    """
+        Frame a payload as an RSP packet: $<payload>#<checksum>
+    """
+    return b'$' + payload + b'#' + b'%02x' % checksum(payload)
+
+def escape_binary(data):
+    """
+        Escape binary data for use in X / vFlashWrite packets
+    """
+    if not _NEEDS_ESCAPE.intersection(data):
+        return data
+    out = bytearray()
+    for byte in data:
+        if byte in _NEEDS_ESCAPE:
+            out.append(_ESCAPE)
+            out.append(byte ^ 0x20)
+        else:
+            out.append(byte)
+    return bytes(out)
+
+class PacketParser:
+    """
+        Incremental RSP packet parser. Acks (+/-) and interrupts are discarded.
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """
+            Feed raw bytes, return a list of complete packet payloads
+        """
+        self._buffer += data
+        payloads = []
+        while True:
+            start = self._buffer.find(b'$')
+            if start == -1:
+                self._buffer.clear()
+                break
+            end = self._buffer.find(b'#', start)
+            if end == -1 or len(self._buffer) < end + 3:
+                del self._buffer[:start]
+                break
+            payloads.append(bytes(self._buffer[start + 1:end]))
+            del self._buffer[:end + 3]
+        return payloads
+
+class GdbserverStub:
+    """
+        Answers the subset of RSP used by the tunnel benchmarks, the way a gdbserver
+        attached to a halted target would.
+    """
+    _PATTERN = bytes(range(256))
+
+    def __init__(self):
+        self.parser = PacketParser()
+        self._memory_cache = {}
+
+    def _memory(self, length):
+        if length not in self._memory_cache:
+            repeats, remainder = divmod(length, len(self._PATTERN))
+            self._memory_cache[length] = (self._PATTERN * repeats + self._PATTERN[:remainder]).hex().encode()
+        return self._memory_cache[length]
+
+    def handle(self, payload):
+        """
+            Build the reply payload for a single request payload
+        """
+        if payload.startswith(b'm'):
+            _addr, length = payload[1:].split(b',')
+            return self._memory(int(length, 16))
+        if payload.startswith((b'vFlashWrite:', b'vFlashErase:', b'M', b'X')) or payload == b'vFlashDone':
+            return b'OK'
+        if payload in (b's', b'c', b'?') or payload.startswith(b'vCont'):
+            return b'S05'
+        if payload == b'g':
+            return b'00000000' * 17
+        return b''
+
+    def feed(self, data):
+        """
+            Feed raw bytes from a client, return the raw bytes to send back
+        """
+        return b''.join(b'+' + make_packet(self.handle(payload)) for payload in self.parser.feed(data))
+
+class RspClient:
+    """
+        Request/response RSP client over a trio stream, running in no-ack mode
+    """
+    def __init__(self, stream, receive_size=65536):
+        self.stream = stream
+        self.receive_size = receive_size
+        self.parser = PacketParser()
+        self.replies = collections.deque()
+
+    async def request(self, payload):
+        """
+            Send one packet and wait for its reply. Returns (reply payload, bytes on the wire)
+        """
+        packet = make_packet(payload)
+        await self.stream.send_all(packet)
+        wire_bytes = len(packet)
+        while not self.replies:
+            data = await self.stream.receive_some(self.receive_size)
+            if not data:
+                raise EOFError('gdbserver closed the connection')
+            wire_bytes += len(data)
+            self.replies.extend(self.parser.feed(data))
+        return self.replies.popleft(), wire_bytes
@@ -0,0 +1,246 @@
+"""
+    lager.bench.startup
+
+    Startup benchmark for ``python -m lager_cli``.
+
+    Measures wall-clock time and peak RSS of every subcommand's ``--help`` and of a few
+    representative commands run against a local mock API, both cold (empty bytecode
+    cache) and warm, and breaks import time down per module with ``-X importtime``.
+    Results can be written as JSON and checked against thresholds, e.g. in CI:
+
+        python -m lager_cli.bench.startup --json-output startup.json --check
+"""
+import os
+import sys
+import json
+import time
+import fnmatch
+import platform
+import statistics
+import tempfile
+import click
+from texttable import Texttable
+from .. import __version__
+from ..cli import _SUBCOMMANDS
+from .mockapi import MockLagerAPI
+from .process import isolated_environment, measure_command
+
+DEFAULT_THRESHOLDS = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'startup_thresholds.json')
+
+# Commands that talk to the (mock) API, as (name, argv)
+REPRESENTATIVE_COMMANDS = (
+    ('version', ['--version']),
+    ('list gateways', ['list', 'gateways', '--refresh']),
+    ('gateway hello', ['gateway', 'hello', '--gateway', 'mock-gateway']),
+    ('gpio output', ['gpio', 'output', '--gateway', 'mock-gateway', '3', 'HIGH']),
+    ('gpio input', ['gpio', 'input', '--gateway', 'mock-gateway', '3']),
+    ('reset', ['reset', '--gateway', 'mock-gateway']),
+    ('serial-ports', ['serial-ports', '--gateway', 'mock-gateway']),
+)
+
+TOP_IMPORTS = 15
+
+
+class StartupCase:  # pylint: disable=too-few-public-methods
+    """
+        One command line to benchmark
+    """
+    def __init__(self, name, argv):
+        self.name = name
+        self.argv = argv
+
+
+def default_cases():
+    """
+        `lager --help`, `lager <subcommand> --help` for every subcommand, and the
+        representative commands
+    """
+    cases = [StartupCase('--help', ['--help'])]
+    cases.extend(StartupCase(f'{name} --help', [name, '--help']) for name in sorted(_SUBCOMMANDS))
+    cases.extend(StartupCase(name, argv) for name, argv in REPRESENTATIVE_COMMANDS)
+    return cases
+
+
+def run_once(argv, env, python_args=()):
+    """
+        Run `python -m lager_cli <argv>` once. Returns (exit code, wall seconds,
+        peak RSS in bytes or None, stderr)
+    """
+    result = measure_command([sys.executable, *python_args, '-m', 'lager_cli', *argv], env)
+    return result.exit_code, result.elapsed, result.rss, result.stderr
+
+
+def parse_importtime(stderr):
+    """
+        Parse `-X importtime` output into [(module, self us, cumulative us, depth)]
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return imports
+
+def import_breakdown(imports):
+    """
+        Total import time, lager_cli's own share and the slowest modules by self time
+    """
+    cumulative = {name: cumulative_us for name, _self_us, cumulative_us, _depth in imports}
+    slowest = sorted(imports, key=lambda entry: entry[1], reverse=True)[:TOP_IMPORTS]
+    return {
+        'total_ms': sum(self_us for _name, self_us, _cumulative, _depth in imports) / 1000,
+        'lager_cli_cli_ms': cumulative.get('lager_cli.cli', 0) / 1000,
+        'modules': len(imports),
+        'slowest': [
+            {'module': name, 'self_ms': self_us / 1000, 'cumulative_ms': cumulative_us / 1000}
+            for name, self_us, cumulative_us, _depth in slowest
+        ],
+    }
+
+
+def _summary(seconds):
+    millis = [value * 1000 for value in seconds]
+    return {
+        'median_ms': statistics.median(millis),
+        'min_ms': min(millis),
+        'max_ms': max(millis),
+    }
+
+def benchmark_case(case, env, runs, cold_runs):
+    """
+        Cold runs (each with a fresh, empty bytecode cache), one warm-up, `runs` warm
+        runs and one `-X importtime` run of `case`
+    """
+    cold = []
+    for _ in range(cold_runs):
+        with tempfile.TemporaryDirectory(prefix='lager-pycache-') as pycache:
+            _code, elapsed, _rss, _stderr = run_once(case.argv, {**env, 'PYTHONPYCACHEPREFIX': pycache})
+            cold.append(elapsed)
+
+    run_once(case.argv, env)
+    warm = []
+    rss = []
+    exit_codes = set()
+    for _ in range(runs):
+        code, elapsed, peak, _stderr = run_once(case.argv, env)
+        exit_codes.add(code)
+        warm.append(elapsed)
+        if peak is not None:
+            rss.append(peak)
+
+    _code, _elapsed, _rss, stderr = run_once(case.argv, env, python_args=('-X', 'importtime'))
+
+    return {
+        'name': case.name,
+        'argv': case.argv,
+        'exit_codes': sorted(exit_codes),
+        'cold': _summary(cold) if cold else None,
+        'warm': _summary(warm),
+        'rss_mb': max(rss) / 2 ** 20 if rss else None,
+        'imports': import_breakdown(parse_importtime(stderr)),
+    }
+
+
+def run_benchmark(cases, runs=5, cold_runs=1, progress=None):
+    """
+        Benchmark each case against a fresh mock API and config directory
+    """
+    results = []
+    with MockLagerAPI() as api, tempfile.TemporaryDirectory(prefix='lager-bench-') as workdir:
+        env = isolated_environment(workdir, api.env())
+        for case in cases:
+            if progress:
+                progress(case)
+            results.append(benchmark_case(case, env, runs, cold_runs))
+    return {
+        'lager_cli': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'runs': runs,
+        'cold_runs': cold_runs,
+        'results': results,
+    }
+
+
+def _metrics(result):
+    return {
+        'warm_ms': result['warm']['median_ms'],
+        'cold_ms': result['cold']['max_ms'] if result['cold'] else None,
+        'rss_mb': result['rss_mb'],
+        'import_ms': result['imports']['total_ms'],
+    }
+
+def check_thresholds(report, thresholds):
+    """
+        Compare results to `thresholds`, a list of rules like
+        {"match": "* --help", "warm_ms": 300, "rss_mb": 60}. The first rule whose
+        `match` glob matches a case name applies to it. Returns a list of violations.
+    """
+    violations = []
+    for result in report['results']:
+        rule = next((rule for rule in thresholds if fnmatch.fnmatchcase(result['name'], rule['match'])), None)
+        if rule is None:
+            continue
+        if result['exit_codes'] != [0]:
+            violations.append(f'{result["name"]}: exited with {result["exit_codes"]}')
+        for metric, value in _metrics(result).items():
+            limit = rule.get(metric)
+            if limit is not None and value is not None and value > limit:
+                violations.append(f'{result["name"]}: {metric} {value:.1f} > {limit}')
+    return violations
+
+
+def render_table(report):
+    """
+        Render startup results as a text table
+    """
+    table = Texttable(max_width=0)
+    table.set_deco(Texttable.HEADER)
+    table.set_cols_dtype(['t', 'f', 'f', 'f', 'f', 'f', 't'])
+    table.set_cols_align(['l', 'r', 'r', 'r', 'r', 'r', 'l'])
+    table.add_row(['command', 'cold ms', 'warm ms', 'RSS MB', 'import ms', 'lager_cli.cli ms', 'slowest import'])
+    for result in report['results']:
+        metrics = _metrics(result)
+        slowest = result['imports']['slowest']
+        table.add_row([
+            result['name'], metrics['cold_ms'] or 0, metrics['warm_ms'], metrics['rss_mb'] or 0,
+            metrics['import_ms'], result['imports']['lager_cli_cli_ms'], slowest[0]['module'] if slowest else '',
+        ])
+    return table.draw()
+
+@click.command()
+@click.option('--runs', type=click.IntRange(min=1), default=5, show_default=True, help='Warm runs per command')
+@click.option('--cold-runs', type=click.IntRange(min=0), default=1, show_default=True,
+              help='Runs per command with an empty bytecode cache')
+@click.option('--filter', 'patterns', multiple=True, help='Only benchmark commands matching this glob. May be repeated')
+@click.option('--json-output', type=click.Path(dir_okay=False, writable=True), help='Also write results as JSON to this file')
+@click.option('--thresholds', type=click.Path(exists=True, dir_okay=False), default=DEFAULT_THRESHOLDS,
+              show_default=True, help='JSON file with per-command limits')
+@click.option('--check', is_flag=True, default=False, help='Exit with status 1 if any threshold is exceeded')
+def main(runs, cold_runs, patterns, json_output, thresholds, check):
+    """
+        Benchmark lager-cli startup time and memory
+    """
+    cases = default_cases()
+    if patterns:
+        cases = [case for case in cases if any(fnmatch.fnmatchcase(case.name, pattern) for pattern in patterns)]
+
+    report = run_benchmark(cases, runs, cold_runs, progress=lambda case: click.echo(f'{case.name}...', err=True))
+    click.echo(render_table(report))
+    if json_output:
+        with open(json_output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if check:
+        with open(thresholds) as f:
+            violations = check_thresholds(report, json.load(f))
+        for violation in violations:
+            click.secho(violation, fg='red', err=True)
+        if violations:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()  # pylint: disable=no-value-for-parameter
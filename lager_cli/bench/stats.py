@@ -0,0 +1,26 @@
+"""
+    lager.bench.stats
+
+    Small statistics helpers shared by the benchmarks
+"""
+import math
+
+def percentile(values, pct):
+    """
+        Nearest-rank percentile of ``values``; ``pct`` is in the range 0-100
+    """
+    if not values:
+        return math.nan
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+def summarize(latencies):
+    """
+        p50/p99/max of a list of latencies in seconds, reported in milliseconds
+    """
+    return {
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': max(latencies) * 1000 if latencies else math.nan,
+    }
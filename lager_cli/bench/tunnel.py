@@ -0,0 +1,210 @@
+"""
+    lager.bench.tunnel
+
+    Loopback benchmark for the gdbserver / openocd tunnels.
+
+    A local websocket server (and a plain TCP server, for ``--local``) plays the part of
+    the gateway's gdbserver, and synthetic RSP traffic is driven through ``serve_tunnel``
+    and ``serve_local_tunnel``. Runs fully offline:
+
+        python -m lager_cli.bench.tunnel
+"""
+import functools
+import json
+import time
+import click
+import trio
+from texttable import Texttable
+from ..gdbserver.tunnel import serve_tunnel, serve_local_tunnel, serve_mux_tunnels
+from .mockapi import MockLagerAPI
+from .rsp import GdbserverStub, RspClient, escape_binary
+from .stats import summarize
+
+_LOOPBACK = '127.0.0.1'
+
+async def _gateway_tcp_handler(stream):
+    """
+        Gateway side of a local tunnel: a gdbserver stub behind a TCP socket
+    """
+    stub = GdbserverStub()
+    try:
+        async for data in stream:
+            reply = stub.feed(data)
+            if reply:
+                await stream.send_all(reply)
+    except trio.BrokenResourceError:
+        pass
+
+class _JsonResponse:  # pylint: disable=too-few-public-methods
+    def __init__(self, payload):
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+class LoopbackSession:  # pylint: disable=too-few-public-methods
+    """
+        Stands in for ``LagerSession`` in ``serve_local_tunnel``, pointing it at the mock gateway
+    """
+    def __init__(self, port):
+        self.port = port
+
+    def start_local_gdb_tunnel(self, _gateway, _fork):
+        """
+            Report where the mock gateway's gdbserver is listening
+        """
+        return _JsonResponse({'host': _LOOPBACK, 'port': self.port})
+
+class WorkloadResult:
+    """
+        Measurements for a single workload through a single tunnel
+    """
+    def __init__(self, mode, name):
+        self.mode = mode
+        self.name = name
+        self.latencies = []
+        self.wire_bytes = 0
+        self.elapsed = 0.0
+        self.cpu = 0.0
+
+    def as_dict(self):
+        """
+            JSON-friendly report for this workload
+        """
+        megabytes = self.wire_bytes / 1e6
+        result = {
+            'mode': self.mode,
+            'workload': self.name,
+            'requests': len(self.latencies),
+            'bytes': self.wire_bytes,
+            'seconds': self.elapsed,
+            'throughput_mb_s': megabytes / self.elapsed if self.elapsed else 0.0,
+            'cpu_s_per_mb': self.cpu / megabytes if megabytes else 0.0,
+        }
+        result.update(summarize(self.latencies))
+        return result
+
+async def _measure(client, result, payloads):
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    for payload in payloads:
+        before = time.perf_counter()
+        _reply, wire_bytes = await client.request(payload)
+        result.latencies.append(time.perf_counter() - before)
+        result.wire_bytes += wire_bytes
+    result.elapsed = time.perf_counter() - start_wall
+    result.cpu = time.process_time() - start_cpu
+
+def memory_reads(read_size, read_total, base=0x20000000):
+    """
+        Large `m` reads, as issued by `dump memory` or a big watch expression
+    """
+    for offset in range(0, read_total, read_size):
+        yield b'm%x,%x' % (base + offset, read_size)
+
+def single_steps(count):
+    """
+        Ping-pong `s` packets, as issued by `stepi` in a loop
+    """
+    for _ in range(count):
+        yield b's'
+
+def flash_writes(flash_size, chunk_size, base=0x08000000):
+    """
+        vFlashErase / vFlashWrite / vFlashDone sequence, as issued by `load`
+    """
+    yield b'vFlashErase:%x,%x' % (base, flash_size)
+    chunk = escape_binary(bytes(range(256)) * (chunk_size // 256))
+    for offset in range(0, flash_size, chunk_size):
+        yield b'vFlashWrite:%x:' % (base + offset) + chunk
+    yield b'vFlashDone'
+
+async def run_workloads(mode, port, workloads):
+    """
+        Connect one gdb-like client to the tunnel on ``port`` and run each workload
+    """
+    results = []
+    for name, payloads in workloads:
+        result = WorkloadResult(mode, name)
+        async with await trio.open_tcp_stream(_LOOPBACK, port) as stream:
+            await _measure(RspClient(stream), result, payloads)
+        results.append(result)
+    return results
+
+def _listener_port(listeners):
+    return listeners[0].socket.getsockname()[1]
+
+async def run_benchmark(modes, make_workloads):
+    """
+        Start the mock gateway and the tunnels under test, then drive each workload through them
+    """
+    results = []
+    async with trio.open_nursery() as nursery:
+        ws_server = await nursery.start(MockLagerAPI().serve_websockets)
+        tcp_listeners = await nursery.start(functools.partial(trio.serve_tcp, _gateway_tcp_handler, 0, host=_LOOPBACK))
+
+        if 'cloud' in modes:
+            uri = f'ws://{_LOOPBACK}:{ws_server.port}/ws/gateway/bench/gdb-tunnel/3333'
+            listeners = await nursery.start(serve_tunnel, _LOOPBACK, 0, (uri, {}), 'GDB')
+            results.extend(await run_workloads('cloud', _listener_port(listeners), make_workloads()))
+
+        if 'mux' in modes:
+            uri = f'ws://{_LOOPBACK}:{ws_server.port}/ws/gateway/bench/tunnel-mux'
+            servers = await nursery.start(serve_mux_tunnels, _LOOPBACK, [(0, 3333, 'GDB')], (uri, {}))
+            results.extend(await run_workloads('mux', _listener_port(servers[0]), make_workloads()))
+
+        if 'local' in modes:
+            session = LoopbackSession(_listener_port(tcp_listeners))
+            listeners = await nursery.start(serve_local_tunnel, session, 'bench', _LOOPBACK, 0, False)
+            results.extend(await run_workloads('local', _listener_port(listeners), make_workloads()))
+
+        nursery.cancel_scope.cancel()
+    return results
+
+def render_table(reports):
+    """
+        Render benchmark reports as a text table
+    """
+    table = Texttable(max_width=0)
+    table.set_deco(Texttable.HEADER)
+    table.set_cols_dtype(['t', 't', 'i', 'f', 'f', 'f', 'f', 'f'])
+    table.set_cols_align(['l', 'l', 'r', 'r', 'r', 'r', 'r', 'r'])
+    table.add_row(['mode', 'workload', 'requests', 'MB/s', 'p50 ms', 'p99 ms', 'max ms', 'CPU s/MB'])
+    for report in reports:
+        table.add_row([
+            report['mode'], report['workload'], report['requests'], report['throughput_mb_s'],
+            report['p50_ms'], report['p99_ms'], report['max_ms'], report['cpu_s_per_mb'],
+        ])
+    return table.draw()
+
+@click.command()
+@click.option('--mode', type=click.Choice(['cloud', 'mux', 'local', 'all']), default='all', show_default=True,
+              help='Which tunnel to benchmark: websocket (cloud), multiplexed websocket (mux) or direct TCP (local)')
+@click.option('--read-size', type=click.INT, default=16384, show_default=True, help='Bytes per `m` packet')
+@click.option('--read-total', type=click.INT, default=8 * 2 ** 20, show_default=True, help='Total bytes to read')
+@click.option('--steps', type=click.INT, default=2000, show_default=True, help='Number of single-step round trips')
+@click.option('--flash-size', type=click.INT, default=2 ** 20, show_default=True, help='Bytes to write with vFlashWrite')
+@click.option('--flash-chunk', type=click.INT, default=4096, show_default=True, help='Bytes per vFlashWrite packet')
+@click.option('--json-output', type=click.Path(dir_okay=False, writable=True), help='Also write results as JSON to this file')
+def main(mode, read_size, read_total, steps, flash_size, flash_chunk, json_output):
+    """
+        Benchmark the gdbserver tunnels against a loopback mock gateway
+    """
+    modes = ('cloud', 'mux', 'local') if mode == 'all' else (mode,)
+
+    def make_workloads():
+        return [
+            ('memory-read', memory_reads(read_size, read_total)),
+            ('single-step', single_steps(steps)),
+            ('flash-write', flash_writes(flash_size, flash_chunk)),
+        ]
+
+    results = trio.run(run_benchmark, modes, make_workloads)
+    reports = [result.as_dict() for result in results]
+    click.echo(render_table(reports))
+    if json_output:
+        with open(json_output, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+if __name__ == '__main__':
+    main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,75 @@
+"""
+    lager.cache
+
+    Small JSON caches kept next to the global config file
+"""
+import os
+import json
+import time
+import tempfile
+
+from .config import get_global_config_file_path
+
+CACHE_DIR_NAME = '.lager_cache'
+
+
+def get_cache_dir():
+    """
+        Directory holding lager-cli caches; override with LAGER_CACHE_DIR
+    """
+    if 'LAGER_CACHE_DIR' in os.environ:
+        return os.getenv('LAGER_CACHE_DIR')
+    config_dir = os.path.dirname(get_global_config_file_path())
+    return os.path.join(config_dir, CACHE_DIR_NAME)
+
+def get_cache_path(name):
+    """
+        Full path to the cache file `name`
+    """
+    return os.path.join(get_cache_dir(), name)
+
+def read_cache(name, ttl=None):
+    """
+        Return the cached value stored under `name` and its age in seconds.
+        Returns (None, None) if there is no cache entry, it is unreadable,
+        or it is older than `ttl` seconds.
+    """
+    try:
+        with open(get_cache_path(name)) as f:
+            entry = json.load(f)
+        age = time.time() - entry['written_at']
+        value = entry['value']
+    except (OSError, ValueError, TypeError, KeyError):
+        return None, None
+
+    if ttl is not None and not 0 <= age < ttl:
+        return None, None
+    return value, age
+
+def write_cache(name, value):
+    """
+        Atomically store `value` (anything JSON-serializable) under `name`.
+        Failures are ignored; a cache is never worth failing a command for.
+    """
+    cache_dir = get_cache_dir()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=f'.{name}.')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'written_at': time.time(), 'value': value}, f)
+            os.replace(tmp_path, get_cache_path(name))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        pass
+
+def clear_cache(name):
+    """
+        Remove the cache entry `name`, if any
+    """
+    try:
+        os.unlink(get_cache_path(name))
+    except FileNotFoundError:
+        pass
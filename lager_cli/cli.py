@@ -3,7 +3,9 @@
 
     Command line interface entry point
 """
+import importlib
 import os
+import sys
 import urllib.parse
 
 import traceback
@@ -11,39 +13,67 @@ import click
 
 from . import __version__
 from .config import read_config_file
-from .context import LagerContext
-
-from .gateway.commands import _gateway
-from .adc.commands import adc
-from .setter.commands import setter
-from .lister.commands import lister
-from .auth import load_auth
-from .auth.commands import login, logout
-from .canbus.commands import canbus
-from .job.commands import job
-from .devenv.commands import devenv
-from .exec.commands import exec_
-from .flash.commands import flash
-from .run.commands import run
-from .erase.commands import erase
-from .reset.commands import reset
-from .uart.commands import uart
-from .testrun.commands import testrun
-from .gdbserver.commands import gdbserver
-from .connect.commands import connect, disconnect
-from .gpio.commands import gpio
-from .openocd.commands import openocd
-from .python.commands import python
-from .wifi.commands import _wifi
-from .serial_ports.commands import serial_ports
+from .context import LagerContext, print_ssl_session_report
 from .util import check_version
 
+# Subcommand name -> (module, attribute). Modules are only imported when the command runs,
+# so e.g. `lager set default gateway` never pays for importing trio or requests.
+_SUBCOMMANDS = {
+    'adc': ('.adc.commands', 'adc'),
+    'agent': ('.agent.commands', 'agent'),
+    'batch': ('.batch.commands', 'batch'),
+    'bench': ('.bench.commands', 'bench'),
+    'canbus': ('.canbus.commands', 'canbus'),
+    'connect': ('.connect.commands', 'connect'),
+    'devenv': ('.devenv.commands', 'devenv'),
+    'disconnect': ('.connect.commands', 'disconnect'),
+    'erase': ('.erase.commands', 'erase'),
+    'exec': ('.exec.commands', 'exec_'),
+    'flash': ('.flash.commands', 'flash'),
+    'gateway': ('.gateway.commands', '_gateway'),
+    'gdbserver': ('.gdbserver.commands', 'gdbserver'),
+    'gpio': ('.gpio.commands', 'gpio'),
+    'history': ('.history.commands', 'history'),
+    'job': ('.job.commands', 'job'),
+    'list': ('.lister.commands', 'lister'),
+    'login': ('.auth.commands', 'login'),
+    'logout': ('.auth.commands', 'logout'),
+    'openocd': ('.openocd.commands', 'openocd'),
+    'python': ('.python.commands', 'python'),
+    'reset': ('.reset.commands', 'reset'),
+    'run': ('.run.commands', 'run'),
+    'serial-ports': ('.serial_ports.commands', 'serial_ports'),
+    'set': ('.setter.commands', 'setter'),
+    'testrun': ('.testrun.commands', 'testrun'),
+    'tunnel': ('.tunnel.commands', 'tunnel'),
+    'uart': ('.uart.commands', 'uart'),
+    'wifi': ('.wifi.commands', '_wifi'),
+}
+
+class LazyGroup(click.Group):
+    """
+        Group whose subcommands are imported on first use
+    """
+    def __init__(self, *args, lazy_subcommands=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_subcommands = lazy_subcommands or {}
+
+    def list_commands(self, ctx):
+        return sorted(set(self.commands) | set(self.lazy_subcommands))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in self.commands and cmd_name in self.lazy_subcommands:
+            module_name, attribute = self.lazy_subcommands[cmd_name]
+            module = importlib.import_module(module_name, __package__)
+            self.add_command(getattr(module, attribute), cmd_name)
+        return super().get_command(ctx, cmd_name)
+
 def _decode_environment():
     for key in os.environ:
         if key.startswith('LAGER_'):
             os.environ[key] = urllib.parse.unquote(os.environ[key])
 
-@click.group(invoke_without_command=True)
+@click.group(cls=LazyGroup, lazy_subcommands=_SUBCOMMANDS, invoke_without_command=True)
 @click.pass_context
 @click.option('--version', 'see_version', is_flag=True, help='See package version')
 @click.option('--debug', 'debug', is_flag=True, help='Show debug output', default=False)
@@ -64,42 +94,18 @@ def cli(ctx=None, see_version=None, debug=False, colorize=False, version_check=T
     else:
         os_args = click.get_os_args()
         help_invoked = '--help' in os_args
-        skip_auth = ctx.invoked_subcommand in ('login', 'logout', 'set', 'devenv', 'exec') or help_invoked
+        skip_auth = ctx.invoked_subcommand in ('login', 'logout', 'set', 'devenv', 'exec', 'agent', 'bench', 'history') or help_invoked
         if version_check and not skip_auth:
             check_version('lager-cli', __version__)
         setup_context(ctx, debug, colorize, skip_auth)
 
-cli.add_command(_gateway)
-cli.add_command(adc)
-cli.add_command(setter)
-cli.add_command(lister)
-cli.add_command(login)
-cli.add_command(logout)
-cli.add_command(canbus)
-cli.add_command(job)
-cli.add_command(devenv)
-cli.add_command(exec_)
-cli.add_command(flash)
-cli.add_command(run)
-cli.add_command(erase)
-cli.add_command(reset)
-cli.add_command(uart)
-cli.add_command(testrun)
-cli.add_command(gdbserver)
-cli.add_command(connect)
-cli.add_command(disconnect)
-cli.add_command(gpio)
-cli.add_command(openocd)
-cli.add_command(python)
-cli.add_command(_wifi)
-cli.add_command(serial_ports)
-
 def setup_context(ctx, debug, colorize, skip_auth):
     """
         Ensure the user has a valid authorization
     """
     auth = None
     if not skip_auth:
+        from .auth import load_auth  # pylint: disable=import-outside-toplevel
         try:
             auth = load_auth()
         except Exception:  # pylint: disable=broad-except
@@ -121,3 +127,16 @@ def setup_context(ctx, debug, colorize, skip_auth):
         debug=debug,
         style=click.style if colorize else lambda string, **kwargs: string,
     )
+    if debug:
+        ctx.call_on_close(print_ssl_session_report)
+
+def main():
+    """
+        Console entry point: hand the invocation to `lager agent` if one is running,
+        otherwise run it in this process
+    """
+    from .agent.client import forward  # pylint: disable=import-outside-toplevel
+    code = forward(sys.argv[1:])
+    if code is not None:
+        sys.exit(code)
+    cli()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,429 @@
+"""
+    lager.client
+
+    Async (trio) client for the Lager API
+
+    Example::
+
+        async with AsyncLagerClient() as client:
+            async with trio.open_nursery() as nursery:
+                for gateway in gateways:
+                    nursery.start_soon(client.gpio_output, gateway, 3, 'HIGH')
+"""
+import os
+import re
+import math
+import ssl
+import json
+import collections
+import urllib.parse
+from uuid import uuid4
+
+import h11
+import trio
+from urllib3.fields import RequestField
+from urllib3.filepost import encode_multipart_formdata
+
+from . import __version__
+from .context import get_ssl_context, get_ci_environment, CIEnvironment
+from .endpoints import LagerEndpoints
+from .exceptions import (
+    GatewayTimeoutError, LagerAPIError, GatewayNotFoundError, LagerServerError,
+    LagerConnectionError, LagerConnectTimeout, LagerRequestTimeout,
+)
+
+_DEFAULT_HOST = 'https://app.lagerdata.com'
+DEFAULT_TIMEOUT = 30
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_MAX_CONNECTIONS = 10
+_RECEIVE_SIZE = 64 * 1024
+_GATEWAY_RE = re.compile(r'/gateway/([^/]+)/')
+
+# Sentinel so `timeout=None` can mean "no timeout" for a single request
+_CLIENT_DEFAULT = object()
+
+
+def _encode_files(files):
+    """
+        multipart/form-data body for `files` in the same formats `requests` accepts
+    """
+    fields = []
+    for name, value in files:
+        content_type = None
+        if isinstance(value, (tuple, list)):
+            filename, data = value[0], value[1]
+            if len(value) > 2:
+                content_type = value[2]
+        else:
+            filename = os.path.basename(getattr(value, 'name', '')) or name
+            data = value
+        if data is None:
+            continue
+        if hasattr(data, 'read'):
+            data = data.read()
+        elif isinstance(data, memoryview):
+            data = data.tobytes()
+        field = RequestField(name=name, data=data, filename=filename)
+        field.make_multipart(content_type=content_type)
+        fields.append(field)
+    return encode_multipart_formdata(fields)
+
+def raise_for_response(response, body):
+    """
+        Raise the exception matching an error response; mirrors LagerSession.handle_errors
+    """
+    status = response.status_code
+    if status < 400:
+        return
+    if status == 404:
+        match = _GATEWAY_RE.search(response.url)
+        gateway = urllib.parse.unquote(match.group(1)) if match else None
+        raise GatewayNotFoundError(f'You don\'t have a gateway with id `{gateway}`', status)
+    if status == 422:
+        try:
+            error = json.loads(body)['error']
+        except (ValueError, KeyError, TypeError):
+            error = {'code': None, 'description': body.decode(errors='replace')}
+        if error['code'] == 'gateway_timeout_error':
+            raise GatewayTimeoutError(error['description'])
+        try:
+            details = json.loads(error['description'])
+        except (ValueError, TypeError):
+            details = None
+        raise LagerAPIError(error['description'], status, error['code'], details)
+    if status >= 500:
+        raise LagerServerError(body.decode(errors='replace'), status)
+    raise LagerAPIError(f'{status} error for {response.url}', status)
+
+
+class _Connection:
+    """
+        One HTTP/1.1 keep-alive connection
+    """
+    def __init__(self, key, stream):
+        self.key = key
+        self.stream = stream
+        self.h11 = h11.Connection(our_role=h11.CLIENT)
+        self.reused = False
+
+    async def send(self, event):
+        data = self.h11.send(event)
+        if data:
+            await self.stream.send_all(data)
+
+    async def next_event(self):
+        while True:
+            event = self.h11.next_event()
+            if event is not h11.NEED_DATA:
+                return event
+            data = await self.stream.receive_some(_RECEIVE_SIZE)
+            self.h11.receive_data(data)
+
+    def reusable(self):
+        return self.h11.our_state is h11.DONE and self.h11.their_state is h11.DONE
+
+    async def aclose(self):
+        with trio.CancelScope(shield=True):
+            await self.stream.aclose()
+
+
+class ConnectionPool:
+    """
+        Keep-alive connections per (scheme, host, port); at most `max_connections`
+        requests are in flight at once
+    """
+    def __init__(self, ssl_context, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT):
+        self.ssl_context = ssl_context
+        self.max_connections = max_connections
+        self.connect_timeout = connect_timeout
+        self._slots = trio.Semaphore(max_connections)
+        self._idle = collections.defaultdict(list)
+        self.opened = 0
+
+    async def acquire(self, key, fresh=False):
+        """
+            Wait for a free slot and return an idle connection, or a new one
+        """
+        await self._slots.acquire()
+        try:
+            if not fresh and self._idle[key]:
+                connection = self._idle[key].pop()
+                connection.reused = True
+                return connection
+            return await self._connect(key)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def _connect(self, key):
+        scheme, host, port = key
+        try:
+            with trio.fail_after(self.connect_timeout):
+                stream = await trio.open_tcp_stream(host, port)
+                if scheme == 'https':
+                    stream = trio.SSLStream(stream, self.ssl_context, server_hostname=host,
+                                            https_compatible=True)
+                    await stream.do_handshake()
+        except trio.TooSlowError:
+            raise LagerConnectTimeout('Connection to Lager API timed out') from None
+        except (OSError, trio.BrokenResourceError) as exc:
+            raise LagerConnectionError(f'Could not connect to Lager API: {exc}') from exc
+        self.opened += 1
+        return _Connection(key, stream)
+
+    async def release(self, connection):
+        """
+            Return a connection to the pool, closing it unless it can carry another request
+        """
+        try:
+            if connection.reusable() and len(self._idle[connection.key]) < self.max_connections:
+                connection.h11.start_next_cycle()
+                self._idle[connection.key].append(connection)
+            else:
+                await connection.aclose()
+        finally:
+            self._slots.release()
+
+    async def discard(self, connection):
+        try:
+            await connection.aclose()
+        finally:
+            self._slots.release()
+
+    async def aclose(self):
+        for connections in self._idle.values():
+            for connection in connections:
+                await connection.aclose()
+        self._idle.clear()
+
+
+class AsyncResponse:
+    """
+        Response to an AsyncLagerClient request. Non-streaming responses are read
+        in full; streaming ones must be consumed with `aiter_bytes` / `aiter_lines`
+        or closed with `aclose`.
+    """
+    def __init__(self, pool, connection, url, event):
+        self._pool = pool
+        self._connection = connection
+        self.url = url
+        self.status_code = event.status_code
+        self.reason = event.reason.decode(errors='replace')
+        self.headers = {name.decode().lower(): value.decode() for name, value in event.headers}
+        self.content = None
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    async def aiter_bytes(self):
+        """
+            Yield body chunks as they arrive
+        """
+        if self.content is not None:
+            if self.content:
+                yield self.content
+            return
+        if self._connection is None:
+            raise RuntimeError('Response body was closed before it was read')
+        try:
+            while True:
+                event = await self._connection.next_event()
+                if isinstance(event, h11.Data):
+                    yield bytes(event.data)
+                elif isinstance(event, (h11.EndOfMessage, h11.ConnectionClosed)):
+                    break
+        except BaseException:
+            await self.aclose()
+            raise
+        await self._finish()
+
+    async def aiter_lines(self):
+        """
+            Yield body lines (bytes, without line endings) as they arrive
+        """
+        pending = b''
+        async for chunk in self.aiter_bytes():
+            pending += chunk
+            *lines, pending = pending.split(b'\n')
+            for line in lines:
+                yield line.rstrip(b'\r')
+        if pending:
+            yield pending
+
+    async def aread(self):
+        """
+            Read the whole body
+        """
+        if self.content is None:
+            chunks = [chunk async for chunk in self.aiter_bytes()]
+            self.content = b''.join(chunks)
+        return self.content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    async def _finish(self):
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            await self._pool.release(connection)
+
+    async def aclose(self):
+        """
+            Drop the rest of the body (and the connection, if the body was unfinished)
+        """
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            if connection.reusable():
+                await self._pool.release(connection)
+            else:
+                await self._pool.discard(connection)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+
+class AsyncLagerClient(LagerEndpoints):
+    """
+        trio-based Lager API client with the same endpoint methods as LagerSession.
+        Error responses raise the exceptions in lager_cli.exceptions instead of
+        printing and exiting.
+    """
+    def __init__(self, auth=None, *, host=None, timeout=DEFAULT_TIMEOUT,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, max_connections=DEFAULT_MAX_CONNECTIONS):
+        if auth is None:
+            from .auth import load_auth  # pylint: disable=import-outside-toplevel
+            auth = load_auth()
+        if host is None:
+            host = os.getenv('LAGER_HOST', _DEFAULT_HOST)
+        self.base_url = '{}{}'.format(host, '/api/v1/')
+        self.timeout = timeout
+
+        if 'NOVERIFY' in os.environ:
+            ssl_context = ssl.create_default_context()
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+        else:
+            ssl_context = get_ssl_context()
+        self.pool = ConnectionPool(ssl_context, max_connections, connect_timeout)
+
+        self.headers = {
+            'Lager-Version': __version__,
+            'Lager-Invocation-Id': str(uuid4()),
+            'User-Agent': f'lager-cli/{__version__}',
+            'Accept-Encoding': 'identity',
+        }
+        if auth:
+            self.headers['Authorization'] = '{} {}'.format(auth['type'], auth['token'])
+        ci_env = get_ci_environment()
+        if ci_env == CIEnvironment.HOST:
+            self.headers['Lager-CI-Active'] = 'False'
+        else:
+            self.headers['Lager-CI-Active'] = 'True'
+            self.headers['Lager-CI-System'] = ci_env.name
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        """
+            Close all idle connections
+        """
+        await self.pool.aclose()
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    def _prepare(self, method, url, params, json_data, files, data, headers):  # pylint: disable=too-many-arguments
+        url = urllib.parse.urljoin(self.base_url, url)
+        if params:
+            url = '{}?{}'.format(url, urllib.parse.urlencode(params, doseq=True))
+        parsed = urllib.parse.urlsplit(url)
+        default_port = 443 if parsed.scheme == 'https' else 80
+        port = parsed.port or default_port
+        host_header = parsed.hostname if port == default_port else f'{parsed.hostname}:{port}'
+        target = parsed.path + (f'?{parsed.query}' if parsed.query else '')
+
+        request_headers = {'Host': host_header, **self.headers, 'Lager-Request-Id': str(uuid4())}
+        body = b''
+        if files is not None:
+            body, request_headers['Content-Type'] = _encode_files(files)
+        elif json_data is not None:
+            body = json.dumps(json_data).encode()
+            request_headers['Content-Type'] = 'application/json'
+        elif data is not None:
+            body = data.read() if hasattr(data, 'read') else bytes(data)
+        request_headers['Content-Length'] = str(len(body))
+        request_headers.update(headers or {})
+
+        key = (parsed.scheme, parsed.hostname, port)
+        event = h11.Request(method=method, target=target,
+                            headers=[(name, str(value)) for name, value in request_headers.items()])
+        return url, key, event, body
+
+    async def _exchange(self, connection, event, body):
+        await connection.send(event)
+        if body:
+            await connection.send(h11.Data(data=body))
+        await connection.send(h11.EndOfMessage())
+        while True:
+            response = await connection.next_event()
+            if isinstance(response, h11.Response):
+                return response
+            if isinstance(response, h11.ConnectionClosed):
+                raise h11.RemoteProtocolError('connection closed before response')
+
+    async def request(self, method, url, *, params=None, json=None, files=None,  # pylint: disable=redefined-outer-name
+                      data=None, headers=None, stream=False, timeout=_CLIENT_DEFAULT):
+        """
+            Send a request. `timeout` (seconds, None for no limit) covers the response
+            headers, and the whole body unless `stream` is set.
+        """
+        if timeout is _CLIENT_DEFAULT:
+            timeout = self.timeout
+        url, key, event, body = self._prepare(method, url, params, json, files, data, headers)
+
+        deadline = math.inf if timeout is None else trio.current_time() + timeout
+        try:
+            with trio.fail_at(deadline):
+                response = await self._request_with_retry(key, event, body, url)
+                if not stream or not response.ok:
+                    await response.aread()
+        except trio.TooSlowError:
+            raise LagerRequestTimeout(f'{method} {url} timed out after {timeout}s') from None
+
+        if not response.ok:
+            raise_for_response(response, response.content)
+        return response
+
+    async def _request_with_retry(self, key, event, body, url):
+        fresh = False
+        while True:
+            connection = await self.pool.acquire(key, fresh=fresh)
+            try:
+                response_event = await self._exchange(connection, event, body)
+            except (h11.RemoteProtocolError, trio.BrokenResourceError, trio.ClosedResourceError) as exc:
+                await self.pool.discard(connection)
+                # An idle keep-alive connection may have been closed by the server; retry once
+                if connection.reused and not fresh:
+                    fresh = True
+                    continue
+                raise LagerConnectionError(f'Connection to Lager API failed: {exc}') from exc
+            except BaseException:
+                await self.pool.discard(connection)
+                raise
+            return AsyncResponse(self.pool, connection, url, response_event)
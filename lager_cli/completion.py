@@ -0,0 +1,282 @@
+"""
+    lager.completion
+
+    Shell completion answered from local caches, without importing the command modules
+    or talking to the Lager API. Works with click's completion scripts, e.g.
+    eval "$(_LAGER_COMPLETE=source_bash lager)"
+"""
+import os
+import sys
+import time
+import shlex
+
+from . import __version__
+from .cache import read_cache, write_cache
+from .config import read_config_file, find_devenv_config_path, all_commands, DEVENV_SECTION_NAME
+from .gateways import GATEWAY_CACHE_NAME, cached_gateways, gateway_cache_ttl
+
+COMPLETE_VAR = '_LAGER_COMPLETE'
+PROG_NAME = 'lager'
+
+COMMAND_TREE_CACHE_NAME = 'completion-tree.json'
+SERIAL_PORTS_CACHE_NAME = 'serial-ports.json'
+SERIAL_PORTS_TTL = 10 * 60
+_REFRESH_CACHE_NAME = 'completion-refresh.json'
+_REFRESH_BACKOFF = 60
+
+# Parameter name -> kind of value it takes, for values that come from a cache
+# rather than a click.Choice
+_PARAM_KINDS = {
+    'gateway': 'gateway',
+    'gateway_id': 'gateway',
+    'serial_device': 'serial',
+    'device_path': 'serial',
+    'cmd_name': 'devenv',
+}
+
+
+def _describe_param(param):
+    import click  # pylint: disable=import-outside-toplevel
+
+    entry = {
+        'kind': _PARAM_KINDS.get(param.name),
+        'choices': list(param.type.choices) if isinstance(param.type, click.Choice) else None,
+    }
+    if isinstance(param, click.Option):
+        entry['value'] = not param.is_flag and not param.count
+        entry['help'] = (param.help or '').split('\n')[0]
+    else:
+        entry['nargs'] = param.nargs
+    return entry
+
+def _describe_command(ctx, command):
+    import click  # pylint: disable=import-outside-toplevel
+
+    node = {'help': command.get_short_help_str(), 'options': {}, 'arguments': []}
+    for param in command.get_params(ctx):
+        entry = _describe_param(param)
+        if isinstance(param, click.Option):
+            for opt in param.opts + param.secondary_opts:
+                node['options'][opt] = entry
+        else:
+            node['arguments'].append(entry)
+
+    if isinstance(command, click.MultiCommand):
+        node['commands'] = {}
+        for name in command.list_commands(ctx):
+            subcommand = command.get_command(ctx, name)
+            if subcommand is None or subcommand.hidden:
+                continue
+            sub_ctx = click.Context(subcommand, info_name=name, parent=ctx)
+            node['commands'][name] = _describe_command(sub_ctx, subcommand)
+    return node
+
+def build_command_tree():
+    """
+        Walk every lager command (importing all of them) and cache the options,
+        arguments and subcommands needed to complete a command line
+    """
+    import click  # pylint: disable=import-outside-toplevel
+    from .cli import cli  # pylint: disable=import-outside-toplevel
+
+    tree = _describe_command(click.Context(cli, info_name=PROG_NAME), cli)
+    write_cache(COMMAND_TREE_CACHE_NAME, {'version': __version__, 'tree': tree})
+    return tree
+
+def load_command_tree():
+    """
+        The cached command tree, rebuilt if missing or written by another lager-cli version
+    """
+    value, _age = read_cache(COMMAND_TREE_CACHE_NAME)
+    if isinstance(value, dict) and value.get('version') == __version__:
+        return value['tree']
+    return build_command_tree()
+
+
+def cache_serial_ports(gateway, ports):
+    """
+        Remember the serial ports of `gateway` for completion
+    """
+    value, _age = read_cache(SERIAL_PORTS_CACHE_NAME)
+    if not isinstance(value, dict):
+        value = {}
+    value[str(gateway)] = {'ports': ports, 'written_at': time.time()}
+    write_cache(SERIAL_PORTS_CACHE_NAME, value)
+
+def _spawn_refresh(key, args):
+    """
+        Run `lager <args>` detached to refresh a cache, at most once per _REFRESH_BACKOFF
+        seconds for each `key`
+    """
+    started, _age = read_cache(_REFRESH_CACHE_NAME)
+    if not isinstance(started, dict):
+        started = {}
+    if 0 <= time.time() - started.get(key, 0) < _REFRESH_BACKOFF:
+        return
+    started[key] = time.time()
+    write_cache(_REFRESH_CACHE_NAME, started)
+
+    import subprocess  # pylint: disable=import-outside-toplevel
+
+    env = {name: value for name, value in os.environ.items() if name != COMPLETE_VAR}
+    try:
+        subprocess.Popen(
+            [sys.executable, '-m', 'lager_cli', '--no-version-check', *args],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            start_new_session=True, env=env,
+        )
+    except OSError:
+        pass
+
+
+def _gateway_values():
+    value, _age = read_cache(GATEWAY_CACHE_NAME, gateway_cache_ttl())
+    if value is None:
+        _spawn_refresh('gateways', ['list', 'gateways', '--refresh'])
+    return [(gateway['name'], str(gateway['id'])) for gateway in cached_gateways()]
+
+def _default_gateway():
+    gateway = os.getenv('LAGER_GATEWAY')
+    if gateway is None:
+        gateway = read_config_file()['LAGER'].get('gateway_id')
+    return gateway
+
+def _serial_values(gateway):
+    gateway = gateway or _default_gateway()
+    value, _age = read_cache(SERIAL_PORTS_CACHE_NAME)
+    if not isinstance(value, dict):
+        value = {}
+
+    keys = {str(gateway)} if gateway else set(value)
+    for entry in cached_gateways():
+        if entry['name'] == gateway:
+            keys.add(str(entry['id']))
+
+    ports = {}
+    fresh = False
+    for key in keys:
+        entry = value.get(key) or {}
+        fresh = fresh or 0 <= time.time() - entry.get('written_at', 0) < SERIAL_PORTS_TTL
+        for port in entry.get('ports', []):
+            ports[port['device']] = port.get('description')
+    if not fresh:
+        args = ['serial-ports'] + (['--gateway', gateway] if gateway else [])
+        _spawn_refresh(f'serial-ports:{gateway or ""}', args)
+    return sorted(ports.items())
+
+def _devenv_values():
+    path = find_devenv_config_path()
+    if path is None:
+        return []
+    config = read_config_file(path)
+    if DEVENV_SECTION_NAME not in config:
+        return []
+    return sorted(all_commands(config[DEVENV_SECTION_NAME]).items())
+
+def _values(entry, gateway):
+    if entry.get('choices'):
+        return [(choice, None) for choice in entry['choices']]
+    kind = entry.get('kind')
+    if kind == 'gateway':
+        return _gateway_values()
+    if kind == 'serial':
+        return _serial_values(gateway)
+    if kind == 'devenv':
+        return _devenv_values()
+    return []
+
+
+def get_completions(tree, args, incomplete):
+    """
+        Completions for `incomplete` after the words `args`, as (value, description) pairs
+    """
+    node = tree
+    pending = None
+    argument = 0
+    gateway = None
+    for word in args:
+        if pending is not None:
+            if pending.get('kind') == 'gateway':
+                gateway = word
+            pending = None
+        elif word.startswith('-') and word != '-':
+            name, eq, value = word.partition('=')
+            entry = node['options'].get(name)
+            if entry and entry['value']:
+                if not eq:
+                    pending = entry
+                elif entry.get('kind') == 'gateway':
+                    gateway = value
+        elif word in node.get('commands', {}):
+            node = node['commands'][word]
+            argument = 0
+        else:
+            argument += 1
+
+    if pending is not None:
+        candidates = _values(pending, gateway)
+    elif incomplete.startswith('-'):
+        candidates = [(opt, entry.get('help')) for opt, entry in node['options'].items()]
+    elif node.get('commands'):
+        candidates = [(name, sub['help']) for name, sub in node['commands'].items()]
+    else:
+        candidates = []
+        position = 0
+        for entry in node['arguments']:
+            if entry['nargs'] < 0 or argument < position + entry['nargs']:
+                candidates = _values(entry, gateway)
+                break
+            position += entry['nargs']
+
+    return [(value, description) for value, description in candidates if value.startswith(incomplete)]
+
+def _split(line):
+    lexer = shlex.shlex(line, posix=True)
+    lexer.whitespace_split = True
+    lexer.commenters = ''
+    words = []
+    try:
+        for word in lexer:
+            words.append(word)
+    except ValueError:
+        words.append(lexer.token)
+    return words
+
+def complete(instruction, environ=None, out=None):
+    """
+        Handle a click-style completion request (`source_bash`, `complete`, `complete_zsh`,
+        `complete_fish`, ...) and return the process exit code
+    """
+    environ = os.environ if environ is None else environ
+    out = sys.stdout if out is None else out
+    command, _sep, shell = instruction.partition('_')
+    shell = shell or 'bash'
+
+    if command == 'source':
+        from click._bashcomplete import get_completion_script  # pylint: disable=import-outside-toplevel
+        # Build the command tree now so the first TAB press is fast
+        load_command_tree()
+        out.write(get_completion_script(PROG_NAME, COMPLETE_VAR, shell) + '\n')
+        return 0
+    if command != 'complete':
+        return 1
+
+    words = _split(environ.get('COMP_WORDS', ''))
+    if shell == 'fish':
+        # fish passes the line up to the cursor, including the word being completed
+        args, incomplete = words[1:], environ.get('COMP_CWORD', '')
+        if incomplete and args and args[-1] == incomplete:
+            args = args[:-1]
+    else:
+        cword = int(environ.get('COMP_CWORD', len(words)))
+        args = words[1:cword]
+        incomplete = words[cword] if cword < len(words) else ''
+
+    for value, help_text in get_completions(load_command_tree(), args, incomplete):
+        if shell == 'zsh':
+            out.write(f'{value}\n{help_text or "_"}\n')
+        elif shell == 'fish' and help_text:
+            out.write(f'{value}\t{help_text}\n')
+        else:
+            out.write(f'{value}\n')
+    return 0
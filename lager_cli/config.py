@@ -5,7 +5,6 @@
 """
 import os
 import configparser
-import click
 
 DEFAULT_CONFIG_FILE_NAME = '.lager'
 LAGER_CONFIG_FILE_NAME = os.getenv('LAGER_CONFIG_FILE_NAME', DEFAULT_CONFIG_FILE_NAME)
@@ -85,6 +84,8 @@ def add_devenv_command(section, command_name, command, warn):
     """
         Add a named command to devenv
     """
+    import click  # pylint: disable=import-outside-toplevel
+
     key = f'cmd.{command_name}'
     if key in section and warn:
         click.echo(f'Command `{command_name}` already exists, overwriting. ', nl=False, err=True)
@@ -95,6 +96,8 @@ def remove_devenv_command(section, command_name):
     """
         Delete a named command
     """
+    import click  # pylint: disable=import-outside-toplevel
+
     key = f'cmd.{command_name}'
     if key not in section:
         click.secho(f'Command `{command_name}` does not exist.', fg='red', err=True)
@@ -113,6 +116,8 @@ def get_devenv_config():
     """
         Return a path and config file for devenv
     """
+    import click  # pylint: disable=import-outside-toplevel
+
     config_path = find_devenv_config_path()
     if config_path is None:
         click.echo(f'Could not find {LAGER_CONFIG_FILE_NAME} in {os.getcwd()} or any parent directories', err=True)
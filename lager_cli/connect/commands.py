@@ -8,9 +8,12 @@ import time
 import click
 from .. import SUPPORTED_DEVICES, SUPPORTED_INTERFACES
 from ..context import get_default_gateway
+from ..fanout import fan_out
 from ..exceptions import GatewayTimeoutError
 from ..paramtypes import HexParamType, VarAssignmentType
+from ..flash.sectors import remember_device
 
+@fan_out
 @click.command()
 @click.pass_context
 @click.option('--gateway', required=False, help='ID of gateway to which DUT is connected')
@@ -72,10 +75,12 @@ def connect(ctx, gateway, snr, device, interface, transport, speed, workareasize
                 time.sleep(2)
 
     if resp.get('start') == 'ok':
+        remember_device(gateway, device)
         click.secho('Connected!', fg='green')
     elif resp.get('already_running') == 'ok':
         click.secho('Debugger already connected, ignoring', fg='green')
 
+@fan_out
 @click.command()
 @click.pass_context
 @click.option('--gateway', required=False, help='ID of gateway to which DUT is connected')
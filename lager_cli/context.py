@@ -4,436 +4,43 @@
     CLI context management
 """
 from enum import Enum
+import collections
 import functools
 import os
-import json
-import signal
 import ssl
 
-from uuid import uuid4
-
 import urllib.parse
-import urllib3
-import requests
 import click
-from requests_toolbelt.sessions import BaseUrlSession
-from . import __version__
-from .exceptions import GatewayTimeoutError
 
-_DEFAULT_HOST = 'https://app.lagerdata.com'
 _DEFAULT_WEBSOCKET_HOST = 'wss://app.lagerdata.com'
 
-def print_openocd_error(error):
-    """
-        Parse an openocd log file and print the error lines
-    """
-    if not error:
-        return
-    parsed = json.loads(error)
-    logfile = parsed['logfile']
-    if not logfile:
-        return
-    error_printed = False
-    for line in logfile.splitlines():
-        if 'Error: ' in line:
-            error_printed = True
-            click.secho(line, fg='red', err=True)
+TUNNEL_PORTS = {
+    'jl-tunnel': 2331,
+    'gdb-tunnel': 3333,
+    'openocd-tunnel': 4444,
+}
 
-    if not error_printed:
-        click.secho('OpenOCD failed to start', fg='red', err=True)
+# Sessions kept open across invocations, keyed by auth token. Only enabled inside
+# `lager agent`; a one-shot CLI process has nothing to reuse them for.
+_warm_sessions = None
 
-def print_docker_error(ctx, error):
+def keep_sessions_warm():
     """
-        Parse an openocd log file and print the error lines
+        Reuse API sessions (and their pooled connections) across invocations in this process
     """
-    if not error:
-        return
-    parsed = json.loads(error)
-    stdout = parsed['stdout']
-    stderr = parsed['stderr']
-    click.echo(stdout, nl=False)
-    click.echo(stderr, err=True, nl=False)
-    ctx.exit(parsed['returncode'])
-
-def print_canbus_error(ctx, error):
-    if not error:
-        return
-    parsed = json.loads(error)
-    if parsed['stdout']:
-        click.secho(parsed['stdout'], fg='red', nl=False)
-    if parsed['stderr']:
-        click.secho(parsed['stderr'], fg='red', err=True, nl=False)
-        if parsed['stderr'] == 'Cannot find device "can0"\n':
-            click.secho('Please check adapter connection', fg='red', err=True)
-
-
-OPENOCD_ERROR_CODES = {
-    'openocd_start_failed',
-}
+    global _warm_sessions  # pylint: disable=global-statement
+    if _warm_sessions is None:
+        _warm_sessions = {}
 
-DOCKER_ERROR_CODES = set()
-
-CANBUS_ERROR_CODES = {
-    'canbus_up_failed',
-}
-
-
-def quote(gateway):
-    return urllib.parse.quote(str(gateway), safe='')
-
-
-class LagerSession(BaseUrlSession):
+def drop_warm_sessions():
     """
-        requests session wrapper
+        Close all reused API sessions, e.g. after the user logs in or out
     """
-
-    @staticmethod
-    def handle_errors(ctx, r, *args, **kwargs):
-        """
-            Handle request errors
-        """
-        try:
-            current_context = click.get_current_context()
-            ctx = current_context
-        except RuntimeError:
-            pass
-        if r.status_code == 404:
-            name = ctx.params['gateway'] or ctx.obj.default_gateway
-            click.secho('You don\'t have a gateway with id `{}`'.format(name), fg='red', err=True)
-            click.secho(
-                'Please double check your login credentials and gateway id',
-                fg='red',
-                err=True,
-            )
-            ctx.exit(1)
-        if r.status_code == 422:
-            error = r.json()['error']
-            if error['code'] == 'gateway_timeout_error':
-                raise GatewayTimeoutError(error['description'])
-
-            if error['code'] in OPENOCD_ERROR_CODES:
-                print_openocd_error(error['description'])
-            elif error['code'] in DOCKER_ERROR_CODES:
-                print_docker_error(ctx, error['description'])
-            elif error['code'] in CANBUS_ERROR_CODES:
-                print_canbus_error(ctx, error['description'])
-            else:
-                click.secho(error['description'], fg='red', err=True)
-            ctx.exit(1)
-        if r.status_code >= 500:
-            if True:
-                print(r.text)
-            else:
-                click.secho('Something went wrong with the Lager API', fg='red', err=True)
-            ctx.exit(1)
-
-        r.raise_for_status()
-
-    def __init__(self, auth, *args, response_hook=None, **kwargs):
-        host = os.getenv('LAGER_HOST', _DEFAULT_HOST)
-        base_url = '{}{}'.format(host, '/api/v1/')
-
-        super().__init__(*args, base_url=base_url, **kwargs)
-        verify = 'NOVERIFY' not in os.environ
-        if not verify:
-            urllib3.disable_warnings()
-
-        if auth:
-            auth_header = {
-                'Authorization': '{} {}'.format(auth['type'], auth['token'])
-            }
-            self.headers.update(auth_header)
-        self.headers.update({
-            'Lager-Version': __version__,
-            'Lager-Invocation-Id': str(uuid4()),
-            })
-        ci_env = get_ci_environment()
-        if ci_env == CIEnvironment.HOST:
-            self.headers.update({'Lager-CI-Active': 'False'})
-        else:
-            self.headers.update({'Lager-CI-Active': 'True'})
-            self.headers.update({'Lager-CI-System': ci_env.name})
-
-        self.verify = verify
-        if response_hook:
-            self.hooks['response'].append(response_hook)
-
-
-    def request(self, *args, **kwargs):
-        """
-            Catch connection errors so they can be handled more cleanly
-        """
-
-        if 'headers' not in kwargs:
-            kwargs['headers'] = {}
-        kwargs['headers'].update({'Lager-Request-Id': str(uuid4())})
-
-        try:
-            return super().request(*args, **kwargs)
-        except requests.exceptions.ConnectTimeout:
-            click.secho('Connection to Lager API timed out', fg='red', err=True)
-            click.get_current_context().exit(1)
-        except requests.exceptions.ConnectionError:
-            click.secho('Could not connect to Lager API', fg='red', err=True)
-            click.get_current_context().exit(1)
-
-    def start_debugger(self, gateway, files):
-        """
-            Start the debugger on the gateway
-        """
-        url = 'gateway/{}/start-debugger'.format(quote(gateway))
-        return self.post(url, files=files)
-
-    def stop_debugger(self, gateway):
-        """
-            Stop the debugger on the gateway
-        """
-        url = 'gateway/{}/stop-debugger'.format(quote(gateway))
-        return self.post(url)
-
-    def erase_dut(self, gateway, addresses):
-        """
-            Erase DUT connected to gateway
-        """
-        url = 'gateway/{}/erase-duck'.format(quote(gateway))
-        return self.post(url, json=addresses, stream=True)
-
-    def flash_dut(self, gateway, files):
-        """
-            Flash DUT connected to gateway
-        """
-        url = 'gateway/{}/flash-duck'.format(quote(gateway))
-        return self.post(url, files=files, stream=True)
-
-    def run_python(self, gateway, files):
-        """
-            Run python on a gateway
-        """
-        url = 'gateway/{}/run-python'.format(quote(gateway))
-        return self.post(url, files=files, stream=True)
-
-    def kill_python(self, gateway, sig=signal.SIGTERM):
-        """
-            Run python on a gateway
-        """
-        url = 'gateway/{}/kill-python'.format(quote(gateway))
-        return self.post(url, json={'signal': sig})
-
-    def gateway_hello(self, gateway):
-        """
-            Say hello to gateway to see if it is connected
-        """
-        url = 'gateway/{}/hello'.format(quote(gateway))
-        return self.get(url)
-
-    def serial_numbers(self, gateway, model):
-        """
-            Get serial numbers of devices attached to gateway
-        """
-        url = 'gateway/{}/serial-numbers'.format(quote(gateway))
-        return self.get(url, params={'model': model})
-
-    def serial_ports(self, gateway):
-        """
-            Get serial port devices attached to gateway
-        """
-        url = 'gateway/{}/serial-ports'.format(quote(gateway))
-        return self.get(url)
-
-    def gateway_status(self, gateway):
-        """
-            Get debugger status on gateway
-        """
-        url = 'gateway/{}/status'.format(quote(gateway))
-        return self.get(url)
-
-    def list_gateways(self):
-        """
-            Get all gateways for logged-in user
-        """
-        url = 'gateway/list'
-        return self.get(url)
-
-    def reset_dut(self, gateway, halt):
-        """
-            Reset the DUT attached to a gateway and optionally halt it
-        """
-        url = 'gateway/{}/reset-duck'.format(quote(gateway))
-        return self.post(url, json={'halt': halt})
-
-    def run_dut(self, gateway):
-        """
-            Run the DUT attached to a gateway
-        """
-        url = 'gateway/{}/run-duck'.format(quote(gateway))
-        return self.post(url, stream=True)
-
-    def uart_gateway(self, gateway, serial_options, test_runner):
-        """
-            Open a connection to gateway serial port
-        """
-        url = 'gateway/{}/uart-duck'.format(quote(gateway))
-
-        if test_runner == 'none':
-            test_runner = None
-        json_data = {
-            'serial_options': serial_options,
-            'test_runner': test_runner,
-        }
-        return self.post(url, json=json_data)
-
-    def rename_gateway(self, gateway, new_name):
-        """
-            Rename a gateway
-        """
-        url = 'gateway/{}/rename'.format(quote(gateway))
-        return self.post(url, json={'name': new_name})
-
-    def start_local_gdb_tunnel(self, gateway, fork):
-        """
-            Start the local gdb tunnel on gateway
-        """
-        url = 'gateway/{}/local-gdb'.format(quote(gateway))
-        return self.post(url, json={'fork': fork})
-
-    def gpio_set(self, gateway, gpio, type_, pull):
-        """
-            Set a GPIO pin to input or output
-        """
-        url = 'gateway/{}/gpio/set'.format(quote(gateway))
-        return self.post(url, json={'gpio': gpio, 'type': type_, 'pull': pull})
-
-    def gpio_input(self, gateway, gpio):
-        """
-            Read from the GPIO pin
-        """
-        url = 'gateway/{}/gpio/input'.format(quote(gateway))
-        return self.post(url, json={'gpio': gpio})
-
-    def gpio_output(self, gateway, gpio, level):
-        """
-            Write to the GPIO pin
-        """
-        url = 'gateway/{}/gpio/output'.format(quote(gateway))
-        return self.post(url, json={'gpio': gpio, 'level': level})
-
-    def gpio_servo(self, gateway, gpio, pulsewidth, stop):
-        """
-            Control a servo with GPIO
-        """
-        url = 'gateway/{}/gpio/servo'.format(quote(gateway))
-        return self.post(url, json={'gpio': gpio, 'pulsewidth': pulsewidth, 'stop': stop})
-
-    def gpio_trigger(self, gateway, gpio, pulse_length, level):
-        """
-            Send a trigger pulse on GPIO
-        """
-        url = 'gateway/{}/gpio/trigger'.format(quote(gateway))
-        return self.post(url, json={'gpio': gpio, 'pulse_length': pulse_length, 'level': level})
-
-    def gpio_hardware_pwm(self, gateway, frequency, dutycycle):
-        """
-            Start hardware PWM on gpio
-        """
-        url = 'gateway/{}/gpio/hardware-pwm'.format(quote(gateway))
-        return self.post(url, json={'frequency': frequency, 'dutycycle': dutycycle})
-
-    def gpio_hardware_clock(self, gateway, frequency):
-        """
-            Start hardware clock on gpio
-        """
-        url = 'gateway/{}/gpio/hardware-clock'.format(quote(gateway))
-        return self.post(url, json={'frequency': frequency})
-
-    def get_wifi_state(self, gateway):
-        """
-            Get the connection state of the specified gateway
-        """
-        url = 'gateway/{}/wifi/state'.format(quote(gateway))
-        return self.get(url)
-
-    def get_wifi_access_points(self, gateway):
-        """
-            Get access points visible to the specified gateway
-        """
-        url = 'gateway/{}/wifi/access-points'.format(quote(gateway))
-        return self.get(url)
-
-    def connect_wifi(self, gateway, ssid, password):
-        """
-            Connect the gateway to a wifi network
-        """
-        url = 'gateway/{}/wifi/connect'.format(quote(gateway))
-        return self.post(url, json={'ssid': ssid, 'password': password})
-
-    def delete_wifi_connection(self, gateway, ssid):
-        """
-            Delete the wifi connection for the specified gateway
-        """
-        url = 'gateway/{}/wifi/delete-connection'.format(quote(gateway))
-        return self.post(url, json={'ssid': ssid})
-
-    def can_up(self, gateway, bitrate, interfaces):
-        """
-            Bring up the CAN bus
-        """
-        url = 'gateway/{}/canbus/up'.format(quote(gateway))
-        return self.post(url, json={'bitrate': bitrate, 'interfaces': interfaces})
-
-    def can_down(self, gateway, interfaces):
-        """
-            Bring down the CAN bus
-        """
-        url = 'gateway/{}/canbus/down'.format(quote(gateway))
-        return self.post(url, json={'interfaces': interfaces})
-
-    def can_list(self, gateway):
-        """
-            List can buses
-        """
-        url = 'gateway/{}/canbus/list'.format(quote(gateway))
-        return self.get(url)
-
-    def can_send(self, gateway, interface, frames):
-        """
-            Send one or more frames on CAN bus
-        """
-        url = 'gateway/{}/canbus/send'.format(quote(gateway))
-        frames = [frame._asdict() for frame in frames]
-        return self.post(url, json={'interface': interface, 'frames': frames})
-
-    def can_dump(self, gateway, interface, can_options):
-        """
-            Dump frames from CAN bus
-        """
-        url = 'gateway/{}/canbus/dump'.format(quote(gateway))
-        return self.post(url, json={'interface': interface, 'can_options': can_options})
-
-    def read_adc(self, gateway, channel, average_count, output):
-        """
-            Read the ADC
-        """
-        data = {
-            'channel': channel,
-            'average_count': average_count,
-            'output': output
-        }
-        url = 'gateway/{}/adc/read'.format(quote(gateway))
-        return self.post(url, json=data)
-
-    def reboot_gateway(self, gateway):
-        """
-            Reboot gateway
-        """
-        url = 'gateway/{}/reboot'.format(quote(gateway))
-        return self.post(url)
-
-    def shutdown_gateway(self, gateway):
-        """
-            shutdown gateway
-        """
-        url = 'gateway/{}/poweroff'.format(quote(gateway))
-        return self.post(url)
+    if not _warm_sessions:
+        return
+    for session in _warm_sessions.values():
+        session.close()
+    _warm_sessions.clear()
 
 class LagerContext:  # pylint: disable=too-few-public-methods
     """
@@ -441,8 +48,9 @@ class LagerContext:  # pylint: disable=too-few-public-methods
     """
     def __init__(self, ctx, auth, defaults, debug, style):
         ws_host = os.getenv('LAGER_WS_HOST', _DEFAULT_WEBSOCKET_HOST)
-        response_hook = functools.partial(LagerSession.handle_errors, ctx)
-        self.session = LagerSession(auth, response_hook=response_hook)
+        self._ctx = ctx
+        self._auth = auth
+        self._session = None
         self.defaults = defaults
         self.style = style
         self.ws_host = ws_host
@@ -450,6 +58,26 @@ class LagerContext:  # pylint: disable=too-few-public-methods
         if auth:
             self.auth_token = auth['token']
 
+    @property
+    def session(self):
+        """
+            API session, created on first use so that commands which never talk to the
+            API don't pay for importing and setting up ``requests``
+        """
+        if self._session is None:
+            from .session import LagerSession  # pylint: disable=import-outside-toplevel
+            response_hook = functools.partial(LagerSession.handle_errors, self._ctx)
+            token = self._auth['token'] if self._auth else None
+            if _warm_sessions is not None and token in _warm_sessions:
+                self._session = _warm_sessions[token]
+                self._session.rebind(response_hook)
+            else:
+                self._session = LagerSession(self._auth, response_hook=response_hook)
+                if _warm_sessions is not None:
+                    _warm_sessions[token] = self._session
+            self._session.debug = self.debug
+        return self._session
+
     @property
     def default_gateway(self):
         """
@@ -467,12 +95,11 @@ class LagerContext:  # pylint: disable=too-few-public-methods
         """
         if socktype == 'job':
             path = f'/ws/job/{kwargs["job_id"]}'
-        elif socktype == 'jl-tunnel':
-            path = f'/ws/gateway/{kwargs["gateway_id"]}/gdb-tunnel/2331'
-        elif socktype == 'gdb-tunnel':
-            path = f'/ws/gateway/{kwargs["gateway_id"]}/gdb-tunnel/3333'
-        elif socktype == 'openocd-tunnel':
-            path = f'/ws/gateway/{kwargs["gateway_id"]}/gdb-tunnel/4444'
+        elif socktype in TUNNEL_PORTS:
+            remote_port = kwargs.get('remote_port', TUNNEL_PORTS[socktype])
+            path = f'/ws/gateway/{kwargs["gateway_id"]}/gdb-tunnel/{remote_port}'
+        elif socktype == 'tunnel-mux':
+            path = f'/ws/gateway/{kwargs["gateway_id"]}/tunnel-mux'
         else:
             raise ValueError(f'Invalid websocket type: {socktype}')
         uri = urllib.parse.urljoin(self.ws_host, path)
@@ -480,7 +107,7 @@ class LagerContext:  # pylint: disable=too-few-public-methods
         headers = [
             (b'authorization', self.session.headers['Authorization'].encode()),
         ]
-        ctx = get_ssl_context()
+        ctx = get_ssl_context() if uri.startswith('wss:') else None
 
         return (uri, dict(extra_headers=headers, ssl_context=ctx))
 
@@ -493,11 +120,10 @@ def get_default_gateway(ctx):
     if name is None:
         name = ctx.obj.default_gateway
 
+    from .gateways import list_gateways, resolve_gateway  # pylint: disable=import-outside-toplevel
+
     if name is None:
-        session = ctx.obj.session
-        resp = session.list_gateways()
-        resp.raise_for_status()
-        gateways = resp.json()['gateways']
+        gateways = list_gateways(ctx)
 
         if not gateways:
             click.secho('No gateways found! Please contact support@lagerdata.com', fg='red')
@@ -513,20 +139,155 @@ def get_default_gateway(ctx):
             ctx=ctx,
             param_type='argument',
         )
-    return name
+    # A configured default may be a gateway missing from the listing (shared, or on a
+    # later page); leave it to the API rather than rejecting it here
+    return resolve_gateway(ctx, name)
+
+class _ResumingConnection:
+    """
+        Mixin for the SSL objects and sockets of a ResumingSSLContext: reports the
+        handshake outcome and hands the TLS session to the context once it carries a
+        ticket. TLS 1.3 tickets arrive after the handshake, so reads check too.
+    """
+    _entry = None
+    _session_saved = False
+
+    def _handshake_done(self):
+        if self._entry is None:
+            return
+        if self._entry[1] is None:
+            self._entry[1] = self.session_reused
+        self._save_session()
+
+    def _save_session(self):
+        if self._session_saved or self._entry is None:
+            return
+        session = self.session
+        if session is not None and session.has_ticket:
+            self.context.remember_session(self._entry[0], session)
+            self._session_saved = True
+
+    def do_handshake(self, *args, **kwargs):
+        super().do_handshake(*args, **kwargs)
+        self._handshake_done()
+
+    def read(self, *args, **kwargs):
+        data = super().read(*args, **kwargs)
+        self._save_session()
+        return data
+
+class _ResumingSSLObject(_ResumingConnection, ssl.SSLObject):
+    pass
+
+class _ResumingSSLSocket(_ResumingConnection, ssl.SSLSocket):
+    pass
+
+class ResumingSSLContext(ssl.SSLContext):
+    """
+        Client SSL context that offers the most recent TLS session for a host when opening
+        another connection to it, so reconnects can skip the full handshake. Only the
+        ssl.SSLSession objects are kept, never the connections themselves.
+    """
+    sslobject_class = _ResumingSSLObject
+    sslsocket_class = _ResumingSSLSocket
+
+    def __init__(self, *args, **kwargs):  # pylint: disable=unused-argument
+        super().__init__()
+        self._sessions = {}
+        self.connections = collections.deque(maxlen=256)
+
+    def remember_session(self, server_hostname, session):
+        self._sessions[server_hostname] = session
+
+    def _track(self, server_hostname):
+        entry = [server_hostname, None]
+        self.connections.append(entry)
+        return entry
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        if server_side:
+            return super().wrap_bio(incoming, outgoing, server_side=server_side,
+                                    server_hostname=server_hostname, session=session)
+        if session is None:
+            session = self._sessions.get(server_hostname)
+        sslobj = super().wrap_bio(incoming, outgoing, server_side=server_side,
+                                  server_hostname=server_hostname, session=session)
+        sslobj._entry = self._track(server_hostname)  # pylint: disable=protected-access
+        return sslobj
+
+    def wrap_socket(self, sock, server_side=False, do_handshake_on_connect=True,  # pylint: disable=arguments-differ
+                    suppress_ragged_eofs=True, server_hostname=None, session=None):
+        if server_side:
+            return super().wrap_socket(sock, server_side=server_side, do_handshake_on_connect=do_handshake_on_connect,
+                                       suppress_ragged_eofs=suppress_ragged_eofs,
+                                       server_hostname=server_hostname, session=session)
+        if session is None:
+            session = self._sessions.get(server_hostname)
+        sslsock = super().wrap_socket(sock, server_side=server_side, do_handshake_on_connect=do_handshake_on_connect,
+                                      suppress_ragged_eofs=suppress_ragged_eofs,
+                                      server_hostname=server_hostname, session=session)
+        sslsock._entry = self._track(server_hostname)  # pylint: disable=protected-access
+        if sslsock.version():
+            # The handshake happened while the socket was being created
+            sslsock._handshake_done()  # pylint: disable=protected-access
+        return sslsock
+
+    def session_report(self):
+        """
+            (host, resumed) for each connection made with this context. ``resumed`` is None
+            if the handshake never completed.
+        """
+        return [(host, resumed) for (host, resumed) in self.connections]
 
 def get_ssl_context():
     """
-        Get an SSL context, with custom CA cert if necessary
+        Get the process-wide SSL context. It trusts the certifi bundle, which the
+        HTTP requests always trusted, plus the CA certs in LAGER_CAFILE_PATH if set
+        or else the system CA certs, which the websockets trusted.
     """
-    cafile_path = os.getenv('LAGER_CAFILE_PATH')
-    if not cafile_path:
-        # Use default system CA certs
-        return None
-    ctx = ssl.create_default_context()
-    ctx.load_verify_locations(cafile=cafile_path)
+    return _build_ssl_context(os.getenv('LAGER_CAFILE_PATH'))
+
+@functools.lru_cache(maxsize=None)
+def _build_ssl_context(cafile_path):
+    import certifi  # pylint: disable=import-outside-toplevel
+    ctx = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    if cafile_path:
+        ctx.load_verify_locations(cafile=cafile_path)
+    else:
+        ctx.load_default_certs()
+    ctx.load_verify_locations(cafile=certifi.where())
     return ctx
 
+@functools.lru_cache(maxsize=None)
+def get_ca_path_ssl_context(path):
+    """
+        SSL context trusting only the CA file or directory `path`, for requests
+        made with an explicit CA bundle (e.g. REQUESTS_CA_BUNDLE)
+    """
+    ctx = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    if os.path.isdir(path):
+        ctx.load_verify_locations(capath=path)
+    else:
+        ctx.load_verify_locations(cafile=path)
+    return ctx
+
+def print_ssl_session_report():
+    """
+        Print whether each TLS connection made by this process resumed a previous session
+    """
+    if not _build_ssl_context.cache_info().currsize:
+        return
+    report = get_ssl_context().session_report()
+    if not report:
+        return
+    click.echo('---- TLS connections ----', err=True)
+    for (host, resumed) in report:
+        if resumed is None:
+            state = 'no handshake'
+        else:
+            state = 'resumed' if resumed else 'full handshake'
+        click.echo(f'{host}: {state}', err=True)
+
 def ensure_debugger_running(gateway, ctx):
     """
         Ensure debugger is running on a given gateway
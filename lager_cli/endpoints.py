@@ -0,0 +1,285 @@
+"""
+    lager.endpoints
+
+    Lager API endpoints, shared by the sync and async clients
+"""
+import signal
+import urllib.parse
+
+
+def quote(gateway):
+    return urllib.parse.quote(str(gateway), safe='')
+
+
+class LagerEndpoints:
+    """
+        Endpoint methods. They only build the request and hand it to ``self.get`` /
+        ``self.post``, so they return a response for LagerSession and an awaitable
+        for AsyncLagerClient.
+    """
+
+    def start_debugger(self, gateway, files):
+        """
+            Start the debugger on the gateway
+        """
+        url = 'gateway/{}/start-debugger'.format(quote(gateway))
+        return self.post(url, files=files)
+
+    def stop_debugger(self, gateway):
+        """
+            Stop the debugger on the gateway
+        """
+        url = 'gateway/{}/stop-debugger'.format(quote(gateway))
+        return self.post(url)
+
+    def erase_dut(self, gateway, addresses):
+        """
+            Erase DUT connected to gateway
+        """
+        url = 'gateway/{}/erase-duck'.format(quote(gateway))
+        return self.post(url, json=addresses, stream=True)
+
+    def flash_dut(self, gateway, files):
+        """
+            Flash DUT connected to gateway
+        """
+        url = 'gateway/{}/flash-duck'.format(quote(gateway))
+        return self.post(url, files=files, stream=True)
+
+    def upload_blob(self, gateway, digest, data):
+        """
+            Store an image on the gateway under its sha256 digest
+        """
+        url = 'gateway/{}/blobs'.format(quote(gateway))
+        headers = {'Content-Type': 'application/octet-stream'}
+        return self.post(url, params={'sha256': digest}, data=data, headers=headers)
+
+    def run_python(self, gateway, files):
+        """
+            Run python on a gateway
+        """
+        url = 'gateway/{}/run-python'.format(quote(gateway))
+        return self.post(url, files=files, stream=True)
+
+    def kill_python(self, gateway, sig=signal.SIGTERM):
+        """
+            Run python on a gateway
+        """
+        url = 'gateway/{}/kill-python'.format(quote(gateway))
+        return self.post(url, json={'signal': sig})
+
+    def gateway_hello(self, gateway):
+        """
+            Say hello to gateway to see if it is connected
+        """
+        url = 'gateway/{}/hello'.format(quote(gateway))
+        return self.get(url)
+
+    def serial_numbers(self, gateway, model):
+        """
+            Get serial numbers of devices attached to gateway
+        """
+        url = 'gateway/{}/serial-numbers'.format(quote(gateway))
+        return self.get(url, params={'model': model})
+
+    def serial_ports(self, gateway):
+        """
+            Get serial port devices attached to gateway
+        """
+        url = 'gateway/{}/serial-ports'.format(quote(gateway))
+        return self.get(url)
+
+    def gateway_status(self, gateway):
+        """
+            Get debugger status on gateway
+        """
+        url = 'gateway/{}/status'.format(quote(gateway))
+        return self.get(url)
+
+    def list_gateways(self):
+        """
+            Get all gateways for logged-in user
+        """
+        url = 'gateway/list'
+        return self.get(url)
+
+    def reset_dut(self, gateway, halt):
+        """
+            Reset the DUT attached to a gateway and optionally halt it
+        """
+        url = 'gateway/{}/reset-duck'.format(quote(gateway))
+        return self.post(url, json={'halt': halt})
+
+    def run_dut(self, gateway):
+        """
+            Run the DUT attached to a gateway
+        """
+        url = 'gateway/{}/run-duck'.format(quote(gateway))
+        return self.post(url, stream=True)
+
+    def uart_gateway(self, gateway, serial_options, test_runner):
+        """
+            Open a connection to gateway serial port
+        """
+        url = 'gateway/{}/uart-duck'.format(quote(gateway))
+
+        if test_runner == 'none':
+            test_runner = None
+        json_data = {
+            'serial_options': serial_options,
+            'test_runner': test_runner,
+        }
+        return self.post(url, json=json_data)
+
+    def rename_gateway(self, gateway, new_name):
+        """
+            Rename a gateway
+        """
+        url = 'gateway/{}/rename'.format(quote(gateway))
+        return self.post(url, json={'name': new_name})
+
+    def start_local_gdb_tunnel(self, gateway, fork):
+        """
+            Start the local gdb tunnel on gateway
+        """
+        url = 'gateway/{}/local-gdb'.format(quote(gateway))
+        return self.post(url, json={'fork': fork})
+
+    def gpio_set(self, gateway, gpio, type_, pull):
+        """
+            Set a GPIO pin to input or output
+        """
+        url = 'gateway/{}/gpio/set'.format(quote(gateway))
+        return self.post(url, json={'gpio': gpio, 'type': type_, 'pull': pull})
+
+    def gpio_input(self, gateway, gpio):
+        """
+            Read from the GPIO pin
+        """
+        url = 'gateway/{}/gpio/input'.format(quote(gateway))
+        return self.post(url, json={'gpio': gpio})
+
+    def gpio_output(self, gateway, gpio, level):
+        """
+            Write to the GPIO pin
+        """
+        url = 'gateway/{}/gpio/output'.format(quote(gateway))
+        return self.post(url, json={'gpio': gpio, 'level': level})
+
+    def gpio_servo(self, gateway, gpio, pulsewidth, stop):
+        """
+            Control a servo with GPIO
+        """
+        url = 'gateway/{}/gpio/servo'.format(quote(gateway))
+        return self.post(url, json={'gpio': gpio, 'pulsewidth': pulsewidth, 'stop': stop})
+
+    def gpio_trigger(self, gateway, gpio, pulse_length, level):
+        """
+            Send a trigger pulse on GPIO
+        """
+        url = 'gateway/{}/gpio/trigger'.format(quote(gateway))
+        return self.post(url, json={'gpio': gpio, 'pulse_length': pulse_length, 'level': level})
+
+    def gpio_hardware_pwm(self, gateway, frequency, dutycycle):
+        """
+            Start hardware PWM on gpio
+        """
+        url = 'gateway/{}/gpio/hardware-pwm'.format(quote(gateway))
+        return self.post(url, json={'frequency': frequency, 'dutycycle': dutycycle})
+
+    def gpio_hardware_clock(self, gateway, frequency):
+        """
+            Start hardware clock on gpio
+        """
+        url = 'gateway/{}/gpio/hardware-clock'.format(quote(gateway))
+        return self.post(url, json={'frequency': frequency})
+
+    def get_wifi_state(self, gateway):
+        """
+            Get the connection state of the specified gateway
+        """
+        url = 'gateway/{}/wifi/state'.format(quote(gateway))
+        return self.get(url)
+
+    def get_wifi_access_points(self, gateway):
+        """
+            Get access points visible to the specified gateway
+        """
+        url = 'gateway/{}/wifi/access-points'.format(quote(gateway))
+        return self.get(url)
+
+    def connect_wifi(self, gateway, ssid, password):
+        """
+            Connect the gateway to a wifi network
+        """
+        url = 'gateway/{}/wifi/connect'.format(quote(gateway))
+        return self.post(url, json={'ssid': ssid, 'password': password})
+
+    def delete_wifi_connection(self, gateway, ssid):
+        """
+            Delete the wifi connection for the specified gateway
+        """
+        url = 'gateway/{}/wifi/delete-connection'.format(quote(gateway))
+        return self.post(url, json={'ssid': ssid})
+
+    def can_up(self, gateway, bitrate, interfaces):
+        """
+            Bring up the CAN bus
+        """
+        url = 'gateway/{}/canbus/up'.format(quote(gateway))
+        return self.post(url, json={'bitrate': bitrate, 'interfaces': interfaces})
+
+    def can_down(self, gateway, interfaces):
+        """
+            Bring down the CAN bus
+        """
+        url = 'gateway/{}/canbus/down'.format(quote(gateway))
+        return self.post(url, json={'interfaces': interfaces})
+
+    def can_list(self, gateway):
+        """
+            List can buses
+        """
+        url = 'gateway/{}/canbus/list'.format(quote(gateway))
+        return self.get(url)
+
+    def can_send(self, gateway, interface, frames):
+        """
+            Send one or more frames on CAN bus
+        """
+        url = 'gateway/{}/canbus/send'.format(quote(gateway))
+        frames = [frame._asdict() for frame in frames]
+        return self.post(url, json={'interface': interface, 'frames': frames})
+
+    def can_dump(self, gateway, interface, can_options):
+        """
+            Dump frames from CAN bus
+        """
+        url = 'gateway/{}/canbus/dump'.format(quote(gateway))
+        return self.post(url, json={'interface': interface, 'can_options': can_options})
+
+    def read_adc(self, gateway, channel, average_count, output):
+        """
+            Read the ADC
+        """
+        data = {
+            'channel': channel,
+            'average_count': average_count,
+            'output': output
+        }
+        url = 'gateway/{}/adc/read'.format(quote(gateway))
+        return self.post(url, json=data)
+
+    def reboot_gateway(self, gateway):
+        """
+            Reboot gateway
+        """
+        url = 'gateway/{}/reboot'.format(quote(gateway))
+        return self.post(url)
+
+    def shutdown_gateway(self, gateway):
+        """
+            shutdown gateway
+        """
+        url = 'gateway/{}/poweroff'.format(quote(gateway))
+        return self.post(url)
@@ -3,24 +3,123 @@
 
     Commands for erasing a DUT
 """
+import os
 import click
+import requests
+from .. import SUPPORTED_DEVICES
 from ..context import get_default_gateway
-from ..paramtypes import MemoryAddressType
+from ..endpoints import quote
+from ..fanout import fan_out
+from ..paramtypes import MemoryAddressType, HexParamType
 from ..util import stream_output
+from ..flash.delta import forget_flash_state
+from ..flash.images import ImageFormatError, Segment, load_segments
+from ..flash.sectors import UnknownGeometryError, connected_device, merge_ranges, touched_sectors
 
+class _RangeByRange:  # pylint: disable=too-few-public-methods
+    """
+        Erase output of one request per range, streamed like a single response
+    """
+    def __init__(self, session, gateway, addresses):
+        self.session = session
+        self.gateway = gateway
+        self.addresses = addresses
+
+    def iter_content(self, chunk_size=1):
+        for address in self.addresses:
+            yield from self.session.erase_dut(self.gateway, addresses=address).iter_content(chunk_size=chunk_size)
+
+def do_erase(session, gateway, ranges, forget=True):
+    """
+        Erase (start, length) `ranges`, with a single request if the gateway takes
+        a list of ranges. Unless `forget` is False, drop the delta flash records
+        of the gateway, which no longer match the flash.
+    """
+    addresses = [dict(start_addr=start, length=length) for start, length in ranges]
+    if forget:
+        forget_flash_state(gateway)
+    if len(addresses) == 1:
+        return session.erase_dut(gateway, addresses=addresses[0])
+
+    url = 'gateway/{}/erase-duck'.format(quote(gateway))
+    try:
+        resp = session.post(url, json=addresses, stream=True, quiet=True)
+    except requests.exceptions.ConnectionError:
+        # Repeat the request with the usual error reporting
+        return session.erase_dut(gateway, addresses=addresses)
+    if 400 <= resp.status_code < 500 and resp.status_code != 404:
+        # Older gateways reject the list form; erase one range at a time
+        resp.close()
+        return _RangeByRange(session, gateway, addresses)
+    return session.handle_response(resp)
+
+def image_segments(value):
+    """
+        Segments of `value`: a hex or ELF file, or `<binfile>,<address>`
+    """
+    path, _, address = value.rpartition(',')
+    if path and os.path.isfile(path) and not os.path.isfile(value):
+        try:
+            address = HexParamType().convert(address, None, None)
+        except click.BadParameter:
+            raise ImageFormatError(f'{value}: invalid address {address}') from None
+        with open(path, 'rb') as f:
+            return [Segment(address, f.read())]
+    if not os.path.isfile(value):
+        raise ImageFormatError(f'{value}: no such file')
+    return load_segments(value)
+
+def erase_ranges(device, images):
+    """
+        Smallest set of sector-aligned (start, length) ranges covering `images`
+    """
+    segments = [segment for image in images for segment in image_segments(image)]
+    return merge_ranges(touched_sectors(device, segments))
+
+@fan_out
 @click.command()
 @click.pass_context
 @click.option('--gateway', required=False, help='ID of gateway to which DUT is connected')
-@click.argument('start_addr', type=MemoryAddressType())
-@click.argument('length', type=MemoryAddressType())
-def erase(ctx, gateway, start_addr, length):
+@click.option(
+    '--for-image', 'for_image', multiple=True, metavar='FILE',
+    help='Erase only the flash sectors this hex or ELF file (or `<binfile>,<address>`) occupies. '
+         'May be passed multiple times.')
+@click.option('--device', type=click.Choice(SUPPORTED_DEVICES),
+              help='Target device type, for --for-image. Default: the device last used with `lager connect`')
+@click.argument('start_addr', type=MemoryAddressType(), required=False)
+@click.argument('length', type=MemoryAddressType(), required=False)
+def erase(ctx, gateway, for_image, device, start_addr, length):
     """
         Erase DUT
     """
+    if for_image and start_addr is not None:
+        raise click.UsageError('Pass either START_ADDR and LENGTH or --for-image, not both')
+    if not for_image and (start_addr is None or length is None):
+        raise click.UsageError('Missing START_ADDR and LENGTH')
+
     if gateway is None:
         gateway = get_default_gateway(ctx)
 
+    if for_image:
+        device = device or connected_device(gateway)
+        if device is None:
+            click.secho('--for-image needs the target device type: pass --device, or connect with '
+                        '`lager connect --device`', fg='red', err=True)
+            ctx.exit(1)
+        try:
+            ranges = erase_ranges(device, for_image)
+        except (ImageFormatError, UnknownGeometryError) as exc:
+            click.secho(str(exc), fg='red', err=True)
+            ctx.exit(1)
+        if not ranges:
+            click.echo('Nothing to erase', err=True)
+            return
+        if ctx.obj.debug:
+            for start, size in ranges:
+                click.echo(f'Erasing {start:#010x}-{start + size:#010x}', err=True)
+    else:
+        ranges = [(start_addr, length)]
+
     session = ctx.obj.session
-    addresses = dict(start_addr=start_addr, length=length)
-    resp = session.erase_dut(gateway, addresses=addresses)
+    resp = do_erase(session, gateway, ranges)
     stream_output(resp)
@@ -1,5 +1,35 @@
 class GatewayTimeoutError(RuntimeError):
     pass
 
+class BlobNotFoundError(RuntimeError):
+    """
+        A flash request referred to an image by digest that the gateway no longer holds
+    """
+
 class OutputFormatNotSupported(Exception):
     pass
+
+class LagerAPIError(Exception):
+    """
+        Error response from the Lager API
+    """
+    def __init__(self, message, status_code=None, code=None, details=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+        self.details = details
+
+class GatewayNotFoundError(LagerAPIError):
+    pass
+
+class LagerServerError(LagerAPIError):
+    pass
+
+class LagerConnectionError(LagerAPIError):
+    pass
+
+class LagerConnectTimeout(LagerConnectionError):
+    pass
+
+class LagerRequestTimeout(LagerConnectionError):
+    pass
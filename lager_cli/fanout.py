@@ -0,0 +1,211 @@
+"""
+    lager.fanout
+
+    Run a gateway command on many gateways at once
+"""
+import io
+import time
+import fnmatch
+import functools
+import threading
+import concurrent.futures
+import click
+from .invoke import redirect_output, call_captured
+from .gateways import list_gateways, resolve_gateway
+
+DEFAULT_JOBS = 8
+_GLOB_CHARS = frozenset('*?[')
+PREFIX_COLORS = ('cyan', 'magenta', 'yellow', 'blue', 'green')
+
+_output_lock = threading.Lock()
+
+
+class PrefixedWriter(io.RawIOBase):
+    """
+        Writes complete lines to `target` (a binary stream) with `prefix` in front,
+        so concurrent gateways never interleave within a line
+    """
+    def __init__(self, target, prefix):
+        super().__init__()
+        self._target = target
+        self._prefix = prefix
+        self._pending = b''
+
+    def writable(self):
+        return True
+
+    def isatty(self):
+        return False
+
+    def write(self, b):
+        data = bytes(b)
+        *lines, self._pending = (self._pending + data).split(b'\n')
+        if lines:
+            self._emit(b''.join(self._prefix + line + b'\n' for line in lines))
+        return len(data)
+
+    def finish(self):
+        """
+            Write out a trailing partial line
+        """
+        if self._pending:
+            pending, self._pending = self._pending, b''
+            self._emit(self._prefix + pending + b'\n')
+
+    def _emit(self, data):
+        with _output_lock:
+            self._target.write(data)
+            self._target.flush()
+
+
+def _prefixed_stream(target, prefix):
+    raw = PrefixedWriter(target, prefix)
+    return raw, io.TextIOWrapper(raw, encoding='utf-8', errors='replace', write_through=True)
+
+
+class FanOutResult:  # pylint: disable=too-few-public-methods
+    """
+        Outcome of running the command against one gateway
+    """
+    def __init__(self, label, exit_code, duration, error=None):
+        self.label = label
+        self.exit_code = exit_code
+        self.duration = duration
+        self.error = error
+
+
+def resolve_gateways(ctx, patterns, all_gateways):
+    """
+        Expand --gateway values and --all into [(label, gateway id)]. Globs are matched
+        against gateway names and ids; plain values are resolved through the gateway cache.
+    """
+    needs_list = all_gateways or any(_GLOB_CHARS & set(pattern) for pattern in patterns)
+    gateways = list_gateways(ctx) if needs_list else []
+
+    targets = []
+    if all_gateways:
+        targets.extend((gateway['name'], str(gateway['id'])) for gateway in gateways)
+    for pattern in patterns:
+        if not _GLOB_CHARS & set(pattern):
+            targets.append((pattern, resolve_gateway(ctx, pattern)))
+            continue
+        matches = [
+            (gateway['name'], str(gateway['id'])) for gateway in gateways
+            if fnmatch.fnmatchcase(gateway['name'], pattern) or fnmatch.fnmatchcase(str(gateway['id']), pattern)
+        ]
+        if not matches:
+            click.secho(f'No gateways match `{pattern}`', fg='red', err=True)
+            ctx.exit(1)
+        targets.extend(matches)
+
+    unique = {}
+    for label, gateway in targets:
+        unique.setdefault(gateway, label)
+    return [(label, gateway) for gateway, label in unique.items()]
+
+
+def _run_one(ctx, callback, label, gateway, kwargs, prefix, stdout, stderr):
+    out_raw, out = _prefixed_stream(stdout, prefix)
+    err_raw, err = _prefixed_stream(stderr, prefix)
+    sub_ctx = click.Context(ctx.command, parent=ctx.parent, info_name=ctx.info_name, obj=ctx.obj)
+    sub_ctx.params = dict(ctx.params, gateway=gateway)
+    started = time.perf_counter()
+    with redirect_output(out, err):
+        with sub_ctx:
+            exit_code, error = call_captured(lambda: sub_ctx.invoke(callback, gateway=gateway, **kwargs))
+        if error:
+            err.write(error)
+    out_raw.finish()
+    err_raw.finish()
+    return FanOutResult(label, exit_code, time.perf_counter() - started, error)
+
+
+def run_fan_out(ctx, callback, targets, kwargs, jobs):
+    """
+        Run `callback` once per target on a bounded thread pool, sharing ctx.obj
+        (and so one API session). Output lines are prefixed with the gateway.
+    """
+    stdout = click.get_binary_stream('stdout')
+    stderr = click.get_binary_stream('stderr')
+    width = max(len(label) for label, _gateway in targets)
+    style = ctx.obj.style
+
+    # Make sure worker threads share one session rather than racing to create it
+    ctx.obj.session  # pylint: disable=pointless-statement
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = []
+        for i, (label, gateway) in enumerate(targets):
+            prefix = style(f'[{label:<{width}}]', fg=PREFIX_COLORS[i % len(PREFIX_COLORS)]) + ' '
+            futures.append(executor.submit(
+                _run_one, ctx, callback, label, gateway, kwargs, prefix.encode(), stdout, stderr))
+        try:
+            return [future.result() for future in futures]
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+            raise
+
+
+def print_summary(results, style):
+    """
+        Table of exit codes and durations, one row per gateway
+    """
+    from texttable import Texttable  # pylint: disable=import-outside-toplevel
+
+    table = Texttable()
+    table.set_deco(Texttable.HEADER)
+    table.set_cols_dtype(['t', 'i', 't'])
+    table.set_cols_align(['l', 'r', 'r'])
+    table.add_row(['gateway', 'exit code', 'duration'])
+    for result in results:
+        table.add_row([result.label, result.exit_code, f'{result.duration:.2f}s'])
+    click.echo(table.draw())
+    failed = sum(1 for result in results if result.exit_code != 0)
+    if failed:
+        click.echo(style(f'{failed} of {len(results)} gateways failed', fg='red'))
+
+
+def fan_out(command):
+    """
+        Let `command` run on several gateways: its --gateway option may be repeated
+        or given a glob over gateway names, and --all selects every gateway.
+        A single plain --gateway (or none) behaves exactly as before.
+    """
+    for param in command.params:
+        if param.name == 'gateway':
+            param.multiple = True
+            param.default = None
+            param.help = f'{param.help}. May be repeated or a glob over gateway names'
+            break
+    else:
+        raise TypeError(f'{command.name} has no --gateway option')
+
+    command.params.extend([
+        click.Option(['--all', 'all_gateways'], is_flag=True, default=False,
+                     help='Run on all of your gateways'),
+        click.Option(['--jobs'], type=click.IntRange(min=1), default=DEFAULT_JOBS, show_default=True,
+                     help='Maximum number of gateways to run on at once'),
+    ])
+
+    callback = command.callback
+
+    @functools.wraps(callback)
+    def fan_out_callback(gateway, all_gateways, jobs, **kwargs):
+        ctx = click.get_current_context()
+        patterns = gateway or ()
+        single = len(patterns) == 1 and not _GLOB_CHARS & set(patterns[0])
+        if not all_gateways and (not patterns or single):
+            gateway = resolve_gateway(ctx, patterns[0]) if patterns else None
+            ctx.params['gateway'] = gateway
+            return ctx.invoke(callback, gateway=gateway, **kwargs)
+
+        targets = resolve_gateways(ctx, patterns, all_gateways)
+        results = run_fan_out(ctx, callback, targets, kwargs, jobs)
+        print_summary(results, ctx.obj.style)
+        if any(result.exit_code != 0 for result in results):
+            ctx.exit(1)
+        return None
+
+    command.callback = fan_out_callback
+    return command
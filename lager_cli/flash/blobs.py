@@ -0,0 +1,193 @@
+"""
+    lager.flash.blobs
+
+    Content-addressed image uploads: images are identified by their sha256 digest
+    and only uploaded if the gateway doesn't already hold them
+"""
+import io
+import os
+import time
+import hashlib
+from ..cache import read_cache, write_cache
+from ..endpoints import quote
+
+HASH_CACHE_NAME = 'image-hashes.json'
+HASH_CACHE_ENTRIES = 512
+
+# Gateways that don't support content-addressed uploads, per API host; each is asked
+# again once its entry is older than BLOB_SUPPORT_TTL
+UNSUPPORTED_CACHE_NAME = 'blob-unsupported.json'
+BLOB_SUPPORT_TTL = 24 * 60 * 60
+_READ_SIZE = 1024 * 1024
+
+
+class Blob:
+    """
+        An image to upload: a file on disk or bytes in memory. The digest is computed
+        on first use.
+    """
+    def __init__(self, path=None, data=None, name=None):
+        self.path = path
+        self.data = data
+        self.name = name or (os.path.basename(path) if path is not None else 'image.bin')
+        self._digest = None
+
+    @property
+    def digest(self):
+        """
+            sha256 of the contents, as hex
+        """
+        if self._digest is None:
+            if self.path is not None:
+                self._digest = file_digest(self.path)
+            else:
+                self._digest = hashlib.sha256(self.data).hexdigest()
+        return self._digest
+
+    @property
+    def size(self):
+        if self.path is not None:
+            return os.path.getsize(self.path)
+        return len(self.data)
+
+    def open(self):
+        """
+            File-like object with the blob's contents
+        """
+        if self.path is not None:
+            return open(self.path, 'rb')
+        return io.BytesIO(self.data)
+
+    def read(self):
+        """
+            The blob's contents
+        """
+        if self.path is not None:
+            with open(self.path, 'rb') as f:
+                return f.read()
+        return self.data
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_READ_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def file_digest(path):
+    """
+        sha256 of the file at `path`. Digests are cached by path, mtime and size, so
+        an unchanged image is never re-read.
+    """
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    cached, _age = read_cache(HASH_CACHE_NAME)
+    cached = cached if isinstance(cached, dict) else {}
+    entry = cached.get(path)
+    if entry and entry.get('mtime_ns') == stat.st_mtime_ns and entry.get('size') == stat.st_size:
+        return entry['sha256']
+
+    digest = _hash_file(path)
+    cached.pop(path, None)
+    cached[path] = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': digest}
+    while len(cached) > HASH_CACHE_ENTRIES:
+        del cached[next(iter(cached))]
+    write_cache(HASH_CACHE_NAME, cached)
+    return digest
+
+def images_digest(hexfiles=(), binfiles=(), elffiles=()):
+    """
+        sha256 identifying a set of images: the contents of every hex and ELF file, and
+        of every (path, address) binary file with its address, in order. None if there
+        are no images.
+    """
+    parts = [f'hexfile:{file_digest(path)}' for path in hexfiles]
+    parts.extend(f'elffile:{file_digest(path)}' for path in elffiles)
+    parts.extend(f'binfile:{file_digest(path)}@{address:#x}' for path, address in binfiles)
+    if not parts:
+        return None
+    return hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+
+def _unsupported_key(session, gateway):
+    return f'{getattr(session, "base_url", "")} {gateway}'
+
+def _read_unsupported():
+    value, _age = read_cache(UNSUPPORTED_CACHE_NAME)
+    return value if isinstance(value, dict) else {}
+
+def blobs_unsupported(session, gateway):
+    """
+        Whether `gateway` recently answered that it doesn't support content-addressed
+        uploads
+    """
+    marked = _read_unsupported().get(_unsupported_key(session, gateway))
+    return marked is not None and 0 <= time.time() - marked < BLOB_SUPPORT_TTL
+
+def _mark_unsupported(session, gateway):
+    unsupported = _read_unsupported()
+    unsupported[_unsupported_key(session, gateway)] = time.time()
+    write_cache(UNSUPPORTED_CACHE_NAME, unsupported)
+
+def query_blobs(session, gateway, digests):
+    """
+        Set of `digests` the gateway already holds, or None if the gateway doesn't
+        support content-addressed uploads or couldn't be asked. A gateway that answers
+        without support (404 or 405) is remembered for BLOB_SUPPORT_TTL; until then it
+        isn't asked and `digests`, which may be a lazy iterable, isn't consumed, so no
+        image is hashed. Other errors aren't remembered.
+    """
+    import requests  # pylint: disable=import-outside-toplevel
+
+    if blobs_unsupported(session, gateway):
+        return None
+    url = 'gateway/{}/blobs/query'.format(quote(gateway))
+    try:
+        resp = session.post(url, json={'sha256': sorted(set(digests))}, quiet=True)
+    except requests.RequestException:
+        return None
+    if resp.status_code in (404, 405):
+        _mark_unsupported(session, gateway)
+        return None
+    if not resp.ok:
+        # Possibly transient (gateway timeout, auth); don't remember it
+        return None
+    try:
+        return set(resp.json()['present'])
+    except (ValueError, KeyError, TypeError):
+        _mark_unsupported(session, gateway)
+        return None
+
+class UploadSummary:  # pylint: disable=too-few-public-methods
+    """
+        Bytes uploaded and bytes skipped because the gateway already had them
+    """
+    def __init__(self, uploaded=0, skipped=0):
+        self.uploaded = uploaded
+        self.skipped = skipped
+
+    def __str__(self):
+        return f'uploaded {self.uploaded:,} bytes, skipped {self.skipped:,} bytes already on gateway'
+
+def upload_missing(session, gateway, blobs):
+    """
+        Upload the blobs the gateway doesn't hold yet. Returns an UploadSummary, or
+        None (having uploaded nothing) if the gateway doesn't support blobs
+    """
+    present = query_blobs(session, gateway, (blob.digest for blob in blobs))
+    if present is None:
+        return None
+
+    summary = UploadSummary()
+    seen = set()
+    for blob in blobs:
+        if blob.digest in seen:
+            continue
+        seen.add(blob.digest)
+        if blob.digest in present:
+            summary.skipped += blob.size
+            continue
+        with blob.open() as data:
+            session.upload_blob(gateway, blob.digest, data)
+        summary.uploaded += blob.size
+    return summary
@@ -3,30 +3,147 @@
 
     Commands for flashing a DUT
 """
-import itertools
+import os
+import time
 import click
+from .. import SUPPORTED_DEVICES
 from ..context import get_default_gateway
+from ..fanout import fan_out
 from ..util import stream_output
 from ..paramtypes import BinfileType
+from ..erase.commands import do_erase
+from ..exceptions import BlobNotFoundError
+from ..history.store import record_phase, recorded
+from .blobs import Blob, images_digest, upload_missing
+from .delta import dut_identity, flashed_sectors, forget_flash_state, plan_delta, record_delta
+from .images import FlashImage, ImageFormatError, load_segments
+from .pipeline import pipelined_flash
+from .sectors import UnknownGeometryError, connected_device, join_shared_sectors
 
-def do_flash(session, gateway, hexfile, binfile, preverify, verify):
+def collect_images(hexfile, binfile, elffile=(), convert=True, device=None):
     """
-        Perform the actual flash operation
+        Images to flash, in order. With `convert`, hex and ELF files are parsed locally
+        into their contiguous segments and sent as binary data, which is less than
+        half the size of the Intel HEX text. Segments of a file that share a flash
+        sector of `device` are sent as one image.
+    """
+    images = []
+    if convert:
+        for path in (*hexfile, *elffile):
+            for address, data in join_shared_sectors(load_segments(path), device):
+                name = f'{os.path.basename(path)}@{address:#010x}.bin'
+                images.append(FlashImage(Blob(data=data, name=name), address))
+    else:
+        images.extend(FlashImage(Blob(path=path), None) for path in hexfile)
+    images.extend(FlashImage(Blob(path=binf.path), binf.address) for binf in binfile)
+    return images
+
+def _upload_files(images):
+    files = [('hexfile', (image.blob.name, image.blob.open())) for image in images if image.address is None]
+    binaries = [image for image in images if image.address is not None]
+    files.extend(('binfile', (image.blob.name, image.blob.open())) for image in binaries)
+    files.extend(('binfile_address', image.address) for image in binaries)
+    return files
+
+def _blob_files(session, gateway, images):
+    """
+        Make sure the gateway holds every image, uploading only the ones it lacks, and
+        refer to them by digest. Returns (files, UploadSummary), or (None, None) if the
+        gateway doesn't support content-addressed uploads.
+    """
+    summary = upload_missing(session, gateway, [image.blob for image in images])
+    if summary is None:
+        return None, None
+
+    files = [('hexfile_sha256', image.blob.digest) for image in images if image.address is None]
+    binaries = [image for image in images if image.address is not None]
+    files.extend(('binfile_sha256', image.blob.digest) for image in binaries)
+    files.extend(('binfile_address', image.address) for image in binaries)
+    return files, summary
+
+def flash_files(session, gateway, images, preverify, verify, always_upload=False, debug=False):
     """
-    files = list(zip(itertools.repeat('hexfile'), [open(path, 'rb') for path in hexfile]))
-    files.extend(
-        zip(itertools.repeat('binfile'), [open(binf.path, 'rb') for binf in binfile])
-    )
-    files.extend(
-        zip(itertools.repeat('binfile_address'), [binf.address for binf in binfile])
-    )
+        Form fields of a request flashing `images` (FlashImage) in order. Images the
+        gateway lacks are uploaded now, unless it doesn't support content-addressed
+        uploads; then the images themselves are in the fields.
+    """
+    files = None
+    if not always_upload:
+        files, summary = _blob_files(session, gateway, images)
+        if debug and summary is not None:
+            click.echo(f'Images for gateway {gateway}: {summary}', err=True)
+    if files is None:
+        files = _upload_files(images)
     files.append(('preverify', preverify))
     files.append(('verify', verify))
     files.append(('force', False))
+    return files
+
+def send_flash(session, gateway, images, files, preverify, verify, debug=False):
+    """
+        Send the flash request with `files` from flash_files. If the gateway has
+        dropped an image it was asked for by digest since the upload, flash once more
+        with every image uploaded in the request itself.
+    """
+    try:
+        return session.flash_dut(gateway, files=files)
+    except BlobNotFoundError as exc:
+        click.secho(f'{exc}; uploading the images with the flash request', fg='yellow', err=True)
+        files = flash_files(session, gateway, images, preverify, verify, always_upload=True, debug=debug)
+        return session.flash_dut(gateway, files=files)
+
+def flash_images(session, gateway, images, preverify, verify, always_upload=False, debug=False):
+    """
+        Flash `images` (FlashImage) in order
+    """
+    started = time.monotonic()
+    files = flash_files(session, gateway, images, preverify, verify, always_upload, debug)
+    record_phase('upload', time.monotonic() - started)
+    return send_flash(session, gateway, images, files, preverify, verify, debug)
+
+def do_flash(session, gateway, hexfile, binfile, preverify, verify, always_upload=False, debug=False,
+             elffile=(), convert=True, device=None):
+    """
+        Perform the actual flash operation
+    """
+    images = collect_images(hexfile, binfile, elffile, convert, device or connected_device(gateway))
+    forget_flash_state(gateway)
+    return flash_images(session, gateway, images, preverify, verify, always_upload, debug)
+
+
+def _delta_flash(ctx, gateway, images, device, verify, always_upload):
+    """
+        Erase and program only the sectors that differ from what was last flashed
+    """
+    session = ctx.obj.session
+    dut = dut_identity(session, gateway)
+    if dut is None:
+        click.secho('Could not identify the DUT; flashing the whole image', fg='yellow', err=True)
+        forget_flash_state(gateway)
+        stream_output(flash_images(session, gateway, images, True, verify, always_upload, ctx.obj.debug))
+        return
 
-    return session.flash_dut(gateway, files=files)
+    previous = flashed_sectors(gateway, dut, device)
+    try:
+        plan = plan_delta(device, images, previous)
+    except UnknownGeometryError as exc:
+        click.secho(str(exc), fg='red', err=True)
+        ctx.exit(1)
+    click.echo(f'Delta flash: {plan}', err=True)
+    if plan.ranges:
+        record_delta(gateway, dut, device, previous, plan, flashed=False)
+        stream_output(do_erase(session, gateway, plan.ranges, forget=False))
+        stream_output(flash_images(session, gateway, plan.images, False, verify, always_upload, ctx.obj.debug))
 
+    # The record can't see flashes from other machines, debuggers or scripts, nor a different
+    # DUT behind the same probe. Have the gateway compare the whole image with the flash
+    # contents (preverify); it only programs anything if they differ.
+    click.echo('Checking the whole image against the DUT', err=True)
+    stream_output(flash_images(session, gateway, images, True, verify, always_upload, ctx.obj.debug))
+    record_delta(gateway, dut, device, previous, plan, flashed=True)
 
+
+@fan_out
 @click.command()
 @click.pass_context
 @click.option('--gateway', required=False, help='ID of gateway to which DUT is connected')
@@ -44,7 +161,28 @@ def do_flash(session, gateway, hexfile, binfile, preverify, verify):
     help='If true, only flash target if image differs from current flash contents',
     default=True, show_default=True)
 @click.option('--verify/--no-verify', help='Verify image successfully flashed', default=True, show_default=True)
-def flash(ctx, gateway, hexfile, binfile, preverify, verify):
+@click.option(
+    '--elffile',
+    multiple=True, type=click.Path(exists=True),
+    help='ELF file(s) to flash. Their loadable segments are flashed at their load addresses. '
+         'May be passed multiple times.')
+@click.option(
+    '--convert/--no-convert',
+    help='Convert hex and ELF files to binary segments locally before uploading',
+    default=True, show_default=True)
+@click.option('--always-upload', is_flag=True, default=False,
+              help='Upload images even if the gateway already has an identical copy')
+@click.option('--delta', is_flag=True, default=False,
+              help='Only erase and program the flash sectors that changed since the last delta flash of this DUT')
+@click.option('--device', type=click.Choice(SUPPORTED_DEVICES),
+              help='Target device type, for its flash sector layout. Default: the device last used with `lager connect`')
+@click.option('--pipeline', is_flag=True, default=False,
+              help='Flash each image with its own request as soon as it is on the gateway, '
+                   'while the images after it are still uploading')
+@recorded('flash', image_hash=lambda kwargs: images_digest(
+    kwargs['hexfile'], [(binf.path, binf.address) for binf in kwargs['binfile']], kwargs['elffile']))
+def flash(ctx, gateway, hexfile, binfile, elffile, convert, preverify, verify, always_upload, delta, device,
+          pipeline):
     """
         Flash a DUT connected to a gateway with 1 or more bin or hex files
     """
@@ -53,5 +191,45 @@ def flash(ctx, gateway, hexfile, binfile, preverify, verify):
 
     session = ctx.obj.session
 
-    resp = do_flash(session, gateway, hexfile, binfile, preverify, verify)
+    if elffile and not convert:
+        raise click.UsageError('--elffile requires --convert')
+    if delta and not convert:
+        raise click.UsageError('--delta requires --convert')
+    if delta and pipeline:
+        raise click.UsageError('--delta and --pipeline are mutually exclusive')
+
+    if delta:
+        device = device or connected_device(gateway)
+        if device is None:
+            click.secho('--delta needs the target device type: pass --device, or connect with '
+                        '`lager connect --device`', fg='red', err=True)
+            ctx.exit(1)
+        try:
+            images = collect_images(hexfile, binfile, elffile, convert, device)
+        except ImageFormatError as exc:
+            click.secho(f'Invalid image {exc}', fg='red', err=True)
+            ctx.exit(1)
+        _delta_flash(ctx, gateway, images, device, verify, always_upload)
+        return
+
+    if pipeline:
+        try:
+            images = collect_images(hexfile, binfile, elffile, convert, device or connected_device(gateway))
+        except ImageFormatError as exc:
+            click.secho(f'Invalid image {exc}', fg='red', err=True)
+            ctx.exit(1)
+        forget_flash_state(gateway)
+        if pipelined_flash(session, gateway, images, preverify, verify, always_upload) is not None:
+            return
+        if ctx.obj.debug:
+            click.echo(f'Gateway {gateway} does not support pipelined flashing; flashing in one request', err=True)
+
+    try:
+        resp = do_flash(session, gateway, hexfile, binfile, preverify, verify, always_upload, ctx.obj.debug,
+                        elffile, convert, device)
+    except ImageFormatError as exc:
+        click.secho(f'Invalid image {exc}', fg='red', err=True)
+        ctx.exit(1)
+    started = time.monotonic()
     stream_output(resp)
+    record_phase('program', time.monotonic() - started)
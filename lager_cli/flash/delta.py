@@ -0,0 +1,145 @@
+"""
+    lager.flash.delta
+
+    Delta flashing: remember what was last flashed to each DUT, sector by sector, and
+    only erase and program the sectors that changed
+"""
+import time
+import hashlib
+import threading
+from ..cache import read_cache, write_cache
+from .blobs import Blob
+from .images import FlashImage
+from .sectors import merge_ranges, touched_sectors
+
+FLASH_STATE_CACHE_NAME = 'flash-state.json'
+
+# Fanned-out flashes update the state from several threads
+_state_lock = threading.Lock()
+
+
+def _read_state():
+    state, _age = read_cache(FLASH_STATE_CACHE_NAME)
+    return state if isinstance(state, dict) else {}
+
+def _update_state(update):
+    with _state_lock:
+        state = _read_state()
+        update(state)
+        write_cache(FLASH_STATE_CACHE_NAME, state)
+
+def _dut_key(dut, device):
+    return f'{dut}/{device}'
+
+def flashed_sectors(gateway, dut, device):
+    """
+        {hex sector start: sha256} last flashed to `dut` on `gateway`
+    """
+    entry = _read_state().get(str(gateway), {}).get(_dut_key(dut, device), {})
+    return entry.get('sectors', {})
+
+def _set_flashed_sectors(gateway, dut, device, sectors):
+    def update(state):
+        duts = state.setdefault(str(gateway), {})
+        duts[_dut_key(dut, device)] = {'sectors': sectors, 'written_at': time.time()}
+    _update_state(update)
+
+def forget_flash_state(gateway):
+    """
+        Drop everything recorded for the DUTs on `gateway`. Called whenever flash
+        contents change without going through a delta flash.
+    """
+    def update(state):
+        state.pop(str(gateway), None)
+    _update_state(update)
+
+
+def dut_identity(session, gateway):
+    """
+        Identity of the DUT(s) on `gateway`: the serial numbers of its debug probes,
+        or None if the gateway reports none
+    """
+    devices = session.serial_numbers(gateway, None).json().get('devices', [])
+    serials = sorted(device['serial'] for device in devices if device.get('serial'))
+    return ','.join(serials) or None
+
+
+def sector_hashes(device, segments):
+    """
+        {sector start: sha256} of the sectors `segments` write to. A sector's content is
+        the image data over erased (0xFF) flash.
+    """
+    hashes = {}
+    for start, size in touched_sectors(device, segments):
+        content = bytearray(b'\xff' * size)
+        for address, data in segments:
+            lo = max(address, start)
+            hi = min(address + len(data), start + size)
+            if lo < hi:
+                content[lo - start:hi - start] = data[lo - address:hi - address]
+        hashes[start] = hashlib.sha256(content).hexdigest()
+    return hashes
+
+def clip_images(images, ranges):
+    """
+        The parts of `images` (binary FlashImages) that fall inside `ranges`
+    """
+    clipped = []
+    for image in images:
+        data = image.blob.read()
+        for start, length in ranges:
+            lo = max(image.address, start)
+            hi = min(image.address + len(data), start + length)
+            if lo < hi:
+                name = f'{image.blob.name}@{lo:#010x}'
+                clipped.append(FlashImage(Blob(data=data[lo - image.address:hi - image.address], name=name), lo))
+    return clipped
+
+
+class DeltaPlan:  # pylint: disable=too-few-public-methods
+    """
+        What a delta flash has to do: `ranges` to erase and `images` to program
+    """
+    def __init__(self, hashes, sizes, ranges, images):
+        self.hashes = hashes
+        self.sizes = sizes
+        self.ranges = ranges
+        self.images = images
+
+    @property
+    def changed_bytes(self):
+        return sum(length for _start, length in self.ranges)
+
+    def __str__(self):
+        changed = sum(1 for start in self.hashes if any(lo <= start < lo + n for lo, n in self.ranges))
+        return (f'{changed} of {len(self.hashes)} sectors changed '
+                f'({self.changed_bytes:,} of {sum(self.sizes.values()):,} bytes)')
+
+def plan_delta(device, images, previous):
+    """
+        Compare the sectors `images` write with `previous` (as returned by
+        flashed_sectors) and work out which ranges need erasing and programming
+    """
+    segments = [(image.address, image.blob.read()) for image in images]
+    hashes = sector_hashes(device, segments)
+    sizes = dict(touched_sectors(device, segments))
+    changed = [(start, sizes[start]) for start, digest in hashes.items() if previous.get(hex(start)) != digest]
+    ranges = merge_ranges(changed)
+    return DeltaPlan(hashes, sizes, ranges, clip_images(images, ranges))
+
+def record_delta(gateway, dut, device, previous, plan, flashed):
+    """
+        Store the sector hashes after a delta flash. Before flashing, call it with
+        `flashed` False: the changed sectors are then forgotten, so an interrupted
+        flash leaves them unknown rather than wrongly recorded.
+    """
+    sectors = dict(previous)
+    for start, digest in plan.hashes.items():
+        if any(lo <= start < lo + length for lo, length in plan.ranges):
+            if flashed:
+                sectors[hex(start)] = digest
+            else:
+                sectors.pop(hex(start), None)
+        else:
+            sectors[hex(start)] = digest
+    _set_flashed_sectors(gateway, dut, device, sectors)
@@ -0,0 +1,153 @@
+"""
+    lager.flash.images
+
+    Parse Intel HEX and ELF images into the contiguous memory segments they describe
+"""
+import os
+import struct
+import collections
+
+Segment = collections.namedtuple('Segment', ['address', 'data'])
+
+# An image to flash: a Blob holding a hexfile (address None) or binary data for `address`
+FlashImage = collections.namedtuple('FlashImage', ['blob', 'address'])
+
+ELF_MAGIC = b'\x7fELF'
+_PT_LOAD = 1
+
+
+class ImageFormatError(ValueError):
+    """
+        An image file that can't be parsed
+    """
+
+
+def merge_segments(segments):
+    """
+        Sort segments by address and join the ones that are contiguous. Overlapping
+        segments are an error, since it's ambiguous which bytes to flash.
+    """
+    merged = []
+    for address, data in sorted(segments, key=lambda segment: segment.address):
+        if not data:
+            continue
+        if merged:
+            last_address, last_data = merged[-1]
+            end = last_address + len(last_data)
+            if address < end:
+                raise ImageFormatError(f'Overlapping data at {address:#010x}')
+            if address == end:
+                last_data.extend(data)
+                continue
+        merged.append((address, bytearray(data)))
+    return [Segment(address, bytes(data)) for address, data in merged]
+
+
+def parse_hex(text):
+    """
+        Parse Intel HEX `text` (bytes), verifying every record's checksum
+    """
+    base = 0
+    segments = []
+    current_address = None
+    current = None
+    for lineno, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        if line[:1] != b':':
+            raise ImageFormatError(f'line {lineno}: record does not start with ":"')
+        try:
+            record = bytes.fromhex(line[1:].decode('ascii'))
+        except (ValueError, UnicodeDecodeError):
+            raise ImageFormatError(f'line {lineno}: invalid hex digits') from None
+        if len(record) < 5 or len(record) != record[0] + 5:
+            raise ImageFormatError(f'line {lineno}: invalid record length')
+        if sum(record) & 0xFF:
+            raise ImageFormatError(f'line {lineno}: checksum mismatch')
+
+        record_type = record[3]
+        payload = record[4:-1]
+        if record_type == 0x00:
+            address = base + ((record[1] << 8) | record[2])
+            if current is not None and address == current_address + len(current):
+                current.extend(payload)
+            else:
+                if current is not None:
+                    segments.append(Segment(current_address, current))
+                current_address, current = address, bytearray(payload)
+        elif record_type == 0x01:
+            break
+        elif record_type == 0x02:
+            base = int.from_bytes(payload, 'big') << 4
+        elif record_type == 0x04:
+            base = int.from_bytes(payload, 'big') << 16
+        elif record_type in (0x03, 0x05):
+            # Start address records don't describe memory contents
+            continue
+        else:
+            raise ImageFormatError(f'line {lineno}: unknown record type {record_type:#04x}')
+    else:
+        raise ImageFormatError('missing end-of-file record')
+
+    if current is not None:
+        segments.append(Segment(current_address, current))
+    return merge_segments(segments)
+
+
+def parse_elf(data):
+    """
+        Segments of the PT_LOAD program headers of the ELF file `data`, placed at
+        their physical (load) addresses, as objcopy does
+    """
+    if data[:4] != ELF_MAGIC or len(data) < 0x34:
+        raise ImageFormatError('not an ELF file')
+    elf_class, encoding = data[4], data[5]
+    if elf_class not in (1, 2) or encoding not in (1, 2):
+        raise ImageFormatError('unsupported ELF class or data encoding')
+    endian = '<' if encoding == 1 else '>'
+    try:
+        if elf_class == 1:
+            phoff, = struct.unpack_from(endian + 'I', data, 0x1C)
+            phentsize, phnum = struct.unpack_from(endian + 'HH', data, 0x2A)
+            header = endian + 'IIIIIIII'
+        else:
+            phoff, = struct.unpack_from(endian + 'Q', data, 0x20)
+            phentsize, phnum = struct.unpack_from(endian + 'HH', data, 0x36)
+            header = endian + 'IIQQQQQQ'
+    except struct.error:
+        raise ImageFormatError('ELF header is truncated') from None
+
+    segments = []
+    for index in range(phnum):
+        offset = phoff + index * phentsize
+        try:
+            fields = struct.unpack_from(header, data, offset)
+        except struct.error:
+            raise ImageFormatError(f'program header {index} is truncated') from None
+        if elf_class == 1:
+            p_type, p_offset, _p_vaddr, p_paddr, p_filesz = fields[:5]
+        else:
+            p_type, _p_flags, p_offset, _p_vaddr, p_paddr, p_filesz = fields[:6]
+        if p_type != _PT_LOAD or not p_filesz:
+            continue
+        if p_offset + p_filesz > len(data):
+            raise ImageFormatError(f'program header {index} points past the end of the file')
+        segments.append(Segment(p_paddr, data[p_offset:p_offset + p_filesz]))
+    return merge_segments(segments)
+
+
+def load_segments(path):
+    """
+        Segments of the Intel HEX or ELF file at `path`, detected by content
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        if data.startswith(ELF_MAGIC):
+            return parse_elf(data)
+        if data.lstrip()[:1] == b':':
+            return parse_hex(data)
+    except ImageFormatError as exc:
+        raise ImageFormatError(f'{os.path.basename(path)}: {exc}') from None
+    raise ImageFormatError(f'{os.path.basename(path)}: not an Intel HEX or ELF file')
@@ -0,0 +1,135 @@
+"""
+    lager.flash.pipeline
+
+    Pipelined multi-image flashing: each image is flashed with its own request as
+    soon as it is on the gateway, while the images after it are still uploading
+"""
+import time
+import queue
+import threading
+import click
+from ..exceptions import BlobNotFoundError
+from ..history.store import bind_record, current_record, record_phase
+from ..util import stream_output
+from .blobs import query_blobs
+
+
+class ImageTiming:  # pylint: disable=too-few-public-methods
+    """
+        Where the time flashing one image went: `transfer` uploading it and
+        `program` its flash request
+    """
+    def __init__(self, image):
+        self.image = image
+        self.uploaded = 0
+        self.transfer = 0.0
+        self.program = 0.0
+
+    @property
+    def label(self):
+        if self.image.address is None:
+            return self.image.blob.name
+        return f'{self.image.blob.name} @ {self.image.address:#010x}'
+
+
+def _image_files(image, preverify, verify):
+    if image.address is None:
+        files = [('hexfile_sha256', image.blob.digest)]
+    else:
+        files = [('binfile_sha256', image.blob.digest), ('binfile_address', image.address)]
+    files.append(('preverify', preverify))
+    files.append(('verify', verify))
+    files.append(('force', False))
+    return files
+
+def _flash_image(session, gateway, timing, preverify, verify):
+    """
+        Flash one image the gateway holds. If the gateway dropped it since the upload,
+        upload it once more and retry.
+    """
+    try:
+        return session.flash_dut(gateway, files=_image_files(timing.image, preverify, verify))
+    except BlobNotFoundError as exc:
+        click.secho(f'{exc}; uploading {timing.label} again', fg='yellow', err=True)
+        blob = timing.image.blob
+        started = time.monotonic()
+        with blob.open() as data:
+            session.upload_blob(gateway, blob.digest, data)
+        timing.transfer += time.monotonic() - started
+        timing.uploaded += blob.size
+        return session.flash_dut(gateway, files=_image_files(timing.image, preverify, verify))
+
+def _upload(session, gateway, timings, present, ready, cancelled):
+    """
+        Upload the images the gateway lacks, in order, putting the index of each image
+        on `ready` once the gateway has it, or the exception that stopped the uploads
+    """
+    try:
+        for index, timing in enumerate(timings):
+            if cancelled.is_set():
+                return
+            blob = timing.image.blob
+            if blob.digest not in present:
+                started = time.monotonic()
+                with blob.open() as data:
+                    session.upload_blob(gateway, blob.digest, data)
+                timing.transfer = time.monotonic() - started
+                timing.uploaded = blob.size
+                present.add(blob.digest)
+            ready.put(index)
+    except BaseException as exc:  # pylint: disable=broad-except
+        ready.put(exc)
+
+def print_timings(timings, wall):
+    """
+        Per-image transfer and programming times, and how much overlapping saved
+    """
+    for timing in timings:
+        click.echo(f'  {timing.label:<32} {timing.uploaded:>12,} bytes  transfer {timing.transfer:7.2f}s  '
+                   f'program {timing.program:7.2f}s', err=True)
+    serial = sum(timing.transfer + timing.program for timing in timings)
+    click.echo(f'Flashed {len(timings)} images in {wall:.2f}s, '
+               f'{max(serial - wall, 0):.2f}s saved by overlapping transfer and programming', err=True)
+
+def pipelined_flash(session, gateway, images, preverify, verify, always_upload=False):
+    """
+        Flash `images` (FlashImage) in order, one request per image, programming each
+        image while the ones after it upload. Returns the ImageTiming of each image, or
+        None (having flashed nothing) if the gateway doesn't support content-addressed
+        uploads.
+    """
+    present = query_blobs(session, gateway, (image.blob.digest for image in images))
+    if present is None:
+        return None
+    if always_upload:
+        present = set()
+
+    started = time.monotonic()
+    timings = [ImageTiming(image) for image in images]
+    ready = queue.Queue()
+    cancelled = threading.Event()
+    record = current_record()
+
+    def upload():
+        with bind_record(record):
+            _upload(session, gateway, timings, present, ready, cancelled)
+
+    uploader = threading.Thread(target=upload, daemon=True)
+    uploader.start()
+    try:
+        for index, timing in enumerate(timings):
+            item = ready.get()
+            if isinstance(item, BaseException):
+                raise item
+
+            click.echo(f'[{index + 1}/{len(timings)}] Flashing {timing.label}', err=True)
+            programming = time.monotonic()
+            stream_output(_flash_image(session, gateway, timing, preverify, verify))
+            timing.program = time.monotonic() - programming
+    finally:
+        cancelled.set()
+        record_phase('upload', sum(timing.transfer for timing in timings))
+        record_phase('program', sum(timing.program for timing in timings))
+
+    print_timings(timings, time.monotonic() - started)
+    return timings
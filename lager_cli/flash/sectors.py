@@ -0,0 +1,151 @@
+"""
+    lager.flash.sectors
+
+    Flash sector geometry of the supported devices
+"""
+import bisect
+from ..cache import read_cache, write_cache
+
+DUT_DEVICES_CACHE_NAME = 'dut-devices.json'
+
+_K = 1024
+
+def _uniform(base, size, total):
+    return ((base, size, total // size),)
+
+def _stm32f4_bank(base):
+    return ((base, 16 * _K, 4), (base + 64 * _K, 64 * _K, 1), (base + 128 * _K, 128 * _K, 7))
+
+# Device -> ((start address, sector size, sector count), ...) for the on-chip flash.
+# Where parts in a family have different sector layouts, the map only uses boundaries
+# that all of them share (e.g. the largest page size), so every range it produces
+# covers whole physical sectors on any part of the family and never cuts one in half.
+SECTOR_MAPS = {
+    'at91samdxx': _uniform(0x00000000, 256, 1024 * _K),
+    'atsame70': _uniform(0x00400000, 128 * _K, 2048 * _K),
+    'cc3220sf': _uniform(0x01000000, 2 * _K, 1024 * _K),
+    'cc3235sf': _uniform(0x01000000, 2 * _K, 1024 * _K),
+    'efm32': _uniform(0x00000000, 4 * _K, 2048 * _K),
+    'nrf52': _uniform(0x00000000, 4 * _K, 1024 * _K),
+    'stm32f0x': _uniform(0x08000000, 2 * _K, 256 * _K),
+    'stm32f1x': _uniform(0x08000000, 2 * _K, 1024 * _K),
+    'stm32f2x': _stm32f4_bank(0x08000000),
+    'stm32f3x': _uniform(0x08000000, 2 * _K, 512 * _K),
+    'stm32f4x': _stm32f4_bank(0x08000000) + _stm32f4_bank(0x08100000),
+    'stm32f7x': ((0x08000000, 128 * _K, 2), (0x08040000, 256 * _K, 7)),
+    'stm32g0x': _uniform(0x08000000, 2 * _K, 512 * _K),
+    'stm32g4x': _uniform(0x08000000, 4 * _K, 512 * _K),
+    'stm32h7x': _uniform(0x08000000, 128 * _K, 2048 * _K),
+    'stm32h7x_dual_bank': _uniform(0x08000000, 128 * _K, 2048 * _K),
+    'stm32l0': _uniform(0x08000000, 128, 192 * _K),
+    'stm32l0_dual_bank': _uniform(0x08000000, 128, 192 * _K),
+    'stm32l1': _uniform(0x08000000, 256, 512 * _K),
+    'stm32l1x_dual_bank': _uniform(0x08000000, 256, 512 * _K),
+    'stm32l4x': _uniform(0x08000000, 8 * _K, 2048 * _K),
+    'stm32w108xx': _uniform(0x08000000, 1 * _K, 256 * _K),
+    'stm32wbx': _uniform(0x08000000, 4 * _K, 1024 * _K),
+    'stm32wlx': _uniform(0x08000000, 2 * _K, 256 * _K),
+    'stm32xl': _uniform(0x08000000, 2 * _K, 1024 * _K),
+}
+
+# Largest sector of any device: segments at least this far apart never share a sector
+MAX_SECTOR_SIZE = max(size for regions in SECTOR_MAPS.values() for _start, size, _count in regions)
+
+
+class UnknownGeometryError(ValueError):
+    """
+        No sector map for a device, or an address outside its flash
+    """
+
+
+def sectors(device):
+    """
+        [(start, size)] of every flash sector of `device`, in address order
+    """
+    try:
+        regions = SECTOR_MAPS[device]
+    except KeyError:
+        raise UnknownGeometryError(f'No flash sector map for device {device}') from None
+    return [(start + index * size, size) for start, size, count in regions for index in range(count)]
+
+def touched_sectors(device, segments):
+    """
+        [(start, size)] of the sectors that `segments` (address, data) write to
+    """
+    layout = sectors(device)
+    touched = []
+    for start, size in layout:
+        end = start + size
+        if any(address < end and start < address + len(data) for address, data in segments):
+            touched.append((start, size))
+
+    flash_start = layout[0][0]
+    flash_end = layout[-1][0] + layout[-1][1]
+    for address, data in segments:
+        if address < flash_start or address + len(data) > flash_end:
+            raise UnknownGeometryError(
+                f'Data at {address:#010x}-{address + len(data):#010x} is outside the flash of {device}')
+    return touched
+
+def _sector_index(layout, starts, address):
+    index = bisect.bisect_right(starts, address) - 1
+    if index >= 0 and address < layout[index][0] + layout[index][1]:
+        return index
+    return None
+
+def join_shared_sectors(segments, device=None):
+    """
+        Join (address, data) segments that share a flash sector, filling the gaps with
+        0xFF, the value of erased flash. The gateway erases the sectors of each image
+        it flashes, so two images in one sector would erase each other. Without the
+        sector map of `device`, segments less than MAX_SECTOR_SIZE apart are joined.
+    """
+    layout = sectors(device) if device in SECTOR_MAPS else None
+    starts = [start for start, _size in layout] if layout else None
+    joined = []
+    for address, data in sorted(segments, key=lambda segment: segment[0]):
+        if joined:
+            last_address, last_data = joined[-1]
+            end = last_address + len(last_data)
+            if layout is None:
+                shared = address - end < MAX_SECTOR_SIZE
+            else:
+                index = _sector_index(layout, starts, address)
+                shared = index is not None and index == _sector_index(layout, starts, end - 1)
+            if shared:
+                last_data.extend(b'\xff' * (address - end))
+                last_data.extend(data)
+                continue
+        joined.append((address, bytearray(data)))
+    return [(address, bytes(data)) for address, data in joined]
+
+def merge_ranges(ranges):
+    """
+        Join adjacent (start, length) ranges
+    """
+    merged = []
+    for start, length in sorted(ranges):
+        if merged and merged[-1][0] + merged[-1][1] == start:
+            merged[-1] = (merged[-1][0], merged[-1][1] + length)
+        else:
+            merged.append((start, length))
+    return merged
+
+
+def remember_device(gateway, device):
+    """
+        Record the device type last connected on `gateway`
+    """
+    devices, _age = read_cache(DUT_DEVICES_CACHE_NAME)
+    devices = devices if isinstance(devices, dict) else {}
+    devices[str(gateway)] = device
+    write_cache(DUT_DEVICES_CACHE_NAME, devices)
+
+def connected_device(gateway):
+    """
+        Device type last used with `lager connect` on `gateway`, if any
+    """
+    devices, _age = read_cache(DUT_DEVICES_CACHE_NAME)
+    if isinstance(devices, dict):
+        return devices.get(str(gateway))
+    return None
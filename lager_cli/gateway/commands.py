@@ -7,6 +7,8 @@ import collections
 import os
 import click
 from ..context import get_default_gateway
+from ..fanout import fan_out
+from ..gateways import invalidate_gateway_cache
 
 @click.group(name='gateway')
 def _gateway():
@@ -107,6 +109,7 @@ class BinfileType(click.ParamType):
     def __repr__(self):
         return 'BINFILE'
 
+@fan_out
 @_gateway.command()
 @click.pass_context
 @click.option('--gateway', required=False, help='ID of gateway to which DUT is connected')
@@ -149,6 +152,7 @@ def rename(ctx, gateway, to):
 
     session = ctx.obj.session
     session.rename_gateway(gateway, to)
+    invalidate_gateway_cache()
 
 @_gateway.command()
 @click.pass_context
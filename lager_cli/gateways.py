@@ -0,0 +1,124 @@
+"""
+    lager.gateways
+
+    Local cache of the user's gateway list, for name -> id resolution and completion.
+    Kept free of heavy imports so shell completion can read it cheaply.
+"""
+import os
+import json
+import base64
+import hashlib
+from .cache import read_cache, write_cache, clear_cache
+
+GATEWAY_CACHE_NAME = 'gateways.json'
+DEFAULT_GATEWAY_CACHE_TTL = 10 * 60
+
+
+def gateway_cache_ttl():
+    """
+        Seconds the gateway list is trusted: LAGER_GATEWAY_CACHE_TTL, or the default if
+        that is unset or not an integer
+    """
+    try:
+        return int(os.getenv('LAGER_GATEWAY_CACHE_TTL', DEFAULT_GATEWAY_CACHE_TTL))
+    except ValueError:
+        return DEFAULT_GATEWAY_CACHE_TTL
+
+
+def _account_key(auth_token):
+    """
+        Identify the account behind a token, so switching accounts or API hosts never
+        serves another account's gateways. Uses the JWT subject when there is one, so
+        a refreshed token keeps the same key.
+    """
+    identity = auth_token or ''
+    try:
+        _header, payload, _sig = identity.split('.')
+        identity = json.loads(base64.urlsafe_b64decode(payload + '===='))['sub']
+    except (ValueError, KeyError, TypeError):
+        pass
+    host = os.getenv('LAGER_HOST', '')
+    return hashlib.sha256(f'{host}\n{identity}'.encode()).hexdigest()
+
+def _read(account, ttl):
+    value, age = read_cache(GATEWAY_CACHE_NAME, ttl)
+    if not isinstance(value, dict) or value.get('account') != account:
+        return None, None
+    return value['gateways'], age
+
+def invalidate_gateway_cache():
+    """
+        Forget cached gateways, e.g. after a rename or login
+    """
+    clear_cache(GATEWAY_CACHE_NAME)
+
+def cached_gateways():
+    """
+        Gateways from the cache regardless of account or age, without touching the
+        network. Used by shell completion.
+    """
+    value, _age = read_cache(GATEWAY_CACHE_NAME)
+    if not isinstance(value, dict):
+        return []
+    return value.get('gateways', [])
+
+def list_gateways(ctx, refresh=False):
+    """
+        The user's gateways, from the cache if it is younger than gateway_cache_ttl().
+        A stale cache is used if the API cannot be reached.
+    """
+    import requests  # pylint: disable=import-outside-toplevel
+
+    account = _account_key(getattr(ctx.obj, 'auth_token', None))
+    if not refresh:
+        gateways, _age = _read(account, gateway_cache_ttl())
+        if gateways is not None:
+            return gateways
+
+    try:
+        resp = ctx.obj.session.get('gateway/list', quiet=True)
+        resp.raise_for_status()
+    except requests.exceptions.RequestException:
+        gateways, _age = _read(account, None)
+        if gateways is not None:
+            return gateways
+        # No cache to fall back on; repeat the request with the usual error reporting
+        resp = ctx.obj.session.list_gateways()
+        resp.raise_for_status()
+
+    gateways = [
+        {'id': gateway['id'], 'name': gateway['name']} for gateway in resp.json()['gateways']
+    ]
+    write_cache(GATEWAY_CACHE_NAME, {'account': account, 'gateways': gateways})
+    return gateways
+
+def _lookup(gateways, gateway):
+    for entry in gateways:
+        if str(entry['id']) == gateway:
+            return str(entry['id'])
+    for entry in gateways:
+        if entry['name'] == gateway:
+            return str(entry['id'])
+    return None
+
+def resolve_gateway(ctx, gateway):
+    """
+        Map a gateway name to its id. Ids (all digits) are returned unchanged without
+        listing gateways. Unknown names trigger one refresh of the cache; if the name
+        is still unknown it is returned unchanged, since the listing can miss shared
+        gateways, and the API is the authority on what exists.
+    """
+    import requests  # pylint: disable=import-outside-toplevel
+
+    gateway = str(gateway)
+    if gateway.isdigit():
+        return gateway
+    try:
+        gateway_id = _lookup(list_gateways(ctx), gateway)
+        if gateway_id is None:
+            gateway_id = _lookup(list_gateways(ctx, refresh=True), gateway)
+    except requests.exceptions.RequestException:
+        # Couldn't list gateways at all; let the API sort it out
+        return gateway
+
+    return gateway if gateway_id is None else gateway_id
@@ -4,15 +4,18 @@
     GDB Server tunnel commands
 """
 
+import functools
 import click
 import trio
 from .tunnel import serve_tunnel, serve_local_tunnel
+from .forward import DEFAULT_BUFFER_SIZE
 from ..context import get_default_gateway, ensure_debugger_running
+from ..flash.delta import forget_flash_state
 
-def _run_gdbserver_cloud(ctx, host, port, gateway, socktype):
+def _run_gdbserver_cloud(ctx, host, port, gateway, socktype, buffer_size):
     connection_params = ctx.obj.websocket_connection_params(socktype=socktype, gateway_id=gateway)
     try:
-        trio.run(serve_tunnel, host, port, connection_params, 'GDB')
+        trio.run(functools.partial(serve_tunnel, host, port, connection_params, 'GDB', buffer_size=buffer_size))
     except PermissionError as exc:
         if port < 1024:
             click.secho(f'Permission denied for port {port}. Using a port number less than '
@@ -26,9 +29,11 @@ def _run_gdbserver_cloud(ctx, host, port, gateway, socktype):
         if ctx.obj.debug:
             raise
 
-def _run_gdbserver_local(ctx, host, port, gateway, fork):
+def _run_gdbserver_local(ctx, host, port, gateway, fork, buffer_size):
     try:
-        trio.run(serve_local_tunnel, ctx.obj.session, gateway, host, port, fork)
+        trio.run(functools.partial(
+            serve_local_tunnel, ctx.obj.session, gateway, host, port, fork, buffer_size=buffer_size,
+        ))
     except PermissionError as exc:
         if port < 1024:
             click.secho(f'Permission denied for port {port}. Using a port number less than '
@@ -50,7 +55,9 @@ def _run_gdbserver_local(ctx, host, port, gateway, fork):
 @click.option('--port', default=3333, help='Port for gdbserver', show_default=True)
 @click.option('--local', is_flag=True, default=False, help='Connect to gateway via local network', show_default=True)
 @click.option('--fork', is_flag=True, default=False, help='Allow forking', show_default=True)
-def gdbserver(ctx, gateway, host, port, local, fork):
+@click.option('--buffer-size', type=click.IntRange(min=1024), default=DEFAULT_BUFFER_SIZE, show_default=True,
+              help='Bytes buffered ahead of a slow reader, per direction')
+def gdbserver(ctx, gateway, host, port, local, fork, buffer_size):
     """
         Establish a proxy to GDB server on gateway. By default binds to localhost, meaning gdb
         client connections must originate from the machine running `lager gdbserver`. If you would
@@ -62,6 +69,8 @@ def gdbserver(ctx, gateway, host, port, local, fork):
     if gateway is None:
         gateway = get_default_gateway(ctx)
 
+    # A debugger session can rewrite flash behind the back of delta flashing
+    forget_flash_state(gateway)
     status = ensure_debugger_running(gateway, ctx)
     if 'Listening on port 3333' in status['logfile']:
         socktype = 'gdb-tunnel'
@@ -71,6 +80,6 @@ def gdbserver(ctx, gateway, host, port, local, fork):
         raise RuntimeError('Unknown tunnel type')
 
     if local:
-        _run_gdbserver_local(ctx, host, port, gateway, fork)
+        _run_gdbserver_local(ctx, host, port, gateway, fork, buffer_size)
     else:
-        _run_gdbserver_cloud(ctx, host, port, gateway, socktype)
+        _run_gdbserver_cloud(ctx, host, port, gateway, socktype, buffer_size)
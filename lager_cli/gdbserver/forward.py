@@ -0,0 +1,151 @@
+"""
+    lager.gdbserver.forward
+
+    Forwarding engine for tunnels: a reader and a writer per direction, decoupled by a
+    bounded buffer so reads and writes overlap. When the buffer is full the reader stops
+    reading, which pushes back on the producer instead of queueing without limit.
+"""
+import collections
+import trio
+import lager_trio_websocket as trio_websocket
+
+DEFAULT_BUFFER_SIZE = 256 * 1024
+MIN_RECEIVE_SIZE = 4 * 1024
+MAX_RECEIVE_SIZE = 256 * 1024
+
+class AdaptiveReceiveSize:
+    """
+        Receive size that tracks observed throughput: a read that fills the whole request
+        means more data was already waiting, so ask for more next time; reads that come back
+        mostly empty mean the stream is interactive, so shrink back down.
+    """
+    def __init__(self, minimum=MIN_RECEIVE_SIZE, maximum=MAX_RECEIVE_SIZE):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.size = minimum
+
+    def observe(self, received):
+        """
+            Adjust the next receive size based on how many bytes the last read returned
+        """
+        if received >= self.size:
+            self.size = min(self.size * 2, self.maximum)
+        elif received < self.size // 4:
+            self.size = max(self.size // 2, self.minimum)
+
+class BoundedBuffer:
+    """
+        Byte-bounded FIFO between a reader task and a writer task
+    """
+    def __init__(self, capacity=DEFAULT_BUFFER_SIZE):
+        self.capacity = capacity
+        self._chunks = collections.deque()
+        self._size = 0
+        self._closed = False
+        self._readers = trio.lowlevel.ParkingLot()
+        self._writers = trio.lowlevel.ParkingLot()
+
+    def __len__(self):
+        return self._size
+
+    async def put(self, data):
+        """
+            Append data, waiting while the buffer is full
+        """
+        while self._size >= self.capacity and not self._closed:
+            await self._writers.park()
+        if self._closed:
+            raise trio.ClosedResourceError
+        self._chunks.append(data)
+        self._size += len(data)
+        self._readers.unpark_all()
+
+    async def get(self, max_bytes=None):
+        """
+            Remove and return buffered data, coalescing small chunks up to ``max_bytes``.
+            Returns b'' once the buffer is closed and drained.
+        """
+        while not self._chunks and not self._closed:
+            await self._readers.park()
+        if not self._chunks:
+            return b''
+        if max_bytes is None:
+            max_bytes = self.capacity
+        data = self._chunks.popleft()
+        if self._chunks and len(data) < max_bytes:
+            parts = [data]
+            total = len(data)
+            while self._chunks and total + len(self._chunks[0]) <= max_bytes:
+                chunk = self._chunks.popleft()
+                parts.append(chunk)
+                total += len(chunk)
+            data = b''.join(parts)
+        self._size -= len(data)
+        self._writers.unpark_all()
+        return data
+
+    def close(self):
+        """
+            No more data will be put; readers drain what is left, then get b''
+        """
+        self._closed = True
+        self._readers.unpark_all()
+        self._writers.unpark_all()
+
+def stream_receiver(stream, receive_size=None):
+    """
+        Wrap a trio stream's receive_some with an adaptive receive size
+    """
+    if receive_size is None:
+        receive_size = AdaptiveReceiveSize()
+
+    async def receive():
+        data = await stream.receive_some(receive_size.size)
+        receive_size.observe(len(data))
+        return data
+    return receive
+
+def websocket_receiver(websocket):
+    """
+        Wrap a websocket's get_message so that it never returns an empty message.
+        End of stream is signalled by ``ConnectionClosed``.
+    """
+    async def receive():
+        while True:
+            message = await websocket.get_message()
+            if message:
+                return message
+    return receive
+
+async def forward(receive, send, *, buffer_size=DEFAULT_BUFFER_SIZE):
+    """
+        Pump data from ``receive()`` to ``send(data)`` until ``receive`` returns b''.
+        Up to ``buffer_size`` bytes may be read ahead of the writer. If ``receive``
+        fails because the peer went away, what was read before is still sent, then
+        the error is raised.
+    """
+    buffer = BoundedBuffer(buffer_size)
+    lost = None
+
+    async def read_into_buffer():
+        nonlocal lost
+        try:
+            while True:
+                data = await receive()
+                if not data:
+                    break
+                await buffer.put(data)
+        except (trio.BrokenResourceError, trio_websocket.ConnectionClosed) as exc:
+            lost = exc
+        finally:
+            buffer.close()
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(read_into_buffer)
+        while True:
+            data = await buffer.get(MAX_RECEIVE_SIZE)
+            if not data:
+                break
+            await send(data)
+    if lost is not None:
+        raise lost
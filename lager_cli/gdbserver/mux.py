@@ -0,0 +1,226 @@
+"""
+    lager.gdbserver.mux
+
+    Multiplex several tunnel streams over a single websocket.
+
+    Every websocket message is one frame: a 1 byte frame type, a 4 byte stream id,
+    then the payload. Each stream has its own credit window in each direction: a sender
+    may only have ``window`` unacknowledged bytes in flight, and the receiver returns
+    credit with WINDOW frames as its local consumer drains data. The reader therefore
+    never blocks on a slow stream, so one busy port cannot starve the others.
+"""
+import math
+import struct
+import trio
+import lager_trio_websocket as trio_websocket
+
+FRAME_OPEN = 1
+FRAME_DATA = 2
+FRAME_WINDOW = 3
+FRAME_EOF = 4
+FRAME_RESET = 5
+
+DEFAULT_WINDOW = 256 * 1024
+MAX_FRAME_PAYLOAD = 16 * 1024
+
+_HEADER = struct.Struct('!BI')
+_OPEN = struct.Struct('!HI')
+_WINDOW = struct.Struct('!I')
+
+class MuxStream:
+    """
+        One logical stream within a ``MuxConnection``. Quacks like a trio stream.
+    """
+    def __init__(self, connection, stream_id, window):
+        self._connection = connection
+        self.stream_id = stream_id
+        self._window = window
+        self._send_credit = window
+        self._credit_available = trio.Event()
+        self._unacknowledged = 0
+        self._pending = b''
+        self._incoming, self._outgoing = trio.open_memory_channel(math.inf)
+        self._eof_received = False
+        self._eof = False
+        self._eof_sent = False
+        self._broken = False
+
+    def _feed(self, data):
+        if self._eof_received:
+            return
+        if not data:
+            self._eof_received = True
+        self._incoming.send_nowait(data)
+
+    def _grant(self, credit):
+        self._send_credit += credit
+        self._credit_available.set()
+
+    def _reset(self):
+        self._broken = True
+        self._feed(b'')
+        self._credit_available.set()
+
+    async def receive_some(self, max_bytes=None):
+        """
+            Receive data from the peer; returns b'' at end of stream, and on every call after
+        """
+        if self._eof:
+            return b''
+        if not self._pending:
+            self._pending = await self._outgoing.receive()
+            if not self._pending:
+                self._eof = True
+                return b''
+        if max_bytes is None:
+            max_bytes = len(self._pending)
+        data, self._pending = self._pending[:max_bytes], self._pending[max_bytes:]
+
+        self._unacknowledged += len(data)
+        if self._unacknowledged >= self._window // 2 and not self._broken:
+            credit, self._unacknowledged = self._unacknowledged, 0
+            try:
+                await self._connection.send_frame(FRAME_WINDOW, self.stream_id, _WINDOW.pack(credit))
+            except trio_websocket.ConnectionClosed:
+                self._broken = True
+        return data
+
+    async def send_all(self, data):
+        """
+            Send data to the peer, waiting for credit as necessary
+        """
+        view = memoryview(data)
+        while view:
+            while self._send_credit <= 0:
+                if self._broken:
+                    raise trio.BrokenResourceError
+                self._credit_available = trio.Event()
+                await self._credit_available.wait()
+            if self._broken or self._eof_sent:
+                raise trio.BrokenResourceError
+            size = min(len(view), self._send_credit, MAX_FRAME_PAYLOAD)
+            self._send_credit -= size
+            await self._connection.send_frame(FRAME_DATA, self.stream_id, bytes(view[:size]))
+            view = view[size:]
+
+    async def send_eof(self):
+        """
+            Tell the peer we are done sending
+        """
+        if self._eof_sent or self._broken:
+            return
+        self._eof_sent = True
+        await self._connection.send_frame(FRAME_EOF, self.stream_id)
+
+    async def aclose(self):
+        """
+            Tear down the stream in both directions
+        """
+        if not self._broken:
+            self._broken = True
+            try:
+                await self._connection.send_frame(FRAME_RESET, self.stream_id)
+            except (trio.BrokenResourceError, trio_websocket.ConnectionClosed):
+                pass
+        self._connection.forget(self.stream_id)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        data = await self.receive_some()
+        if not data:
+            raise StopAsyncIteration
+        return data
+
+class MuxConnection:
+    """
+        Stream multiplexer over a websocket. The opening side calls ``open_stream``;
+        the accepting side passes ``accept_handler(stream, remote_port)``.
+    """
+    def __init__(self, websocket, accept_handler=None, window=DEFAULT_WINDOW):
+        self.websocket = websocket
+        self.accept_handler = accept_handler
+        self.window = window
+        self._streams = {}
+        self._next_stream_id = 1
+        self._send_lock = trio.Lock()
+
+    async def send_frame(self, frame_type, stream_id, payload=b''):
+        """
+            Send a single frame. The lock is FIFO so streams take turns on the websocket.
+        """
+        async with self._send_lock:
+            await self.websocket.send_message(_HEADER.pack(frame_type, stream_id) + payload)
+
+    def forget(self, stream_id):
+        """
+            Drop bookkeeping for a closed stream
+        """
+        self._streams.pop(stream_id, None)
+
+    async def open_stream(self, remote_port):
+        """
+            Open a new stream to ``remote_port`` on the far side
+        """
+        stream_id = self._next_stream_id
+        self._next_stream_id += 1
+        stream = MuxStream(self, stream_id, self.window)
+        self._streams[stream_id] = stream
+        await self.send_frame(FRAME_OPEN, stream_id, _OPEN.pack(remote_port, self.window))
+        return stream
+
+    async def _accept(self, stream, remote_port):
+        async with stream:
+            await self.accept_handler(stream, remote_port)
+
+    def _dispatch(self, nursery, message):
+        frame_type, stream_id = _HEADER.unpack_from(message)
+        payload = message[_HEADER.size:]
+        if frame_type == FRAME_OPEN:
+            remote_port, window = _OPEN.unpack(payload)
+            stream = MuxStream(self, stream_id, window)
+            self._streams[stream_id] = stream
+            if self.accept_handler is None:
+                nursery.start_soon(stream.aclose)
+            else:
+                nursery.start_soon(self._accept, stream, remote_port)
+            return
+
+        stream = self._streams.get(stream_id)
+        if stream is None:
+            return
+        if frame_type == FRAME_DATA:
+            stream._feed(payload)  # pylint: disable=protected-access
+        elif frame_type == FRAME_WINDOW:
+            stream._grant(_WINDOW.unpack(payload)[0])  # pylint: disable=protected-access
+        elif frame_type == FRAME_EOF:
+            stream._feed(b'')  # pylint: disable=protected-access
+        elif frame_type == FRAME_RESET:
+            stream._reset()  # pylint: disable=protected-access
+            self.forget(stream_id)
+
+    async def run(self, *, task_status=trio.TASK_STATUS_IGNORED):
+        """
+            Read frames from the websocket and route them to their streams until
+            the websocket closes
+        """
+        try:
+            async with trio.open_nursery() as nursery:
+                task_status.started()
+                try:
+                    while True:
+                        message = await self.websocket.get_message()
+                        self._dispatch(nursery, message)
+                except trio_websocket.ConnectionClosed:
+                    nursery.cancel_scope.cancel()
+        finally:
+            for stream in list(self._streams.values()):
+                stream._reset()  # pylint: disable=protected-access
+            self._streams.clear()
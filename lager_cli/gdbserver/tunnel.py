@@ -9,37 +9,38 @@ import click
 import trio
 import lager_trio_websocket as trio_websocket
 from ..util import heartbeat
+from .mux import MuxConnection
+from .forward import forward, stream_receiver, websocket_receiver, DEFAULT_BUFFER_SIZE
 
 logger = logging.getLogger(__name__)
 
-async def send_to_websocket(websocket, gdb_client_stream, nursery):
+async def send_to_websocket(websocket, gdb_client_stream, nursery, buffer_size=DEFAULT_BUFFER_SIZE):
     """
         Read data from gdb_client_stream (a trio stream connected to a gdb client)
         and send to websocket (ultimate destination is gateway gdbserver).
     """
     try:
         async with gdb_client_stream:
-            async for msg in gdb_client_stream:
-                await websocket.send_message(msg)
+            await forward(stream_receiver(gdb_client_stream), websocket.send_message, buffer_size=buffer_size)
     except trio.BrokenResourceError:
         pass
     finally:
         nursery.cancel_scope.cancel()
 
 
-async def send_to_gdb(websocket, gdb_client_stream, nursery):
+async def send_to_gdb(websocket, gdb_client_stream, nursery, buffer_size=DEFAULT_BUFFER_SIZE):
     """
         Read data from websocket (originating from gateway gdbserver)
         and send to gdb_client_stream (a trio stream connected to a gdb client)
     """
-    while True:
-        try:
-            msg = await websocket.get_message()
-            await gdb_client_stream.send_all(msg)
-        except trio_websocket.ConnectionClosed:
-            nursery.cancel_scope.cancel()
+    try:
+        await forward(websocket_receiver(websocket), gdb_client_stream.send_all, buffer_size=buffer_size)
+    except (trio_websocket.ConnectionClosed, trio.BrokenResourceError, trio.ClosedResourceError):
+        pass
+    finally:
+        nursery.cancel_scope.cancel()
 
-async def cloud_connection_handler(connection_params, gdb_client_stream):
+async def cloud_connection_handler(connection_params, buffer_size, gdb_client_stream):
     """
         Handle a single connection from a gdb client
     """
@@ -49,18 +50,17 @@ async def cloud_connection_handler(connection_params, gdb_client_stream):
     try:
         async with trio_websocket.open_websocket_url(uri, disconnect_timeout=1, **kwargs) as websocket:
             async with trio.open_nursery() as nursery:
-                nursery.start_soon(send_to_websocket, websocket, gdb_client_stream, nursery)
-                nursery.start_soon(send_to_gdb, websocket, gdb_client_stream, nursery)
+                nursery.start_soon(send_to_websocket, websocket, gdb_client_stream, nursery, buffer_size)
+                nursery.start_soon(send_to_gdb, websocket, gdb_client_stream, nursery, buffer_size)
                 nursery.start_soon(heartbeat, websocket, 30, 30)
     except Exception as exc:  # pylint: disable=broad-except
         logger.exception('Exception in connection_handler', exc_info=exc)
     finally:
         click.echo(f'gdb client disconnected: {sockname}')
 
-async def send_to_local_client(gateway_stream, gdb_client_stream, nursery):
+async def send_to_local_client(gateway_stream, gdb_client_stream, nursery, buffer_size=DEFAULT_BUFFER_SIZE):
     try:
-        async for data in gateway_stream:
-            await gdb_client_stream.send_all(data)
+        await forward(stream_receiver(gateway_stream), gdb_client_stream.send_all, buffer_size=buffer_size)
         try:
             await gdb_client_stream.send_eof()
         except trio.BrokenResourceError:
@@ -69,10 +69,9 @@ async def send_to_local_client(gateway_stream, gdb_client_stream, nursery):
         logger.exception('send_to_local_client failed: ', exc_info=exc)
         nursery.cancel_scope.cancel()
 
-async def send_to_local_gateway(gateway_stream, gdb_client_stream, nursery):
+async def send_to_local_gateway(gateway_stream, gdb_client_stream, nursery, buffer_size=DEFAULT_BUFFER_SIZE):
     try:
-        async for data in gdb_client_stream:
-            await gateway_stream.send_all(data)
+        await forward(stream_receiver(gdb_client_stream), gateway_stream.send_all, buffer_size=buffer_size)
         try:
             await gateway_stream.send_eof()
         except trio.BrokenResourceError:
@@ -81,7 +80,7 @@ async def send_to_local_gateway(gateway_stream, gdb_client_stream, nursery):
         logger.exception('send_to_local_gateway failed: ', exc_info=exc)
         nursery.cancel_scope.cancel()
 
-async def local_connection_handler(session, gateway, remote_host, remote_port, gdb_client_stream):
+async def local_connection_handler(session, gateway, remote_host, remote_port, buffer_size, gdb_client_stream):
     """
         Handle a single connection from a gdb client
     """
@@ -96,8 +95,8 @@ async def local_connection_handler(session, gateway, remote_host, remote_port, g
     try:
         async with await trio.open_tcp_stream(remote_host, remote_port) as gateway_stream:
             async with trio.open_nursery() as nursery:
-                nursery.start_soon(send_to_local_client, gateway_stream, gdb_client_stream, nursery)
-                nursery.start_soon(send_to_local_gateway, gateway_stream, gdb_client_stream, nursery)
+                nursery.start_soon(send_to_local_client, gateway_stream, gdb_client_stream, nursery, buffer_size)
+                nursery.start_soon(send_to_local_gateway, gateway_stream, gdb_client_stream, nursery, buffer_size)
     except OSError:
         click.secho('Failed to connect to gateway. Are you sure you\'re on the same network as your gateway?', fg='red', err=True)
     except Exception as exc:  # pylint: disable=broad-except
@@ -105,12 +104,13 @@ async def local_connection_handler(session, gateway, remote_host, remote_port, g
     finally:
         click.echo(f'gdb client disconnected: {sockname}')
 
-async def serve_tunnel(host, port, connection_params, name, *, task_status=trio.TASK_STATUS_IGNORED):
+async def serve_tunnel(host, port, connection_params, name, *, buffer_size=DEFAULT_BUFFER_SIZE,
+                       task_status=trio.TASK_STATUS_IGNORED):
     """
         Start up the server that tunnels traffic to a gdbserver instance running on a gateway
     """
     async with trio.open_nursery() as nursery:
-        handler = functools.partial(cloud_connection_handler, connection_params)
+        handler = functools.partial(cloud_connection_handler, connection_params, buffer_size)
         serve_listeners = functools.partial(trio.serve_tcp, handler, port, host=host)
 
         server = await nursery.start(serve_listeners)
@@ -121,7 +121,8 @@ async def serve_tunnel(host, port, connection_params, name, *, task_status=trio.
         except KeyboardInterrupt:
             nursery.cancel_scope.cancel()
 
-async def serve_local_tunnel(session, gateway, host, port, fork, *, task_status=trio.TASK_STATUS_IGNORED):
+async def serve_local_tunnel(session, gateway, host, port, fork, *, buffer_size=DEFAULT_BUFFER_SIZE,
+                             task_status=trio.TASK_STATUS_IGNORED):
     """
         Start up the server that locally tunnels traffic to a gdbserver instance running on a gateway
     """
@@ -133,7 +134,7 @@ async def serve_local_tunnel(session, gateway, host, port, fork, *, task_status=
         remote_port = int(resp['port'])
 
     async with trio.open_nursery() as nursery:
-        handler = functools.partial(local_connection_handler, session, gateway, remote_host, remote_port)
+        handler = functools.partial(local_connection_handler, session, gateway, remote_host, remote_port, buffer_size)
         serve_listeners = functools.partial(trio.serve_tcp, handler, port, host=host)
 
         server = await nursery.start(serve_listeners)
@@ -143,3 +144,61 @@ async def serve_local_tunnel(session, gateway, host, port, fork, *, task_status=
             await trio.sleep_forever()
         except KeyboardInterrupt:
             nursery.cancel_scope.cancel()
+
+async def serve_tunnels(host, tunnels, *, buffer_size=DEFAULT_BUFFER_SIZE, task_status=trio.TASK_STATUS_IGNORED):
+    """
+        Serve several tunnels from one process. ``tunnels`` is a list of
+        (port, connection_params, name) tuples; each client connection gets its own websocket.
+    """
+    async with trio.open_nursery() as nursery:
+        servers = []
+        for (port, connection_params, name) in tunnels:
+            serve = functools.partial(serve_tunnel, host, port, connection_params, name, buffer_size=buffer_size)
+            servers.append(await nursery.start(serve))
+        task_status.started(servers)
+
+async def mux_connection_handler(mux, remote_port, name, buffer_size, gdb_client_stream):
+    """
+        Handle a single client connection by opening a stream on a multiplexed websocket
+    """
+    sockname = gdb_client_stream.socket.getsockname()
+    click.echo(f'Serving {name} client: {sockname}')
+    try:
+        async with await mux.open_stream(remote_port) as gateway_stream:
+            async with trio.open_nursery() as nursery:
+                nursery.start_soon(send_to_local_client, gateway_stream, gdb_client_stream, nursery, buffer_size)
+                nursery.start_soon(send_to_local_gateway, gateway_stream, gdb_client_stream, nursery, buffer_size)
+    except trio_websocket.ConnectionClosed:
+        pass
+    except Exception as exc:  # pylint: disable=broad-except
+        logger.exception('Exception in mux_connection_handler', exc_info=exc)
+    finally:
+        click.echo(f'{name} client disconnected: {sockname}')
+
+async def _run_mux(mux, nursery, *, task_status=trio.TASK_STATUS_IGNORED):
+    """
+        Run the multiplexer; once the upstream websocket closes, take the listeners down with it
+    """
+    await mux.run(task_status=task_status)
+    click.secho('Tunnel connection to gateway closed', fg='red', err=True)
+    nursery.cancel_scope.cancel()
+
+async def serve_mux_tunnels(host, tunnels, connection_params, *, buffer_size=DEFAULT_BUFFER_SIZE,
+                            task_status=trio.TASK_STATUS_IGNORED):
+    """
+        Serve several tunnels over a single upstream websocket. ``tunnels`` is a list of
+        (port, remote_port, name) tuples.
+    """
+    (uri, kwargs) = connection_params
+    async with trio_websocket.open_websocket_url(uri, disconnect_timeout=1, **kwargs) as websocket:
+        mux = MuxConnection(websocket, window=buffer_size)
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(heartbeat, websocket, 30, 30)
+            await nursery.start(_run_mux, mux, nursery)
+            servers = []
+            for (port, remote_port, name) in tunnels:
+                handler = functools.partial(mux_connection_handler, mux, remote_port, name, buffer_size)
+                serve_listeners = functools.partial(trio.serve_tcp, handler, port, host=host)
+                servers.append(await nursery.start(serve_listeners))
+                click.echo(f'Serving {name} on {host}:{port}. Press Ctrl+C to quit.')
+            task_status.started(servers)
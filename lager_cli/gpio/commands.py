@@ -5,6 +5,7 @@
 """
 import click
 from ..context import get_default_gateway
+from ..fanout import fan_out
 
 @click.group()
 def gpio():
@@ -16,6 +17,7 @@ def gpio():
 _GPIO_CHOICES = click.IntRange(0, 14)
 _LEVEL_CHOICES = click.Choice(('LOW', 'HIGH'), case_sensitive=False)
 
+@fan_out
 @gpio.command(name='set')
 @click.option('--gateway', required=False, help='ID of gateway to which DUT is connected')
 @click.argument('gpio_', metavar='GPIO', type=_GPIO_CHOICES)
@@ -40,6 +42,7 @@ def set_(ctx, gateway, gpio_, type_, pull):
     ctx.obj.session.gpio_set(gateway, gpio_, type_, pull)
 
 
+@fan_out
 @gpio.command(name='input')
 @click.option('--gateway', required=False, help='ID of gateway to which DUT is connected')
 @click.argument('gpio_', metavar='GPIO', type=_GPIO_CHOICES)
@@ -56,6 +59,7 @@ def input_(ctx, gateway, gpio_):
     click.echo(result.json()['level'])
 
 
+@fan_out
 @gpio.command()
 @click.option('--gateway', required=False, help='ID of gateway to which DUT is connected')
 @click.argument('gpio_', metavar='GPIO', type=_GPIO_CHOICES)
@@ -72,6 +76,7 @@ def output(ctx, gateway, gpio_, level):
     ctx.obj.session.gpio_output(gateway, gpio_, level)
 
 
+@fan_out
 @gpio.command()
 @click.option('--gateway', required=False, help='ID of gateway to which DUT is connected')
 @click.argument('gpio_', metavar='GPIO', type=_GPIO_CHOICES)
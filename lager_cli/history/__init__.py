@@ -0,0 +1,5 @@
+"""
+    lager.history
+
+    Local history of command runs and their timings
+"""
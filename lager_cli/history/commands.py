@@ -0,0 +1,190 @@
+"""
+    lager.history.commands
+
+    Show timing trends from the local run history
+"""
+import json
+import math
+import statistics
+import click
+from .store import connect, history_path
+
+# Changes smaller than this are noise, however large they are relatively
+MIN_REGRESSION_SECONDS = 0.05
+
+
+def percentile(values, fraction):
+    """
+        Linearly interpolated percentile of `values`; `fraction` is between 0 and 1
+    """
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def regression(values, window, threshold):
+    """
+        Compare the median of the last `window` of `values` (oldest first) with the
+        median of the earlier ones. Returns (recent median, relative change, regressed),
+        or None if there aren't enough values for a baseline.
+    """
+    baseline, recent = values[:-window], values[-window:]
+    if len(recent) < window or len(baseline) < 3:
+        return None
+    before = statistics.median(baseline)
+    after = statistics.median(recent)
+    change = (after - before) / before if before else 0.0
+    return after, change, change > threshold and after - before > MIN_REGRESSION_SECONDS
+
+
+def load_runs(connection, command=None, gateway=None, image=None):
+    """
+        Runs matching the filters, oldest first, with their phases and tests
+    """
+    clauses, params = [], []
+    if command:
+        clauses.append('command = ?')
+        params.append(command)
+    if gateway:
+        clauses.append('gateway = ?')
+        params.append(gateway)
+    if image:
+        clauses.append('image_hash LIKE ?')
+        params.append(image + '%')
+    where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+    rows = connection.execute(
+        f'SELECT id, command, gateway, image_hash, started_at, duration, exit_code, bytes_sent, bytes_received '
+        f'FROM runs {where} ORDER BY started_at, id', params).fetchall()
+    runs = {}
+    for row in rows:
+        runs[row[0]] = {
+            'command': row[1], 'gateway': row[2], 'image_hash': row[3], 'started_at': row[4],
+            'duration': row[5], 'exit_code': row[6], 'bytes': row[7] + row[8], 'phases': {}, 'tests': [],
+        }
+    if not runs:
+        return []
+    selected = f'SELECT id FROM runs {where}'
+    for run_id, name, seconds in connection.execute(
+            f'SELECT run_id, name, seconds FROM phases WHERE run_id IN ({selected})', params):
+        runs[run_id]['phases'][name] = seconds
+    for run_id, name, result, seconds in connection.execute(
+            f'SELECT run_id, name, result, seconds FROM tests WHERE run_id IN ({selected})', params):
+        runs[run_id]['tests'].append((name, result, seconds))
+    return list(runs.values())
+
+def trends(runs, show_tests, window, threshold, limit):
+    """
+        Percentiles and regression checks of the total duration, every phase and,
+        with `show_tests`, every test, per (command, gateway, image hash)
+    """
+    groups = {}
+    for run in runs:
+        groups.setdefault((run['command'], run['gateway'], run['image_hash']), []).append(run)
+
+    rows = []
+    for (command, gateway, image_hash), group in groups.items():
+        group = group[-limit:]
+        ok = [run for run in group if run['exit_code'] == 0]
+        metrics = {'total': [run['duration'] for run in ok]}
+        for run in ok:
+            for name, seconds in run['phases'].items():
+                metrics.setdefault(f'phase:{name}', []).append(seconds)
+        if show_tests:
+            for run in group:
+                for name, _result, seconds in run['tests']:
+                    if seconds is not None:
+                        metrics.setdefault(f'test:{name}', []).append(seconds)
+
+        for metric, values in metrics.items():
+            if not values:
+                continue
+            row = {
+                'command': command,
+                'gateway': gateway,
+                'image_hash': image_hash,
+                'metric': metric,
+                'runs': len(values),
+                'failed': len(group) - len(ok) if metric == 'total' else None,
+                'bytes': statistics.median(run['bytes'] for run in ok) if metric == 'total' else None,
+                'p50': percentile(values, 0.5),
+                'p90': percentile(values, 0.9),
+                'p99': percentile(values, 0.99),
+                'recent': None,
+                'change': None,
+                'regressed': False,
+            }
+            checked = regression(values, window, threshold)
+            if checked is not None:
+                row['recent'], row['change'], row['regressed'] = checked
+            rows.append(row)
+    return rows
+
+
+def _format_seconds(seconds):
+    return '-' if seconds is None else f'{seconds:.2f}s'
+
+def print_trends(rows, style):
+    """
+        Table of percentiles, one row per command, gateway, image and metric
+    """
+    from texttable import Texttable  # pylint: disable=import-outside-toplevel
+
+    table = Texttable(max_width=0)
+    table.set_deco(Texttable.HEADER)
+    table.set_cols_dtype(['t'] * 11)
+    table.set_cols_align(['l', 'l', 'l', 'l', 'r', 'r', 'r', 'r', 'r', 'r', 'r'])
+    table.add_row(['command', 'gateway', 'image', 'metric', 'runs', 'bytes', 'p50', 'p90', 'p99', 'recent', 'change'])
+    for row in rows:
+        change = '-' if row['change'] is None else f'{row["change"]:+.0%}'
+        if row['regressed']:
+            change = style(f'{change} REGRESSION', fg='red')
+        runs = str(row['runs']) if not row['failed'] else f'{row["runs"]} (+{row["failed"]} failed)'
+        table.add_row([
+            row['command'], row['gateway'] or '-', (row['image_hash'] or '-')[:12], row['metric'], runs,
+            '-' if row['bytes'] is None else f'{row["bytes"]:,.0f}',
+            _format_seconds(row['p50']), _format_seconds(row['p90']), _format_seconds(row['p99']),
+            _format_seconds(row['recent']), change,
+        ])
+    click.echo(table.draw())
+
+
+@click.command()
+@click.pass_context
+@click.option('--gateway', help='Only show runs on this gateway ID')
+@click.option('--command', 'command_name', type=click.Choice(['flash', 'python', 'testrun']),
+              help='Only show runs of this command')
+@click.option('--image', help='Only show runs of images whose hash starts with this')
+@click.option('--tests', 'show_tests', is_flag=True, default=False, help='Show the duration of every test')
+@click.option('--window', type=click.IntRange(min=1), default=5, show_default=True,
+              help='Number of recent runs compared with the runs before them')
+@click.option('--threshold', type=click.FloatRange(min=0), default=0.2, show_default=True,
+              help='Flag a regression when the recent median is slower by more than this fraction')
+@click.option('--limit', type=click.IntRange(min=1), default=500, show_default=True,
+              help='Most recent runs to consider per command, gateway and image')
+@click.option('--fail-on-regression', is_flag=True, default=False, help='Exit with status 1 if anything regressed')
+@click.option('--json-output', is_flag=True, default=False, help='Print the results as JSON')
+def history(ctx, gateway, command_name, image, show_tests, window, threshold, limit, fail_on_regression,
+            json_output):
+    """
+        Show how long testrun, flash and python runs took, and flag regressions
+    """
+    connection = connect()
+    try:
+        runs = load_runs(connection, command_name, gateway, image)
+    finally:
+        connection.close()
+    if not runs:
+        click.echo(f'No runs recorded in {history_path()}', err=True)
+        return
+
+    rows = trends(runs, show_tests, window, threshold, limit)
+    regressed = [row for row in rows if row['regressed']]
+    if json_output:
+        click.echo(json.dumps({'runs': len(runs), 'trends': rows}, indent=2))
+    else:
+        print_trends(rows, ctx.obj.style)
+        if regressed:
+            click.echo(ctx.obj.style(f'{len(regressed)} regressions', fg='red'))
+    if regressed and fail_on_regression:
+        ctx.exit(1)
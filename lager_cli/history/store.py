@@ -0,0 +1,256 @@
+"""
+    lager.history.store
+
+    Local SQLite history of testrun, flash and python runs: phase timings, bytes
+    transferred, exit codes and per-test durations. Runs are queued in memory and
+    written in batches; set LAGER_NO_HISTORY to record nothing.
+"""
+import os
+import time
+import atexit
+import contextlib
+import functools
+import threading
+import click
+from ..cache import get_cache_dir
+
+HISTORY_DB_NAME = 'history.sqlite3'
+
+# Queued runs are written once this many have accumulated, and at exit
+BATCH_SIZE = 64
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    command TEXT NOT NULL,
+    gateway TEXT,
+    image_hash TEXT,
+    started_at REAL NOT NULL,
+    duration REAL NOT NULL,
+    exit_code INTEGER,
+    bytes_sent INTEGER NOT NULL,
+    bytes_received INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_gateway ON runs (gateway, command, started_at);
+CREATE INDEX IF NOT EXISTS runs_image_hash ON runs (image_hash, started_at);
+CREATE TABLE IF NOT EXISTS phases (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    seconds REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS phases_run ON phases (run_id);
+CREATE TABLE IF NOT EXISTS tests (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    result TEXT NOT NULL,
+    seconds REAL
+);
+CREATE INDEX IF NOT EXISTS tests_run ON tests (run_id);
+CREATE INDEX IF NOT EXISTS tests_name ON tests (name, run_id);
+'''
+
+
+def history_path():
+    """
+        Path of the history database
+    """
+    return os.path.join(get_cache_dir(), HISTORY_DB_NAME)
+
+def connect(path=None):
+    """
+        Open (and if needed create) the history database
+    """
+    import sqlite3  # pylint: disable=import-outside-toplevel
+    path = path or history_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = sqlite3.connect(path, timeout=10)
+    connection.execute('PRAGMA foreign_keys = ON')
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+class RunRecord:
+    """
+        What one invocation of a command did
+    """
+    def __init__(self, command, gateway=None, image_hash=None):
+        self.command = command
+        self.gateway = None if gateway is None else str(gateway)
+        self.image_hash = image_hash
+        self.started_at = time.time()
+        self.duration = None
+        self.exit_code = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.phases = {}
+        self.tests = []
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+
+    def add_phase(self, name, seconds):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add_bytes(self, sent=0, received=0):
+        with self._lock:
+            self.bytes_sent += sent
+            self.bytes_received += received
+
+    def finish(self, exit_code):
+        self.exit_code = exit_code
+        self.duration = time.monotonic() - self._started
+
+
+_local = threading.local()
+_pending = []
+_pending_lock = threading.Lock()
+_atexit_registered = False
+
+
+def current_record():
+    """
+        The RunRecord of the command running in this thread, if any
+    """
+    return getattr(_local, 'record', None)
+
+@contextlib.contextmanager
+def bind_record(record):
+    """
+        Make `record` the current record of this thread while the block runs; for
+        worker threads doing part of a command's work
+    """
+    previous = current_record()
+    _local.record = record
+    try:
+        yield record
+    finally:
+        _local.record = previous
+
+def record_phase(name, seconds):
+    """
+        Add `seconds` to phase `name` of the current run
+    """
+    record = current_record()
+    if record is not None:
+        record.add_phase(name, seconds)
+
+def count_bytes(sent=0, received=0):
+    """
+        Count bytes sent to / received from the API for the current run
+    """
+    record = current_record()
+    if record is not None:
+        record.add_bytes(sent, received)
+
+def record_tests(matcher):
+    """
+        Store the (name, result, seconds) test results `matcher` parsed, if any
+    """
+    record = current_record()
+    results = getattr(matcher, 'results', None)
+    if record is not None and results:
+        record.tests.extend(results)
+
+
+def write_runs(connection, records):
+    """
+        Insert `records` (RunRecord) in a single transaction
+    """
+    with connection:
+        for record in records:
+            cursor = connection.execute(
+                'INSERT INTO runs (command, gateway, image_hash, started_at, duration, exit_code, bytes_sent, '
+                'bytes_received) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (record.command, record.gateway, record.image_hash, record.started_at, record.duration,
+                 record.exit_code, record.bytes_sent, record.bytes_received))
+            run_id = cursor.lastrowid
+            connection.executemany(
+                'INSERT INTO phases (run_id, name, seconds) VALUES (?, ?, ?)',
+                [(run_id, name, seconds) for name, seconds in record.phases.items()])
+            connection.executemany(
+                'INSERT INTO tests (run_id, name, result, seconds) VALUES (?, ?, ?, ?)',
+                [(run_id, name, result, seconds) for name, result, seconds in record.tests])
+
+def flush():
+    """
+        Write the queued runs. Failures are ignored; history is never worth failing a
+        command for.
+    """
+    with _pending_lock:
+        if not _pending:
+            return
+        batch = list(_pending)
+        _pending.clear()
+    by_path = {}
+    for path, record in batch:
+        by_path.setdefault(path, []).append(record)
+    import sqlite3  # pylint: disable=import-outside-toplevel
+    for path, records in by_path.items():
+        try:
+            connection = connect(path)
+            try:
+                write_runs(connection, records)
+            finally:
+                connection.close()
+        except (OSError, sqlite3.Error):
+            pass
+
+def _queue(record):
+    global _atexit_registered  # pylint: disable=global-statement
+    with _pending_lock:
+        _pending.append((history_path(), record))
+        full = len(_pending) >= BATCH_SIZE
+        if not _atexit_registered:
+            atexit.register(flush)
+            _atexit_registered = True
+    if full:
+        flush()
+
+
+def _exit_code(exc):
+    if isinstance(exc, click.exceptions.Exit):
+        return exc.exit_code
+    if isinstance(exc, click.ClickException):
+        return exc.exit_code
+    if isinstance(exc, SystemExit):
+        return exc.code if isinstance(exc.code, int) else 1
+    return 1
+
+def recorded(command, image_hash=None, when=None):
+    """
+        Decorator recording each run of a command callback in the history.
+        `image_hash(kwargs)` gives the hash of the images the run uses; runs for
+        which `when(kwargs)` is false aren't recorded.
+    """
+    def decorator(callback):
+        @functools.wraps(callback)
+        def wrapper(*args, **kwargs):
+            if os.getenv('LAGER_NO_HISTORY') or (when is not None and not when(kwargs)):
+                return callback(*args, **kwargs)
+            try:
+                digest = image_hash(kwargs) if image_hash is not None else None
+            except (OSError, ValueError):
+                digest = None
+            record = RunRecord(command, kwargs.get('gateway'), digest)
+            exit_code = 0
+            try:
+                with bind_record(record):
+                    return callback(*args, **kwargs)
+            except BaseException as exc:
+                exit_code = _exit_code(exc)
+                raise
+            finally:
+                if record.gateway is None:
+                    record.gateway = _default_gateway()
+                record.finish(exit_code)
+                _queue(record)
+        return wrapper
+    return decorator
+
+def _default_gateway():
+    try:
+        ctx = click.get_current_context()
+        gateway = ctx.params.get('gateway') or ctx.obj.default_gateway
+    except (RuntimeError, AttributeError):
+        return None
+    return None if gateway is None else str(gateway)
@@ -0,0 +1,232 @@
+"""
+    lager.invoke
+
+    Run lager subcommands in-process, capturing their output per thread
+"""
+import io
+import sys
+import time
+import threading
+import traceback
+import contextlib
+import click
+
+
+class _ThreadLocalStream:
+    """
+        Stand-in for sys.stdout / sys.stderr that writes to a per-thread capture
+        buffer when one is active, and to the original stream otherwise
+    """
+    def __init__(self, original):
+        self._original = original
+        self._local = threading.local()
+
+    @property
+    def target(self):
+        return getattr(self._local, 'target', None) or self._original
+
+    @target.setter
+    def target(self, stream):
+        self._local.target = stream
+
+    @property
+    def encoding(self):
+        return self.target.encoding
+
+    @property
+    def errors(self):
+        return self.target.errors
+
+    @property
+    def buffer(self):
+        return self.target.buffer
+
+    def write(self, data):
+        return self.target.write(data)
+
+    def writelines(self, lines):
+        return self.target.writelines(lines)
+
+    def flush(self):
+        return self.target.flush()
+
+    def isatty(self):
+        return self.target.isatty()
+
+    def fileno(self):
+        return self.target.fileno()
+
+    def writable(self):
+        return True
+
+
+_install_lock = threading.Lock()
+_active = 0
+
+def _install():
+    global _active  # pylint: disable=global-statement
+    with _install_lock:
+        if not isinstance(sys.stdout, _ThreadLocalStream):
+            sys.stdout = _ThreadLocalStream(sys.stdout)
+        if not isinstance(sys.stderr, _ThreadLocalStream):
+            sys.stderr = _ThreadLocalStream(sys.stderr)
+        _active += 1
+        return sys.stdout, sys.stderr
+
+def _uninstall():
+    """
+        Put the original sys.stdout / sys.stderr back once the last capture ends, so
+        nothing outlives the in-process invocations (e.g. in the agent)
+    """
+    global _active  # pylint: disable=global-statement
+    with _install_lock:
+        _active -= 1
+        if _active:
+            return
+        # pylint: disable=protected-access
+        if isinstance(sys.stdout, _ThreadLocalStream):
+            sys.stdout = sys.stdout._original
+        if isinstance(sys.stderr, _ThreadLocalStream):
+            sys.stderr = sys.stderr._original
+
+
+class CapturedOutput:
+    """
+        stdout / stderr written by one thread while capturing
+    """
+    def __init__(self):
+        self.stdout = io.TextIOWrapper(io.BytesIO(), encoding='utf-8', errors='replace', write_through=True)
+        self.stderr = io.TextIOWrapper(io.BytesIO(), encoding='utf-8', errors='replace', write_through=True)
+
+    @staticmethod
+    def _text(stream):
+        return stream.buffer.getvalue().decode('utf-8', 'replace')
+
+    def getvalue(self):
+        """
+            (stdout, stderr) captured so far
+        """
+        return self._text(self.stdout), self._text(self.stderr)
+
+
+@contextlib.contextmanager
+def redirect_output(stdout, stderr):
+    """
+        Route this thread's writes to sys.stdout / sys.stderr into the given text
+        streams. Other threads are unaffected.
+    """
+    proxy_stdout, proxy_stderr = _install()
+    previous = proxy_stdout.target, proxy_stderr.target
+    proxy_stdout.target, proxy_stderr.target = stdout, stderr
+    try:
+        yield
+    finally:
+        proxy_stdout.target, proxy_stderr.target = previous
+        _uninstall()
+
+
+@contextlib.contextmanager
+def capture_output():
+    """
+        Collect this thread's output in a CapturedOutput
+    """
+    captured = CapturedOutput()
+    with redirect_output(captured.stdout, captured.stderr):
+        yield captured
+
+
+class InvocationResult:  # pylint: disable=too-few-public-methods
+    """
+        Outcome of one in-process invocation
+    """
+    def __init__(self, argv, exit_code, stdout, stderr, started, duration, error=None):
+        self.argv = argv
+        self.exit_code = exit_code
+        self.stdout = stdout
+        self.stderr = stderr
+        self.started = started
+        self.duration = duration
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.exit_code == 0
+
+    def as_dict(self):
+        return {
+            'argv': self.argv,
+            'exit_code': self.exit_code,
+            'duration_ms': round(self.duration * 1000, 3),
+            'stdout': self.stdout,
+            'stderr': self.stderr,
+            'error': self.error,
+        }
+
+
+def call_captured(func):
+    """
+        Call `func()` the way click's standalone mode would, folding exits, click
+        errors and exceptions into (exit_code, traceback or None). Errors are
+        reported on sys.stderr.
+    """
+    try:
+        func()
+    except click.exceptions.Exit as exc:
+        return exc.exit_code, None
+    except click.ClickException as exc:
+        exc.show()
+        return exc.exit_code, None
+    except click.Abort:
+        click.echo('Aborted!', err=True)
+        return 1, None
+    except SystemExit as exc:
+        return (exc.code if isinstance(exc.code, int) else 1), None
+    except Exception:  # pylint: disable=broad-except
+        return 1, traceback.format_exc()
+    return 0, None
+
+
+def _invoker(parent_ctx, argv):
+    root = parent_ctx.find_root()
+
+    def invoke():
+        name, args = argv[0], list(argv[1:])
+        command = root.command.get_command(root, name)
+        if command is None:
+            raise click.UsageError(f'No such command "{name}".', root)
+        with command.make_context(name, args, parent=root) as ctx:
+            command.invoke(ctx)
+    return invoke
+
+
+def run_command(parent_ctx, argv):
+    """
+        Run the lager subcommand `argv` (e.g. ['gpio', 'output', '3', 'HIGH']) as a child
+        of `parent_ctx`, so it shares the parent's LagerContext and API session.
+        Exits, usage errors and exceptions are all folded into the result.
+
+        Concurrent invocations share one requests.Session. That is safe as long as
+        the session is created before the threads start and only used to send
+        requests afterwards: urllib3's connection pool is thread-safe, and nothing
+        changes the session's headers, adapters or hooks once it exists.
+    """
+    started = time.perf_counter()
+    with capture_output() as captured:
+        exit_code, error = call_captured(_invoker(parent_ctx, argv))
+        stdout, stderr = captured.getvalue()
+    duration = time.perf_counter() - started
+    return InvocationResult(list(argv), exit_code, stdout, stderr, started, duration, error)
+
+
+def stream_command(parent_ctx, argv, stdout, stderr):
+    """
+        Like run_command, but the subcommand writes to the text streams `stdout` and
+        `stderr` as it runs; the result holds no output
+    """
+    started = time.perf_counter()
+    with redirect_output(stdout, stderr):
+        exit_code, error = call_captured(_invoker(parent_ctx, argv))
+        if error:
+            stderr.write(error)
+    duration = time.perf_counter() - started
+    return InvocationResult(list(argv), exit_code, '', '', started, duration, error)
@@ -7,6 +7,7 @@ import click
 from texttable import Texttable
 from .. import SUPPORTED_DEVICES
 from ..config import read_config_file
+from ..gateways import list_gateways
 
 @click.group(name='list')
 def lister():
@@ -18,14 +19,12 @@ def lister():
 
 @lister.command()
 @click.pass_context
-def gateways(ctx):
+@click.option('--refresh', is_flag=True, default=False, help='Ignore the local gateway cache')
+def gateways(ctx, refresh):
     """
         List a user's gateways
     """
-
-    session = ctx.obj.session
-    resp = session.list_gateways()
-    resp.raise_for_status()
+    gateway_list = list_gateways(ctx, refresh=refresh)
 
     table = Texttable()
     table.set_deco(Texttable.HEADER)
@@ -33,7 +32,7 @@ def gateways(ctx):
     table.set_cols_align(["l", "r"])
     table.add_row(['name', 'id'])
 
-    for gateway in resp.json()['gateways']:
+    for gateway in gateway_list:
         table.add_row([gateway['name'], gateway['id']])
     click.echo(table.draw())
 
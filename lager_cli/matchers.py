@@ -1,6 +1,7 @@
 import sys
 import re
 import enum
+import time
 import click
 
 def test_matcher_factory(test_runner):
@@ -78,6 +79,7 @@ def iter_streams(response):
 
 class UnityMatcher:
     summary_separator = b'-----------------------'
+    result_line = re.compile(rb'^[^:]+:\d+:(?P<name>[^:]+):(?P<result>PASS|FAIL|IGNORE)')
 
     def __init__(self, io, _success_regex, _failure_regex):
         self.state = b''
@@ -85,8 +87,22 @@ class UnityMatcher:
         self.has_fail = False
         self.in_summary = False
         self.io = io
+        # (test name, PASS/FAIL/IGNORE, seconds since the previous result or the first output)
+        self.results = []
+        self._last_result_at = None
+
+    def _record_result(self, line):
+        match = self.result_line.match(line)
+        if not match:
+            return
+        now = time.monotonic()
+        seconds = now - self._last_result_at
+        self._last_result_at = now
+        self.results.append((safe_decode(match.group('name')), match.group('result').decode(), round(seconds, 6)))
 
     def feed(self, data):
+        if self._last_result_at is None:
+            self._last_result_at = time.monotonic()
         self.state += data
         if b'\n' not in data:
             return
@@ -95,6 +111,8 @@ class UnityMatcher:
         to_process, remainder = lines[:-1], lines[-1]
         self.state = remainder
         for line in to_process:
+            if not self.in_summary:
+                self._record_result(line)
             if line == self.summary_separator:
                 self.in_summary = True
                 click.echo(line)
@@ -4,15 +4,18 @@
     Openocd telnet server tunnel commands
 """
 
+import functools
 import click
 import trio
 from ..gdbserver.tunnel import serve_tunnel
+from ..gdbserver.forward import DEFAULT_BUFFER_SIZE
 from ..context import get_default_gateway, ensure_debugger_running
+from ..flash.delta import forget_flash_state
 
-def run_openocd_tunnel(ctx, host, port, gateway):
+def run_openocd_tunnel(ctx, host, port, gateway, buffer_size=DEFAULT_BUFFER_SIZE):
     connection_params = ctx.obj.websocket_connection_params(socktype='openocd-tunnel', gateway_id=gateway)
     try:
-        trio.run(serve_tunnel, host, port, connection_params, 'telnet')
+        trio.run(functools.partial(serve_tunnel, host, port, connection_params, 'telnet', buffer_size=buffer_size))
     except PermissionError as exc:
         if port < 1024:
             click.secho(f'Permission denied for port {port}. Using a port number less than '
@@ -32,7 +35,9 @@ def run_openocd_tunnel(ctx, host, port, gateway):
 @click.option('--host', default='localhost', help='interface for telnet to bind. '
               'Use --host \'*\' to bind to all interfaces.', show_default=True)
 @click.option('--port', default=4444, help='Port for telnet', show_default=True)
-def openocd(ctx, gateway, host, port):
+@click.option('--buffer-size', type=click.IntRange(min=1024), default=DEFAULT_BUFFER_SIZE, show_default=True,
+              help='Bytes buffered ahead of a slow reader, per direction')
+def openocd(ctx, gateway, host, port, buffer_size):
     """
         Establish a telnet proxy to openocd server on gateway. By default binds to localhost, meaning telnet
         client connections must originate from the machine running `lager openocd`. If you would
@@ -41,6 +46,8 @@ def openocd(ctx, gateway, host, port):
     if gateway is None:
         gateway = get_default_gateway(ctx)
 
+    # A debugger session can rewrite flash behind the back of delta flashing
+    forget_flash_state(gateway)
     ensure_debugger_running(gateway, ctx)
 
-    run_openocd_tunnel(ctx, host, port, gateway)
+    run_openocd_tunnel(ctx, host, port, gateway, buffer_size)
@@ -5,11 +5,16 @@
 """
 import os
 import sys
+import time
 import itertools
 import functools
 import signal
+import threading
 import click
 from ..context import get_default_gateway
+from ..fanout import fan_out
+from ..flash.delta import forget_flash_state
+from ..history.store import count_bytes, record_phase, recorded
 from ..util import (
     stream_python_output, zip_dir, SizeLimitExceeded,
     FAILED_TO_RETRIEVE_EXIT_CODE,
@@ -43,6 +48,7 @@ def _do_exit(exit_code):
         click.secho('Gateway script forcibly killed due to timeout.', fg='red', err=True)
     sys.exit(exit_code)
 
+@fan_out
 @click.command()
 @click.pass_context
 @click.argument('runnable', required=False, type=click.Path(exists=True))
@@ -63,6 +69,7 @@ def _do_exit(exit_code):
 @click.option('--timeout', type=click.INT, required=False, help='Max runtime in seconds for the python script')
 @click.option('--detach', '-d', is_flag=True, required=False, default=False, help='Detach')
 @click.argument('args', nargs=-1)
+@recorded('python', when=lambda kwargs: not kwargs['kill'])
 def python(ctx, runnable, gateway, image, env, passenv, kill, signum, timeout, detach, args):
     """
         Run a python script on the gateway
@@ -79,6 +86,8 @@ def python(ctx, runnable, gateway, image, env, passenv, kill, signum, timeout, d
         resp.raise_for_status()
         return
 
+    # Scripts can flash the DUT, which delta flashing wouldn't know about
+    forget_flash_state(gateway)
     post_data = [
         ('image', image),
         ('stdout_is_stderr', stdout_is_stderr()),
@@ -107,24 +116,35 @@ def python(ctx, runnable, gateway, image, env, passenv, kill, signum, timeout, d
             click.secho(f'Folder content exceeds max size of {max_content_size:,} bytes', err=True, fg='red')
             ctx.exit(1)
 
-        if len(zipped_folder) > MAX_ZIP_SIZE:
+        zipped_folder.seek(0, os.SEEK_END)
+        zipped_size = zipped_folder.tell()
+        zipped_folder.seek(0)
+        if zipped_size > MAX_ZIP_SIZE:
             click.secho(f'Zipped module content exceeds max size of {MAX_ZIP_SIZE:,} bytes', err=True, fg='red')
             ctx.exit(1)
 
         post_data.append(('module', zipped_folder))
 
+    started = time.monotonic()
     resp = session.run_python(gateway, files=post_data)
+    record_phase('start', time.monotonic() - started)
+    started = time.monotonic()
     kill_python = functools.partial(session.kill_python, gateway)
     handler = functools.partial(sigint_handler, kill_python)
-    signal.signal(signal.SIGINT, handler)
+    if threading.current_thread() is threading.main_thread():
+        # Signal handlers can only be set from the main thread; fanned-out runs skip it
+        signal.signal(signal.SIGINT, handler)
 
     try:
         for (datatype, content) in stream_python_output(resp):
             if datatype == StreamDatatypes.EXIT:
+                record_phase('run', time.monotonic() - started)
                 _do_exit(content)
             elif datatype == StreamDatatypes.STDOUT:
+                count_bytes(received=len(content))
                 click.echo(content, nl=False)
             elif datatype == StreamDatatypes.STDERR:
+                count_bytes(received=len(content))
                 click.echo(content, nl=False, err=True)
             elif datatype == StreamDatatypes.OUTPUT:
                 click.echo(content)
@@ -5,6 +5,7 @@
 """
 import click
 from ..context import get_default_gateway
+from ..fanout import fan_out
 from ..util import stream_output
 
 def do_reset(session, gateway, halt):
@@ -13,6 +14,7 @@ def do_reset(session, gateway, halt):
     """
     return session.reset_dut(gateway, halt)
 
+@fan_out
 @click.command()
 @click.pass_context
 @click.option('--gateway', required=False, help='ID of gateway to which DUT is connected')
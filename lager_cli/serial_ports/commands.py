@@ -5,6 +5,7 @@
 """
 import click
 from ..context import get_default_gateway
+from ..completion import cache_serial_ports
 
 @click.command()
 @click.pass_context
@@ -28,6 +29,8 @@ def serial_ports(ctx, gateway):
 
     session = ctx.obj.session
     resp = session.serial_ports(gateway)
+    ports = resp.json()['serial_ports']
+    cache_serial_ports(gateway, ports)
     style = ctx.obj.style
-    for port in resp.json()['serial_ports']:
+    for port in ports:
         click.echo('{} - {}'.format(style(port['device'], fg='green'), port['description']))
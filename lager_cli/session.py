@@ -0,0 +1,265 @@
+"""
+    lager.session
+
+    HTTP session for the Lager API
+"""
+import os
+import json
+
+from uuid import uuid4
+
+import urllib.parse
+import urllib3
+import requests
+import requests.adapters
+import click
+from requests_toolbelt.sessions import BaseUrlSession
+from . import __version__
+from .context import get_ssl_context, get_ca_path_ssl_context, get_ci_environment, CIEnvironment
+from .endpoints import LagerEndpoints, quote  # pylint: disable=unused-import
+from .exceptions import BlobNotFoundError, GatewayTimeoutError
+from .history.store import count_bytes
+from .upload import report_upload, streaming_file, streaming_multipart
+
+_DEFAULT_HOST = 'https://app.lagerdata.com'
+
+def print_openocd_error(error):
+    """
+        Parse an openocd log file and print the error lines
+    """
+    if not error:
+        return
+    parsed = json.loads(error)
+    logfile = parsed['logfile']
+    if not logfile:
+        return
+    error_printed = False
+    for line in logfile.splitlines():
+        if 'Error: ' in line:
+            error_printed = True
+            click.secho(line, fg='red', err=True)
+
+    if not error_printed:
+        click.secho('OpenOCD failed to start', fg='red', err=True)
+
+def print_docker_error(ctx, error):
+    """
+        Parse an openocd log file and print the error lines
+    """
+    if not error:
+        return
+    parsed = json.loads(error)
+    stdout = parsed['stdout']
+    stderr = parsed['stderr']
+    click.echo(stdout, nl=False)
+    click.echo(stderr, err=True, nl=False)
+    ctx.exit(parsed['returncode'])
+
+def print_canbus_error(ctx, error):
+    if not error:
+        return
+    parsed = json.loads(error)
+    if parsed['stdout']:
+        click.secho(parsed['stdout'], fg='red', nl=False)
+    if parsed['stderr']:
+        click.secho(parsed['stderr'], fg='red', err=True, nl=False)
+        if parsed['stderr'] == 'Cannot find device "can0"\n':
+            click.secho('Please check adapter connection', fg='red', err=True)
+
+
+OPENOCD_ERROR_CODES = {
+    'openocd_start_failed',
+}
+
+DOCKER_ERROR_CODES = set()
+
+CANBUS_ERROR_CODES = {
+    'canbus_up_failed',
+}
+
+
+class LagerSession(LagerEndpoints, BaseUrlSession):
+    """
+        requests session wrapper
+    """
+
+    @staticmethod
+    def handle_errors(ctx, r, *args, **kwargs):
+        """
+            Handle request errors
+        """
+        try:
+            current_context = click.get_current_context()
+            ctx = current_context
+        except RuntimeError:
+            pass
+        if r.status_code == 404:
+            name = ctx.params['gateway'] or ctx.obj.default_gateway
+            click.secho('You don\'t have a gateway with id `{}`'.format(name), fg='red', err=True)
+            click.secho(
+                'Please double check your login credentials and gateway id',
+                fg='red',
+                err=True,
+            )
+            ctx.exit(1)
+        if r.status_code == 422:
+            error = r.json()['error']
+            if error['code'] == 'gateway_timeout_error':
+                raise GatewayTimeoutError(error['description'])
+            if error['code'] == 'blob_not_found':
+                raise BlobNotFoundError(error['description'])
+
+            if error['code'] in OPENOCD_ERROR_CODES:
+                print_openocd_error(error['description'])
+            elif error['code'] in DOCKER_ERROR_CODES:
+                print_docker_error(ctx, error['description'])
+            elif error['code'] in CANBUS_ERROR_CODES:
+                print_canbus_error(ctx, error['description'])
+            else:
+                click.secho(error['description'], fg='red', err=True)
+            ctx.exit(1)
+        if r.status_code >= 500:
+            if True:
+                print(r.text)
+            else:
+                click.secho('Something went wrong with the Lager API', fg='red', err=True)
+            ctx.exit(1)
+
+        r.raise_for_status()
+
+    def __init__(self, auth, *args, response_hook=None, **kwargs):
+        host = os.getenv('LAGER_HOST', _DEFAULT_HOST)
+        base_url = '{}{}'.format(host, '/api/v1/')
+
+        super().__init__(*args, base_url=base_url, **kwargs)
+        verify = 'NOVERIFY' not in os.environ
+        if not verify:
+            urllib3.disable_warnings()
+
+        if auth:
+            auth_header = {
+                'Authorization': '{} {}'.format(auth['type'], auth['token'])
+            }
+            self.headers.update(auth_header)
+        self.headers.update({
+            'Lager-Version': __version__,
+            'Lager-Invocation-Id': str(uuid4()),
+            })
+        ci_env = get_ci_environment()
+        if ci_env == CIEnvironment.HOST:
+            self.headers.update({'Lager-CI-Active': 'False'})
+        else:
+            self.headers.update({'Lager-CI-Active': 'True'})
+            self.headers.update({'Lager-CI-System': ci_env.name})
+
+        self.debug = False
+        self.verify = verify
+        if verify:
+            self.mount('https://', SharedSSLContextAdapter(get_ssl_context()))
+        if response_hook:
+            self.hooks['response'].append(response_hook)
+
+
+    def rebind(self, response_hook):
+        """
+            Prepare a reused session for a new invocation
+        """
+        self.headers['Lager-Invocation-Id'] = str(uuid4())
+        self.hooks['response'] = [response_hook]
+
+    def handle_response(self, response):
+        """
+            Run the session's error handling on a response fetched with `quiet`
+        """
+        for hook in self.hooks['response']:
+            hook(response)
+        return response
+
+    @staticmethod
+    def _stream_body(args, kwargs):
+        """
+            Replace multipart `files` and file-like `data` with streaming bodies that
+            report their progress. Returns the UploadProgress, if any.
+        """
+        label = urllib.parse.urlsplit(str(kwargs.get('url', args[1] if len(args) > 1 else ''))).path.rsplit('/', 1)[-1]
+        if kwargs.get('files') is not None:
+            body, content_type, progress = streaming_multipart(kwargs.pop('files'), label)
+            kwargs['data'] = body
+            kwargs['headers']['Content-Type'] = content_type
+            return progress
+        data = kwargs.get('data')
+        if hasattr(data, 'read') and hasattr(data, 'seek'):
+            kwargs['data'], progress = streaming_file(data, label)
+            return progress
+        return None
+
+    def _send(self, progress, *args, **kwargs):
+        if progress is None:
+            response = super().request(*args, **kwargs)
+            body = response.request.body
+            if isinstance(body, str):
+                body = body.encode()
+            count_bytes(sent=len(body) if isinstance(body, bytes) else 0)
+            return response
+        try:
+            response = super().request(*args, **kwargs)
+        finally:
+            progress.close()
+            count_bytes(sent=progress.sent)
+        report_upload(progress, max(response.elapsed.total_seconds() - progress.upload_seconds, 0), self.debug)
+        return response
+
+    def request(self, *args, quiet=False, **kwargs):  # pylint: disable=arguments-differ
+        """
+            Catch connection errors so they can be handled more cleanly.
+            With `quiet`, skip the error handling (no messages, no exit) and leave
+            failures to the caller as ordinary requests exceptions / error responses.
+        """
+
+        if 'headers' not in kwargs:
+            kwargs['headers'] = {}
+        kwargs['headers'].update({'Lager-Request-Id': str(uuid4())})
+        progress = self._stream_body(args, kwargs)
+        if quiet:
+            # A non-empty request-level hook list replaces the session's handle_errors hook
+            kwargs.setdefault('hooks', {'response': [_ignore_response]})
+            return self._send(progress, *args, **kwargs)
+
+        try:
+            return self._send(progress, *args, **kwargs)
+        except requests.exceptions.ConnectTimeout:
+            click.secho('Connection to Lager API timed out', fg='red', err=True)
+            click.get_current_context().exit(1)
+        except requests.exceptions.ConnectionError:
+            click.secho('Could not connect to Lager API', fg='red', err=True)
+            click.get_current_context().exit(1)
+
+def _ignore_response(response, *args, **kwargs):  # pylint: disable=unused-argument
+    return response
+
+class SharedSSLContextAdapter(requests.adapters.HTTPAdapter):
+    """
+        HTTP adapter whose connection pools use the process-wide SSL context
+    """
+    def __init__(self, ssl_context, **kwargs):
+        self.ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):  # pylint: disable=arguments-differ
+        kwargs['ssl_context'] = self.ssl_context
+        return super().init_poolmanager(*args, **kwargs)
+
+    def cert_verify(self, conn, url, verify, cert):
+        super().cert_verify(conn, url, verify, cert)
+        if not url.lower().startswith('https'):
+            return
+        if verify is True:
+            # CA certs are already loaded in the shared context; don't reload them per connection
+            conn.ca_certs = None
+            conn.ca_cert_dir = None
+            conn.conn_kw['ssl_context'] = self.ssl_context
+        elif isinstance(verify, str):
+            # urllib3 would load the bundle into the shared context, changing it for everyone
+            conn.ca_certs = None
+            conn.ca_cert_dir = None
+            conn.conn_kw['ssl_context'] = get_ca_path_ssl_context(verify)
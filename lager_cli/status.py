@@ -1,8 +1,10 @@
 """
     lager.status
 
-    Job status output functions
+    Job status output functions. trio, the websocket stack, bson and requests are imported
+    inside the functions that need them, so importing this module stays cheap.
 """
+# pylint: disable=import-outside-toplevel
 try:
     _TERMIOS_IMPORT_FAILED = False
     import termios
@@ -14,15 +16,10 @@ import threading
 import sys
 import os
 import select
+from contextlib import contextmanager
 from functools import partial
-import bson
 import click
-import trio
-import lager_trio_websocket as trio_websocket
-from lager_trio_websocket import open_websocket_url
-from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception_type
-import wsproto.frame_protocol as wsframeproto
-import requests
+from .history.store import count_bytes, record_tests
 from .matchers import test_matcher_factory
 from .util import heartbeat
 
@@ -38,6 +35,8 @@ async def handle_url_message(matcher, urls):
     """
         Handle a message with data location urls
     """
+    import trio
+    import requests
     downloader = partial(requests.get, stream=True)
     for url in urls:
         response = await trio.to_thread.run_sync(downloader, url)
@@ -52,6 +51,7 @@ async def handle_data_message(matcher, message):
         entry = item['entry']
         if 'payload' in entry:
             payload = entry['payload']
+            count_bytes(received=len(payload))
             matcher.feed(payload)
 
 async def handle_message(matcher, message):
@@ -71,6 +71,10 @@ class InterMessageTimeout(Exception):
     pass
 
 async def read_from_websocket(websocket, matcher, message_timeout, nursery):
+    import bson
+    import trio
+    import lager_trio_websocket as trio_websocket
+    import wsproto.frame_protocol as wsframeproto
     try:
         while True:
             try:
@@ -91,6 +95,7 @@ async def read_from_websocket(websocket, matcher, message_timeout, nursery):
         nursery.cancel_scope.cancel()
 
 def reader_function(io, send_channel, trio_token):
+    import trio
     try:
         while True:
             data = io.read()
@@ -103,6 +108,9 @@ def reader_function(io, send_channel, trio_token):
 
 
 async def write_to_websocket(websocket, receive_channel, eof_timeout, nursery):
+    import trio
+    import lager_trio_websocket as trio_websocket
+    import wsproto.frame_protocol as wsframeproto
     while True:
         message = await receive_channel.receive()
         if message['type'] == 'EOF':
@@ -198,11 +206,22 @@ class StandardIO:
         return None
 
 
-@retry(reraise=True, sleep=trio.sleep, stop=stop_after_attempt(4), wait=wait_fixed(2), retry=retry_if_exception_type(trio_websocket.ConnectionRejected))
-async def display_job_output(connection_params, test_runner, interactive, line_ending, message_timeout, overall_timeout, eof_timeout, success_regex=None, failure_regex=None):
+async def display_job_output(*args, **kwargs):
     """
-        Display job output from websocket
+        Display job output from websocket, retrying if the API rejects the connection
     """
+    import trio
+    import lager_trio_websocket as trio_websocket
+    from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception_type
+
+    retrying = retry(reraise=True, sleep=trio.sleep, stop=stop_after_attempt(4), wait=wait_fixed(2),
+                     retry=retry_if_exception_type(trio_websocket.ConnectionRejected))
+    return await retrying(_display_job_output)(*args, **kwargs)
+
+async def _display_job_output(connection_params, test_runner, interactive, line_ending, message_timeout, overall_timeout, eof_timeout, success_regex=None, failure_regex=None):
+    import trio
+    from lager_trio_websocket import open_websocket_url
+
     (uri, kwargs) = connection_params
     match_class = test_matcher_factory(test_runner)
     if interactive:
@@ -234,6 +253,8 @@ def run_job_output(connection_params, test_runner, interactive, line_ending, mes
     """
         Run async task to get job output from websocket
     """
+    import trio
+
     if interactive and _TERMIOS_IMPORT_FAILED:
         click.echo(_TERMIOS_IMPORT_FAILED, err=True)
         click.echo('Interactive terminal not currently supported by Windows; please try running in Docker.', err=True)
@@ -248,9 +269,23 @@ def run_job_output(connection_params, test_runner, interactive, line_ending, mes
     else:
         raise ValueError('Invalid line ending')
 
-    try:
+    with job_output_errors(message_timeout, overall_timeout, debug):
         matcher = trio.run(display_job_output, connection_params, test_runner, interactive, line_ending, message_timeout, overall_timeout, eof_timeout, success_regex, failure_regex)
+        record_tests(matcher)
         click.get_current_context().exit(matcher.exit_code)
+
+@contextmanager
+def job_output_errors(message_timeout, overall_timeout, debug=False):
+    """
+        Report errors from reading job output over the websocket and exit
+    """
+    import trio
+    import requests
+    import lager_trio_websocket as trio_websocket
+    import wsproto.frame_protocol as wsframeproto
+
+    try:
+        yield
     except trio.TooSlowError:
         suffix = '' if overall_timeout == 1 else 's'
         message = f'Job status timed out after {overall_timeout} second{suffix}'
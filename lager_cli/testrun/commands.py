@@ -8,10 +8,17 @@ import click
 from ..context import get_default_gateway
 from ..reset.commands import do_reset
 from ..uart.commands import do_uart
-from ..flash.commands import do_flash
+from ..flash.commands import collect_images, flash_images
+from ..flash.blobs import images_digest
+from ..flash.delta import forget_flash_state
+from ..history.store import recorded
+from ..flash.images import ImageFormatError
+from ..flash.sectors import connected_device
 from ..paramtypes import BinfileType
 from ..util import stream_output
 from ..status import run_job_output
+from .matrix import testrun_matrix
+from .pipeline import PhaseTimer, run_pipelined
 
 @click.command()
 @click.pass_context
@@ -42,39 +49,103 @@ from ..status import run_job_output
     help='If true, only flash target if image differs from current flash contents',
     default=True)
 @click.option('--verify/--no-verify', help='Verify image successfully flashed', default=True)
+@click.option(
+    '--convert/--no-convert',
+    help='Convert hex files to binary segments locally before uploading',
+    default=True, show_default=True)
 @click.option('--display-job-id', default=False, is_flag=True)
 @click.option('--success-regex', help='Line regex for detecting a successful test. Will be passed to Python\'s re.compile', default=None, required=False)
 @click.option('--failure-regex', help='Line regex for detecting a failed test. Will be passed to Python\'s re.compile', default=None, required=False)
+@click.option('--pipeline', is_flag=True, default=False,
+              help='Upload images during the halt, connect to the test output before flashing, '
+                   'and report the time spent in each phase')
+@click.option('--matrix', 'matrix_file', type=click.File('r'),
+              help='Run every combination of the gateways, images and matchers in this YAML file')
+@click.option('--jobs', type=click.IntRange(min=1), default=None,
+              help='With --matrix, maximum number of gateways to run on at once. Default: 4')
+@click.option('--retries', type=click.IntRange(min=0), default=None,
+              help='With --matrix, times to retry a failed target. Default: 0')
+@click.option('--report', type=click.Path(dir_okay=False, writable=True), default=None,
+              help='With --matrix, write the combined results here as JSON. Default: testrun-report.json')
+@click.option('--shard', is_flag=True, default=False,
+              help='With --matrix, run each image once, spreading them over the gateways by their past durations')
+@recorded(
+    'testrun',
+    image_hash=lambda kwargs: images_digest(kwargs['hexfile'], [(binf.path, binf.address) for binf in kwargs['binfile']]),
+    when=lambda kwargs: kwargs['matrix_file'] is None)
 def testrun(ctx, gateway, serial_device, baudrate, bytesize, parity, stopbits, xonxoff, rtscts,
             dsrdtr, test_runner, interactive, message_timeout, overall_timeout, hexfile, binfile,
-            preverify, verify, display_job_id, success_regex, failure_regex):
+            preverify, verify, convert, display_job_id, success_regex, failure_regex, pipeline,
+            matrix_file, jobs, retries, report, shard):
     """
         Flash and run test on a DUT connected to a gateway
     """
+    if shard and matrix_file is None:
+        raise click.UsageError('--shard requires --matrix')
+    if matrix_file is not None:
+        if gateway is not None or hexfile or binfile:
+            raise click.UsageError('With --matrix, gateways and images come from the matrix file')
+        testrun_matrix(ctx, ctx.command, matrix_file, jobs, retries, report, shard)
+        return
+    if pipeline and interactive:
+        raise click.UsageError('--pipeline cannot be used with --interactive')
     if gateway is None:
         gateway = get_default_gateway(ctx)
     session = ctx.obj.session
-    resp = do_reset(session, gateway, halt=True)
-    stream_output(resp)
 
-    resp = do_uart(
-        ctx, gateway, serial_device, baudrate, bytesize, parity,
-        stopbits, xonxoff, rtscts, dsrdtr, test_runner
-    )
-    test_run = resp.json()
+    # Parse the images before touching the DUT, so a bad image doesn't leave it halted
+    # with an orphaned UART job
+    try:
+        images = collect_images(hexfile, binfile, convert=convert, device=connected_device(gateway))
+    except ImageFormatError as exc:
+        click.secho(f'Invalid image {exc}', fg='red', err=True)
+        ctx.exit(1)
+    forget_flash_state(gateway)
+
+    if pipeline:
+        def start_uart():
+            return do_uart(
+                ctx, gateway, serial_device, baudrate, bytesize, parity,
+                stopbits, xonxoff, rtscts, dsrdtr, test_runner
+            )
+
+        run_pipelined(
+            ctx, gateway, images, start_uart, (preverify, verify), test_runner, message_timeout,
+            overall_timeout, display_job_id, success_regex, failure_regex,
+        )
+        return
+
+    timer = PhaseTimer()
+    try:
+        with timer.phase('halt'):
+            resp = do_reset(session, gateway, halt=True)
+            stream_output(resp)
+
+        with timer.phase('uart'):
+            resp = do_uart(
+                ctx, gateway, serial_device, baudrate, bytesize, parity,
+                stopbits, xonxoff, rtscts, dsrdtr, test_runner
+            )
+            test_run = resp.json()
 
-    resp = do_flash(session, gateway, hexfile, binfile, preverify, verify)
-    stream_output(resp)
+        with timer.phase('flash'):
+            resp = flash_images(session, gateway, images, preverify, verify, debug=ctx.obj.debug)
+            stream_output(resp)
 
-    resp = do_reset(ctx.obj.session, gateway, halt=False)
-    stream_output(resp)
+        with timer.phase('reset'):
+            resp = do_reset(ctx.obj.session, gateway, halt=False)
+            stream_output(resp)
 
-    job_id = test_run['test_run']['id']
-    if display_job_id:
-        click.echo('Job id: {}'.format(job_id), err=True)
+        job_id = test_run['test_run']['id']
+        if display_job_id:
+            click.echo('Job id: {}'.format(job_id), err=True)
 
-    connection_params = ctx.obj.websocket_connection_params(socktype='job', job_id=job_id)
-    run_job_output(
-        connection_params, test_runner, interactive, None, message_timeout,
-        overall_timeout, None, ctx.obj.debug, success_regex, failure_regex,
-    )
+        connection_params = ctx.obj.websocket_connection_params(socktype='job', job_id=job_id)
+        with timer.phase('output'):
+            run_job_output(
+                connection_params, test_runner, interactive, None, message_timeout,
+                overall_timeout, None, ctx.obj.debug, success_regex, failure_regex,
+            )
+    finally:
+        timer.stop()
+        timer.record()
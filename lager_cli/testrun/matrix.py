@@ -0,0 +1,406 @@
+"""
+    lager.testrun.matrix
+
+    Run a testrun for every combination of gateway, image and matcher settings in a
+    matrix file, on a bounded pool of gateways sharing one API session
+"""
+import io
+import re
+import json
+import time
+import itertools
+import threading
+import concurrent.futures
+import click
+from ..fanout import PREFIX_COLORS, PrefixedWriter, resolve_gateways
+from ..invoke import stream_command
+from .shard import estimate_duration, image_key, lpt_assign, read_durations, record_duration
+
+DEFAULT_JOBS = 4
+DEFAULT_REPORT = 'testrun-report.json'
+
+# Options that the matrix itself decides, or that need a terminal
+_RESERVED_OPTIONS = frozenset(('gateway', 'matrix', 'jobs', 'retries', 'report', 'interactive'))
+
+_UNITY_SUMMARY = re.compile(rb'^(\d+) Tests (\d+) Failures (\d+) Ignored', re.MULTILINE)
+
+
+class Target:  # pylint: disable=too-few-public-methods
+    """
+        One testrun of the matrix: an image and matcher settings on a gateway
+    """
+    def __init__(self, gateway_label, gateway, image, matcher, argv, image_key=None):
+        self.gateway_label = gateway_label
+        self.gateway = gateway
+        self.image = image
+        self.matcher = matcher
+        self.argv = argv
+        self.image_key = image_key
+
+    @property
+    def label(self):
+        parts = [self.gateway_label, self.image]
+        if self.matcher is not None:
+            parts.append(self.matcher)
+        return '/'.join(parts)
+
+
+class Matrix:  # pylint: disable=too-few-public-methods
+    """
+        A parsed matrix file
+    """
+    def __init__(self, gateways, options, images, matchers, jobs=None, retries=None, report=None, shard=False):
+        self.gateways = gateways
+        self.options = options
+        self.images = images
+        self.matchers = matchers
+        self.jobs = jobs
+        self.retries = retries
+        self.report = report
+        self.shard = shard
+
+    def runs(self):
+        """
+            [(image name, matcher name, testrun options)] for every image and matcher
+        """
+        runs = []
+        for (image, image_options), (matcher, matcher_options) in itertools.product(
+                self.images.items(), (self.matchers or {None: {}}).items()):
+            options = dict(self.options)
+            options.update(image_options)
+            options.update(matcher_options)
+            runs.append((image, matcher, options))
+        return runs
+
+
+def _named_options(document, key, required):
+    value = document.get(key)
+    if value is None:
+        if required:
+            raise click.UsageError(f'Matrix needs `{key}`')
+        return {}
+    if not isinstance(value, dict) or not all(isinstance(options or {}, dict) for options in value.values()):
+        raise click.UsageError(f'Matrix `{key}` must map names to testrun options')
+    return {str(name): dict(options or {}) for name, options in value.items()}
+
+def parse_matrix(text):
+    """
+        Parse a matrix file: `gateways` (names, ids or globs), `images` and optional
+        `matchers` mapping names to testrun options, shared `options`, and optional
+        `jobs`, `retries`, `report` and `shard`
+    """
+    from ..util import yaml_safe_load  # pylint: disable=import-outside-toplevel
+
+    document = yaml_safe_load(text)
+    if not isinstance(document, dict):
+        raise click.UsageError('Matrix must be a mapping')
+
+    gateways = document.get('gateways')
+    if isinstance(gateways, (str, int)):
+        gateways = [gateways]
+    if not gateways or not isinstance(gateways, list):
+        raise click.UsageError('Matrix needs a list of `gateways`')
+
+    options = document.get('options') or {}
+    if not isinstance(options, dict):
+        raise click.UsageError('Matrix `options` must be a mapping of testrun options')
+
+    return Matrix(
+        [str(gateway) for gateway in gateways],
+        options,
+        _named_options(document, 'images', required=True),
+        _named_options(document, 'matchers', required=False),
+        document.get('jobs'),
+        document.get('retries'),
+        document.get('report'),
+        bool(document.get('shard')),
+    )
+
+
+def command_args(command, options):
+    """
+        Command line arguments setting `options` ({option name: value}) of `command`.
+        Names are the long option names without dashes; lists repeat the option.
+    """
+    params = {}
+    for param in command.params:
+        if isinstance(param, click.Option):
+            for opt in param.opts:
+                if opt.startswith('--'):
+                    params[opt[2:]] = param
+
+    argv = []
+    for name, value in options.items():
+        name = str(name).replace('_', '-')
+        param = params.get(name)
+        if param is None or param.name in _RESERVED_OPTIONS:
+            raise click.UsageError(f'Matrix: `{name}` is not a testrun option that can be set per target')
+        if param.is_flag:
+            if value:
+                argv.append(param.opts[0])
+            elif param.secondary_opts:
+                argv.append(param.secondary_opts[0])
+            continue
+        values = value if isinstance(value, list) else [value]
+        for item in values:
+            argv.extend([param.opts[0], str(item)])
+    return argv
+
+def expand_targets(ctx, command, matrix):
+    """
+        Every (gateway, image, matcher) combination of `matrix` as a Target
+    """
+    gateways = resolve_gateways(ctx, matrix.gateways, False)
+    targets = []
+    for (label, gateway), (image, matcher, options) in itertools.product(gateways, matrix.runs()):
+        argv = ['testrun', '--gateway', gateway, *command_args(command, options)]
+        targets.append(Target(label, gateway, image, matcher, argv, image_key(options)))
+    return targets
+
+def shard_targets(ctx, command, matrix):
+    """
+        Each (image, matcher) combination of `matrix` once, on one of its gateways,
+        assigned by bin packing on past durations to finish the suite soonest
+    """
+    gateways = dict((gateway, label) for label, gateway in resolve_gateways(ctx, matrix.gateways, False))
+    runs = matrix.runs()
+    keys = [image_key(options) for _image, _matcher, options in runs]
+    durations = read_durations()
+
+    def estimate(index, gateway):
+        return estimate_duration(durations, keys[index], gateway)
+
+    assigned, loads = lpt_assign(range(len(runs)), list(gateways), estimate)
+    targets = []
+    for gateway, indices in assigned.items():
+        for index in indices:
+            image, matcher, options = runs[index]
+            argv = ['testrun', '--gateway', gateway, *command_args(command, options)]
+            targets.append(Target(gateways[gateway], gateway, image, matcher, argv, keys[index]))
+        click.echo(f'{gateways[gateway]}: {len(indices)} runs, about {loads[gateway]:.0f}s', err=True)
+    if loads:
+        click.echo(f'Estimated wall time: {max(loads.values()):.0f}s', err=True)
+    return targets
+
+
+def unity_summary(output):
+    """
+        Test counts from the last Unity summary line in `output`, if any
+    """
+    matches = _UNITY_SUMMARY.findall(output)
+    if not matches:
+        return None
+    tests, failures, ignored = (int(value) for value in matches[-1])
+    return {'tests': tests, 'failures': failures, 'ignored': ignored}
+
+
+class TargetResult:
+    """
+        The attempts at running one target
+    """
+    def __init__(self, target):
+        self.target = target
+        self.attempts = []
+
+    @property
+    def exit_code(self):
+        return self.attempts[-1]['exit_code'] if self.attempts else None
+
+    @property
+    def flaky(self):
+        return self.exit_code == 0 and len(self.attempts) > 1
+
+    @property
+    def duration(self):
+        return sum(attempt['duration_s'] for attempt in self.attempts)
+
+    def as_dict(self):
+        target = self.target
+        return {
+            'target': target.label,
+            'gateway': target.gateway_label,
+            'gateway_id': target.gateway,
+            'image': target.image,
+            'matcher': target.matcher,
+            'argv': target.argv,
+            'exit_code': self.exit_code,
+            'flaky': self.flaky,
+            'attempts': self.attempts,
+        }
+
+
+class _TeeWriter(io.RawIOBase):
+    """
+        Writes to several binary streams at once
+    """
+    def __init__(self, *targets):
+        super().__init__()
+        self._targets = targets
+
+    def writable(self):
+        return True
+
+    def isatty(self):
+        return False
+
+    def write(self, b):
+        data = bytes(b)
+        for target in self._targets:
+            target.write(data)
+        return len(data)
+
+
+def _run_target(ctx, target, retries, prefix, stdout, stderr):
+    result = TargetResult(target)
+    for attempt in range(retries + 1):
+        out_raw = PrefixedWriter(stdout, prefix)
+        err_raw = PrefixedWriter(stderr, prefix)
+        captured = io.BytesIO()
+        out = io.TextIOWrapper(_TeeWriter(out_raw, captured), encoding='utf-8', errors='replace', write_through=True)
+        err = io.TextIOWrapper(err_raw, encoding='utf-8', errors='replace', write_through=True)
+        if attempt:
+            err.write(f'Retrying (attempt {attempt + 1} of {retries + 1})\n')
+        invocation = stream_command(ctx, target.argv, out, err)
+        out_raw.finish()
+        err_raw.finish()
+        result.attempts.append({
+            'exit_code': invocation.exit_code,
+            'duration_s': round(invocation.duration, 3),
+            'results': unity_summary(captured.getvalue()),
+            'error': invocation.error,
+        })
+        if invocation.ok:
+            break
+    return result
+
+def run_matrix(ctx, targets, jobs, retries):
+    """
+        Run `targets`, at most `jobs` gateways at a time. Targets on the same gateway
+        run one after another, since they share its DUT. A failed target is retried
+        up to `retries` times. Output lines are prefixed with the target.
+    """
+    stdout = click.get_binary_stream('stdout')
+    stderr = click.get_binary_stream('stderr')
+    width = max(len(target.label) for target in targets)
+    style = ctx.obj.style
+    prefixes = {
+        target.label: (style(f'[{target.label:<{width}}]', fg=PREFIX_COLORS[i % len(PREFIX_COLORS)]) + ' ').encode()
+        for i, target in enumerate(targets)
+    }
+
+    by_gateway = {}
+    for target in targets:
+        by_gateway.setdefault(target.gateway, []).append(target)
+
+    # Make sure worker threads share one session rather than racing to create it
+    ctx.obj.session  # pylint: disable=pointless-statement
+
+    results = {}
+    lock = threading.Lock()
+
+    def run_gateway(gateway_targets):
+        for target in gateway_targets:
+            result = _run_target(ctx, target, retries, prefixes[target.label], stdout, stderr)
+            last = result.attempts[-1]
+            if target.image_key and (last['exit_code'] == 0 or last['results'] is not None):
+                record_duration(target.image_key, target.gateway, last['duration_s'])
+            with lock:
+                results[target.label] = result
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(run_gateway, gateway_targets) for gateway_targets in by_gateway.values()]
+        try:
+            for future in futures:
+                future.result()
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+            raise
+    return [results[target.label] for target in targets]
+
+
+def build_report(results, duration):
+    """
+        Combined results of a matrix run
+    """
+    return {
+        'duration_s': round(duration, 3),
+        'targets': len(results),
+        'tests': unity_totals(results),
+        'passed': sum(1 for result in results if result.exit_code == 0),
+        'failed': sum(1 for result in results if result.exit_code != 0),
+        'flaky': sum(1 for result in results if result.flaky),
+        'results': [result.as_dict() for result in results],
+    }
+
+def print_summary(results, style):
+    """
+        Table of exit codes, attempts, test counts and durations, one row per target
+    """
+    from texttable import Texttable  # pylint: disable=import-outside-toplevel
+
+    table = Texttable(max_width=0)
+    table.set_deco(Texttable.HEADER)
+    table.set_cols_dtype(['t', 'i', 'i', 't', 't'])
+    table.set_cols_align(['l', 'r', 'r', 'r', 'r'])
+    table.add_row(['target', 'exit code', 'attempts', 'tests', 'duration'])
+    for result in results:
+        counts = result.attempts[-1]['results']
+        tests = f'{counts["tests"] - counts["failures"]}/{counts["tests"]}' if counts else '-'
+        table.add_row([result.target.label, result.exit_code, len(result.attempts), tests, f'{result.duration:.2f}s'])
+    click.echo(table.draw())
+    failed = sum(1 for result in results if result.exit_code != 0)
+    flaky = sum(1 for result in results if result.flaky)
+    if flaky:
+        click.echo(style(f'{flaky} of {len(results)} targets passed only on retry', fg='yellow'))
+    if failed:
+        click.echo(style(f'{failed} of {len(results)} targets failed', fg='red'))
+
+def unity_totals(results):
+    """
+        Unity test counts summed over the last attempt of every target
+    """
+    totals = {'tests': 0, 'failures': 0, 'ignored': 0}
+    for result in results:
+        for name, count in (result.attempts[-1]['results'] or {}).items():
+            totals[name] += count
+    return totals
+
+def print_unity_totals(results, style):
+    """
+        The suite's combined results, in the format of a Unity summary
+    """
+    totals = unity_totals(results)
+    failed = totals['failures'] > 0 or any(result.exit_code != 0 for result in results)
+    color = 'red' if failed else 'green'
+    click.echo(style(f'{totals["tests"]} Tests {totals["failures"]} Failures {totals["ignored"]} Ignored', fg=color))
+    click.echo(style('FAIL' if failed else 'OK', fg=color))
+
+def testrun_matrix(ctx, command, matrix_file, jobs, retries, report, shard=False):
+    """
+        Run the matrix in `matrix_file`, print a summary and write the report.
+        `jobs`, `retries` and `report` override the matrix file's settings. With
+        `shard`, each image runs once, on one of the gateways.
+    """
+    matrix = parse_matrix(matrix_file.read())
+    shard = shard or matrix.shard
+    retries = retries if retries is not None else (matrix.retries or 0)
+    report = report or matrix.report or DEFAULT_REPORT
+
+    if shard:
+        targets = shard_targets(ctx, command, matrix)
+        jobs = jobs or matrix.jobs or len({target.gateway for target in targets})
+    else:
+        targets = expand_targets(ctx, command, matrix)
+        jobs = jobs or matrix.jobs or DEFAULT_JOBS
+    started = time.perf_counter()
+    results = run_matrix(ctx, targets, jobs, retries)
+    print_summary(results, ctx.obj.style)
+    if shard:
+        print_unity_totals(results, ctx.obj.style)
+    with open(report, 'w') as f:
+        json.dump(build_report(results, time.perf_counter() - started), f, indent=2)
+        f.write('\n')
+    click.echo(f'Report written to {report}', err=True)
+    if any(result.exit_code != 0 for result in results):
+        ctx.exit(1)
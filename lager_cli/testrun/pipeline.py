@@ -0,0 +1,278 @@
+"""
+    lager.testrun.pipeline
+
+    Pipelined testrun: images are uploaded while the DUT is halted, and the UART job's
+    websocket is connected and buffering while the DUT is flashed, so output from the
+    first instructions after the reset is never missed
+"""
+# pylint: disable=import-outside-toplevel
+import json
+import math
+import time
+import contextlib
+import platform
+import threading
+from functools import partial
+import click
+from ..flash.commands import flash_files, send_flash
+from ..history.store import bind_record, current_record, record_phase, record_tests
+from ..matchers import test_matcher_factory
+from ..reset.commands import do_reset
+from ..status import (
+    InterMessageTimeout, StandardIO, handle_message, job_output_errors, reader_function, write_to_websocket,
+)
+from ..util import heartbeat, stream_output
+
+# Phases in the order they start
+PHASES = ('halt', 'upload', 'uart', 'connect', 'flash', 'reset', 'output')
+
+
+class PhaseTimer:
+    """
+        Start and end of each phase of a testrun, relative to the start of the run
+    """
+    def __init__(self):
+        self.started = time.monotonic()
+        self.finished = None
+        self.phases = {}
+
+    def begin(self, name):
+        self.phases[name] = [time.monotonic() - self.started, None]
+
+    def end(self, name):
+        self.phases[name][1] = time.monotonic() - self.started
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+            Time the block as phase `name`
+        """
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    async def run_sync(self, name, func, *args):
+        """
+            Run the blocking `func(*args)` in a worker thread as phase `name`
+        """
+        import trio
+
+        record = current_record()
+
+        def run():
+            with bind_record(record):
+                return func(*args)
+
+        with self.phase(name):
+            return await trio.to_thread.run_sync(run)
+
+    def stop(self):
+        self.finished = time.monotonic() - self.started
+
+    @property
+    def wall_seconds(self):
+        return self.finished if self.finished is not None else time.monotonic() - self.started
+
+    def seconds(self, name):
+        start, end = self.phases[name]
+        return (end if end is not None else self.wall_seconds) - start
+
+    def summary(self):
+        """
+            Machine-readable phase timings
+        """
+        return {
+            'event': 'phases',
+            'wall_s': round(self.wall_seconds, 6),
+            'phases': {
+                name: {'start_s': round(self.phases[name][0], 6), 'seconds': round(self.seconds(name), 6)}
+                for name in PHASES if name in self.phases
+            },
+        }
+
+    def record(self):
+        """
+            Add the phase timings to the current run in the history
+        """
+        for name in self.phases:
+            record_phase(name, self.seconds(name))
+
+    def render(self):
+        """
+            Human-readable phase timings
+        """
+        names = [name for name in PHASES if name in self.phases]
+        serial = sum(self.seconds(name) for name in names)
+        lines = [f'Phase timings: {self.wall_seconds:.2f}s wall, '
+                 f'{max(serial - self.wall_seconds, 0):.2f}s saved by overlapping']
+        for name in names:
+            start = self.phases[name][0]
+            lines.append(f'  {name:<8} {start:7.2f}s - {start + self.seconds(name):7.2f}s  {self.seconds(name):7.2f}s')
+        return '\n'.join(lines)
+
+
+class JobOutput:
+    """
+        A job's output, read from its websocket from the moment the job starts.
+        Messages are buffered, and the message timeout doesn't run, until `release`;
+        then the buffered messages and everything after them go to the matcher.
+    """
+    def __init__(self, test_runner, message_timeout, success_regex=None, failure_regex=None):
+        self.io_source = StandardIO()
+        self.matcher = test_matcher_factory(test_runner)(self.io_source, success_regex, failure_regex)
+        self.message_timeout = message_timeout
+        self._released = None
+        self._read_scope = None
+        self._nursery = None
+        self._websocket = None
+
+    async def run(self, connection_params, overall_timeout, task_status=None):
+        """
+            Connect to the job websocket, retrying if the API rejects the connection,
+            and read until the job ends. Reports started once connected.
+        """
+        import trio
+        import lager_trio_websocket as trio_websocket
+        from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception_type
+
+        task_status = task_status or trio.TASK_STATUS_IGNORED
+        retrying = retry(reraise=True, sleep=trio.sleep, stop=stop_after_attempt(4), wait=wait_fixed(2),
+                         retry=retry_if_exception_type(trio_websocket.ConnectionRejected))
+        with trio.fail_after(overall_timeout):
+            await retrying(self._run)(connection_params, task_status)
+
+    async def _run(self, connection_params, task_status):
+        import trio
+        from lager_trio_websocket import open_websocket_url
+
+        uri, kwargs = connection_params
+        self._released = trio.Event()
+        send_channel, receive_channel = trio.open_memory_channel(math.inf)
+        async with open_websocket_url(uri, disconnect_timeout=1, **kwargs) as websocket:
+            async with trio.open_nursery() as nursery:
+                self._nursery = nursery
+                self._websocket = websocket
+                nursery.start_soon(heartbeat, websocket, 30, 30)
+                nursery.start_soon(self._read, websocket, send_channel)
+                nursery.start_soon(self._feed, receive_channel, nursery)
+                task_status.started()
+
+    def _deadline(self):
+        import trio
+
+        if not self._released.is_set():
+            return math.inf
+        return trio.current_time() + self.message_timeout
+
+    async def _read(self, websocket, send_channel):
+        import bson
+        import trio
+        import lager_trio_websocket as trio_websocket
+        import wsproto.frame_protocol as wsframeproto
+        async with send_channel:
+            while True:
+                with trio.CancelScope(deadline=self._deadline()) as self._read_scope:
+                    try:
+                        message = await websocket.get_message()
+                    except trio_websocket.ConnectionClosed as exc:
+                        if exc.reason is None:
+                            return
+                        if exc.reason.code != wsframeproto.CloseReason.NORMAL_CLOSURE or exc.reason.reason != 'EOF':
+                            raise
+                        return
+                if self._read_scope.cancelled_caught:
+                    raise InterMessageTimeout(self.message_timeout)
+                await send_channel.send(bson.loads(message))
+
+    async def _feed(self, receive_channel, nursery):
+        await self._released.wait()
+        try:
+            async with receive_channel:
+                async for message in receive_channel:
+                    await handle_message(self.matcher, message)
+        finally:
+            self.matcher.done()
+            nursery.cancel_scope.cancel()
+
+    def release(self):
+        """
+            Hand the buffered messages and everything after them to the matcher, start
+            the message timeout and forward stdin to the job. Call from the trio thread.
+        """
+        import trio
+
+        self._released.set()
+        if self._read_scope is not None:
+            self._read_scope.deadline = trio.current_time() + self.message_timeout
+        if platform.system() != 'Windows':
+            send_channel, receive_channel = trio.open_memory_channel(0)
+            token = trio.lowlevel.current_trio_token()
+            thread = threading.Thread(target=reader_function, args=(self.io_source, send_channel, token), daemon=True)
+            thread.start()
+            self._nursery.start_soon(write_to_websocket, self._websocket, receive_channel, None, self._nursery)
+
+
+async def _testrun(ctx, gateway, images, start_uart, flash_options, job, overall_timeout, display_job_id, timer):
+    import trio
+
+    session = ctx.obj.session
+    uploaded = {}
+
+    async def upload():
+        uploaded['files'] = await timer.run_sync(
+            'upload', partial(flash_files, session, gateway, images, *flash_options, debug=ctx.obj.debug))
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(timer.run_sync, 'halt', lambda: stream_output(do_reset(session, gateway, halt=True)))
+        nursery.start_soon(upload)
+
+    test_run = await timer.run_sync('uart', lambda: start_uart().json())
+    job_id = test_run['test_run']['id']
+    if display_job_id:
+        click.echo('Job id: {}'.format(job_id), err=True)
+    connection_params = ctx.obj.websocket_connection_params(socktype='job', job_id=job_id)
+
+    async with trio.open_nursery() as nursery:
+        connected = trio.Event()
+
+        async def connect():
+            timer.begin('connect')
+            await nursery.start(job.run, connection_params, overall_timeout)
+            timer.end('connect')
+            connected.set()
+
+        nursery.start_soon(connect)
+        await timer.run_sync('flash', lambda: stream_output(send_flash(
+            session, gateway, images, uploaded['files'], *flash_options, debug=ctx.obj.debug)))
+        await connected.wait()
+        await timer.run_sync('reset', lambda: stream_output(do_reset(session, gateway, halt=False)))
+        timer.begin('output')
+        job.release()
+    timer.end('output')
+
+
+def run_pipelined(ctx, gateway, images, start_uart, flash_options, test_runner, message_timeout,
+                  overall_timeout, display_job_id, success_regex, failure_regex):
+    """
+        Halt the DUT while uploading `images`, start the UART job with `start_uart()`,
+        flash while the job websocket connects, reset, and print the job output and
+        the time spent in each phase. `flash_options` is (preverify, verify).
+    """
+    import trio
+
+    timer = PhaseTimer()
+    job = JobOutput(test_runner, message_timeout, success_regex, failure_regex)
+    with job_output_errors(message_timeout, overall_timeout, ctx.obj.debug):
+        try:
+            trio.run(_testrun, ctx, gateway, images, start_uart, flash_options, job, overall_timeout,
+                     display_job_id, timer)
+        finally:
+            timer.stop()
+            timer.record()
+            click.echo(timer.render(), err=True)
+            if ctx.obj.debug:
+                click.echo(json.dumps(timer.summary()), err=True)
+        record_tests(job.matcher)
+        ctx.exit(job.matcher.exit_code)
@@ -0,0 +1,105 @@
+"""
+    lager.testrun.shard
+
+    Split a test suite across gateways: every image runs once, on the gateway that
+    longest-processing-time-first bin packing picks from its past durations
+"""
+import threading
+import click
+from ..cache import read_cache, write_cache
+from ..flash.blobs import images_digest
+from ..paramtypes import HexParamType
+
+DURATIONS_CACHE_NAME = 'testrun-durations.json'
+
+# Estimate for an image that has never run anywhere, when there is no history at all
+DEFAULT_DURATION = 60.0
+
+# Weight of the latest run in the moving average of an image's duration on a gateway
+_SMOOTHING = 0.5
+
+# Matrix targets on different gateways finish from different threads
+_durations_lock = threading.Lock()
+
+
+def _values(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+def image_key(options):
+    """
+        Key identifying the images that testrun `options` flash (see images_digest).
+        None if there are no images or one of them is missing or malformed.
+    """
+    binfiles = []
+    for value in _values(options.get('binfile')):
+        path, _, address = str(value).rpartition(',')
+        try:
+            binfiles.append((path, HexParamType().convert(address, None, None)))
+        except click.BadParameter:
+            return None
+    try:
+        return images_digest(
+            [str(path) for path in _values(options.get('hexfile'))], binfiles,
+            [str(path) for path in _values(options.get('elffile'))])
+    except OSError:
+        return None
+
+
+def read_durations():
+    """
+        {image key: {gateway: {'seconds': moving average, 'runs': count}}}
+    """
+    durations, _age = read_cache(DURATIONS_CACHE_NAME)
+    return durations if isinstance(durations, dict) else {}
+
+def record_duration(key, gateway, seconds):
+    """
+        Fold a run of the images `key` on `gateway` that took `seconds` into their history
+    """
+    with _durations_lock:
+        durations = read_durations()
+        entry = durations.setdefault(key, {}).get(str(gateway))
+        if entry:
+            seconds = _SMOOTHING * seconds + (1 - _SMOOTHING) * entry['seconds']
+            runs = entry['runs'] + 1
+        else:
+            runs = 1
+        durations[key][str(gateway)] = {'seconds': round(seconds, 3), 'runs': runs}
+        write_cache(DURATIONS_CACHE_NAME, durations)
+
+def estimate_duration(durations, key, gateway):
+    """
+        Expected seconds for the images `key` on `gateway`: their history there, else
+        their average over other gateways, else the average of everything recorded
+    """
+    history = durations.get(key, {})
+    if str(gateway) in history:
+        return history[str(gateway)]['seconds']
+    if history:
+        return sum(entry['seconds'] for entry in history.values()) / len(history)
+    known = [entry['seconds'] for entries in durations.values() for entry in entries.values()]
+    if known:
+        return sum(known) / len(known)
+    return DEFAULT_DURATION
+
+
+def lpt_assign(jobs, gateways, estimate):
+    """
+        Assign `jobs` to `gateways` with longest-processing-time-first bin packing:
+        jobs in decreasing order of their average estimate, each to the gateway where
+        it would finish soonest. `estimate(job, gateway)` gives a job's duration.
+        Returns ({gateway: [job, ...]}, {gateway: estimated busy seconds}).
+    """
+    loads = {gateway: 0.0 for gateway in gateways}
+    assigned = {gateway: [] for gateway in gateways}
+
+    def average(job):
+        return sum(estimate(job, gateway) for gateway in gateways) / len(gateways)
+
+    for job in sorted(jobs, key=average, reverse=True):
+        gateway = min(gateways, key=lambda gateway: loads[gateway] + estimate(job, gateway))
+        assigned[gateway].append(job)
+        loads[gateway] += estimate(job, gateway)
+    return assigned, loads
@@ -0,0 +1,91 @@
+"""
+    lager.tunnel.commands
+
+    Serve the gateway's GDB, OpenOCD telnet and J-Link ports from a single process
+"""
+
+import functools
+import click
+import trio
+from ..gdbserver.tunnel import serve_tunnels, serve_mux_tunnels
+from ..gdbserver.forward import DEFAULT_BUFFER_SIZE
+from ..context import get_default_gateway, ensure_debugger_running, TUNNEL_PORTS
+from ..flash.delta import forget_flash_state
+
+_TUNNEL_NAMES = {
+    'gdb-tunnel': 'GDB',
+    'openocd-tunnel': 'telnet',
+    'jl-tunnel': 'J-Link GDB',
+}
+
+def _default_socktypes(status):
+    if 'Listening on port 3333' in status['logfile']:
+        return ('gdb-tunnel', 'openocd-tunnel')
+    if 'Logging started @' in status['logfile']:
+        return ('jl-tunnel',)
+    raise RuntimeError('Unknown tunnel type')
+
+def _run_tunnels(ctx, host, gateway, forwards, multiplex, buffer_size):
+    if multiplex:
+        connection_params = ctx.obj.websocket_connection_params(socktype='tunnel-mux', gateway_id=gateway)
+        tunnels = [(port, TUNNEL_PORTS[socktype], _TUNNEL_NAMES[socktype]) for (socktype, port) in forwards]
+        runner = functools.partial(serve_mux_tunnels, host, tunnels, connection_params, buffer_size=buffer_size)
+    else:
+        tunnels = [
+            (port, ctx.obj.websocket_connection_params(socktype=socktype, gateway_id=gateway), _TUNNEL_NAMES[socktype])
+            for (socktype, port) in forwards
+        ]
+        runner = functools.partial(serve_tunnels, host, tunnels, buffer_size=buffer_size)
+
+    try:
+        trio.run(runner)
+    except PermissionError as exc:
+        if any(port < 1024 for (_socktype, port) in forwards):
+            click.secho('Permission denied. Using a port number less than '
+                        '1024 typically requires root privileges.', fg='red', err=True)
+        else:
+            click.secho(str(exc), fg='red', err=True)
+        if ctx.obj.debug:
+            raise
+    except OSError as exc:
+        click.secho(f'Could not start tunnel: {exc}', fg='red', err=True)
+        if ctx.obj.debug:
+            raise
+
+@click.command()
+@click.pass_context
+@click.option('--gateway', required=False, help='ID of gateway to which DUT is connected')
+@click.option('--host', default='localhost', help='interface for the tunnels to bind. '
+              'Use --host \'*\' to bind to all interfaces.', show_default=True)
+@click.option('--gdb-port', type=click.INT, help='Local port for the OpenOCD GDB server (gateway port 3333)')
+@click.option('--telnet-port', type=click.INT, help='Local port for the OpenOCD telnet server (gateway port 4444)')
+@click.option('--jlink-port', type=click.INT, help='Local port for the J-Link GDB server (gateway port 2331)')
+@click.option('--multiplex/--no-multiplex', default=False, show_default=True,
+              help='Carry every port over a single websocket to the gateway')
+@click.option('--buffer-size', type=click.IntRange(min=1024), default=DEFAULT_BUFFER_SIZE, show_default=True,
+              help='Bytes buffered ahead of a slow reader, per direction and per port')
+def tunnel(ctx, gateway, host, gdb_port, telnet_port, jlink_port, multiplex, buffer_size):
+    """
+        Establish proxies to several debugger ports on the gateway from one process. Without any
+        port options, serves GDB on 3333 and telnet on 4444 for OpenOCD, or GDB on 2331 for J-Link.
+
+        With --multiplex, all client connections share a single websocket to the gateway, each with
+        its own flow control, so only one set of auth, TLS and heartbeats is needed.
+    """
+    if gateway is None:
+        gateway = get_default_gateway(ctx)
+
+    # A debugger session can rewrite flash behind the back of delta flashing
+    forget_flash_state(gateway)
+    status = ensure_debugger_running(gateway, ctx)
+
+    requested = (
+        ('gdb-tunnel', gdb_port),
+        ('openocd-tunnel', telnet_port),
+        ('jl-tunnel', jlink_port),
+    )
+    forwards = [(socktype, port) for (socktype, port) in requested if port is not None]
+    if not forwards:
+        forwards = [(socktype, TUNNEL_PORTS[socktype]) for socktype in _default_socktypes(status)]
+
+    _run_tunnels(ctx, host, gateway, forwards, multiplex, buffer_size)
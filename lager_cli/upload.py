@@ -0,0 +1,177 @@
+"""
+    lager.upload
+
+    Streaming request bodies with progress and timing reports
+"""
+import os
+import sys
+import json
+import time
+import threading
+import click
+
+# Uploads smaller than this finish too quickly for a progress bar to be useful
+PROGRESS_MIN_BYTES = 256 * 1024
+_REDRAW_INTERVAL = 0.1
+_BAR_WIDTH = 30
+
+
+def _format_rate(bytes_per_second):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if bytes_per_second < 1024 or unit == 'GB':
+            return f'{bytes_per_second:.1f} {unit}/s'
+        bytes_per_second /= 1024
+    return None
+
+
+class UploadProgress:
+    """
+        Tracks how much of a request body has been sent. Draws a progress bar with
+        throughput and ETA on stderr if `show_bar`, and summarizes the transfer.
+    """
+    def __init__(self, label, total, show_bar=False):
+        self.label = label
+        self.total = total
+        self.show_bar = show_bar
+        self.sent = 0
+        self.started = None
+        self.finished = None
+        self._last_draw = 0
+
+    def update(self, sent):
+        """
+            Record that `sent` bytes have been sent so far
+        """
+        now = time.monotonic()
+        if self.started is None:
+            self.started = now
+        self.sent = sent
+        if self.total and sent >= self.total:
+            self.finished = now
+        if self.show_bar and (now - self._last_draw >= _REDRAW_INTERVAL or sent >= self.total):
+            self._last_draw = now
+            self._draw(now)
+
+    def _draw(self, now):
+        elapsed = max(now - self.started, 1e-6)
+        rate = self.sent / elapsed
+        fraction = self.sent / self.total if self.total else 1
+        filled = int(fraction * _BAR_WIDTH)
+        eta = (self.total - self.sent) / rate if rate else 0
+        click.echo(
+            f'\rUploading {self.label} [{"#" * filled}{"." * (_BAR_WIDTH - filled)}] {fraction:4.0%} '
+            f'{_format_rate(rate)} ETA {eta:.0f}s ',
+            nl=False, err=True,
+        )
+
+    def close(self):
+        """
+            End the progress bar line
+        """
+        if self.show_bar and self.started is not None:
+            click.echo('', err=True)
+            self.show_bar = False
+
+    @property
+    def upload_seconds(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    def summary(self, response_seconds=None):
+        """
+            Machine-readable timing of the transfer
+        """
+        seconds = self.upload_seconds
+        return {
+            'event': 'upload',
+            'label': self.label,
+            'bytes': self.sent,
+            'upload_s': round(seconds, 6),
+            'bytes_per_s': round(self.sent / seconds) if seconds else None,
+            'response_s': None if response_seconds is None else round(response_seconds, 6),
+        }
+
+
+class ProgressReader:
+    """
+        File-like wrapper reporting reads to an UploadProgress. `requests` streams
+        any body with `read` and `len`.
+    """
+    def __init__(self, fileobj, total, progress):
+        self.fileobj = fileobj
+        self.total = total
+        self.progress = progress
+        self.sent = 0
+
+    def __len__(self):
+        return self.total
+
+    def read(self, size=-1):
+        chunk = self.fileobj.read(size)
+        self.sent += len(chunk)
+        self.progress.update(self.sent)
+        return chunk
+
+
+def _file_size(fileobj):
+    position = fileobj.tell()
+    fileobj.seek(0, os.SEEK_END)
+    end = fileobj.tell()
+    fileobj.seek(position)
+    return end - position
+
+def encoder_fields(files):
+    """
+        Convert a `requests`-style `files` list to MultipartEncoder fields. As with
+        `requests`, every value is sent as a file part; file objects are read lazily.
+    """
+    fields = []
+    for name, value in files:
+        if isinstance(value, (tuple, list)):
+            filename, data, *content_type = value
+        else:
+            filename = getattr(value, 'name', None)
+            filename = os.path.basename(filename) if isinstance(filename, str) else name
+            data = value
+            content_type = []
+        if data is None:
+            continue
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        if not isinstance(data, (str, bytes, bytearray)) and not hasattr(data, 'read'):
+            data = str(data)
+        fields.append((name, (filename, data, *content_type)))
+    return fields
+
+
+def _show_bar(total):
+    return (total >= PROGRESS_MIN_BYTES and sys.stderr.isatty()
+            and threading.current_thread() is threading.main_thread())
+
+def streaming_multipart(files, label):
+    """
+        A streaming multipart/form-data body for `files` and its UploadProgress.
+        Returns (body, content type, progress).
+    """
+    from requests_toolbelt.multipart.encoder import MultipartEncoder  # pylint: disable=import-outside-toplevel
+
+    encoder = MultipartEncoder(encoder_fields(files))
+    progress = UploadProgress(label, encoder.len, _show_bar(encoder.len))
+    return ProgressReader(encoder, encoder.len, progress), encoder.content_type, progress
+
+def streaming_file(fileobj, label):
+    """
+        A streaming body for the file object `fileobj` and its UploadProgress
+    """
+    total = _file_size(fileobj)
+    progress = UploadProgress(label, total, _show_bar(total))
+    return ProgressReader(fileobj, total, progress), progress
+
+def report_upload(progress, response_seconds, debug):
+    """
+        Finish the progress bar and, with `debug`, print the timing summary as JSON
+    """
+    progress.close()
+    if debug:
+        click.echo(json.dumps(progress.summary(response_seconds)), err=True)
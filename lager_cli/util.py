@@ -4,23 +4,24 @@
     Catchall for utility functions
 """
 import sys
+import re
+import atexit
 import math
-from distutils.version import StrictVersion
 import pathlib
 import enum
 import os
 import json
+import threading
+import shutil
+import tempfile
 from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
-from io import BytesIO
-import yaml
-import requests
 import click
-import trio
-import lager_trio_websocket as trio_websocket
-import wsproto.frame_protocol as wsframeproto
 from .matchers import iter_streams
 from .safe_unpickle import restricted_loads
 from .exceptions import OutputFormatNotSupported
+from .cache import read_cache, write_cache
+from .history.store import count_bytes
+from .context import get_ci_environment, CIEnvironment
 from . import __version__
 
 
@@ -33,6 +34,7 @@ def stream_output(response, chunk_size=1):
         Stream an http response to stdout
     """
     for chunk in response.iter_content(chunk_size=chunk_size):
+        count_bytes(received=len(chunk))
         click.echo(chunk, nl=False)
         sys.stdout.flush()
 
@@ -62,6 +64,10 @@ class StreamDatatypes(enum.Enum):
 def identity(x):
     return x
 
+def yaml_safe_load(data):
+    import yaml  # pylint: disable=import-outside-toplevel
+    return yaml.safe_load(data)
+
 class OutputHandler:
     def __init__(self):
         self.encoder = None
@@ -72,7 +78,7 @@ class OutputHandler:
         1: identity,
         2: restricted_loads,
         3: json.loads,
-        4: yaml.safe_load,
+        4: yaml_safe_load,
     }
 
     def parse(self):
@@ -144,6 +150,10 @@ async def heartbeat(websocket, timeout, interval):
     :raises: ``TooSlowError`` if the timeout expires.
     :returns: This function runs until cancelled.
     '''
+    # pylint: disable=import-outside-toplevel
+    import trio
+    import lager_trio_websocket as trio_websocket
+    import wsproto.frame_protocol as wsframeproto
     try:
         while True:
             with trio.fail_after(timeout):
@@ -168,13 +178,17 @@ class SizeLimitExceeded(RuntimeError):
     """
 
 
+# Zipped folders larger than this are spooled to disk rather than kept in memory
+ZIP_SPOOL_SIZE = 1024 * 1024
+
 def zip_dir(root, max_content_size=math.inf):
     """
-        Zip a directory into memory
+        Zip a directory into a temporary file, which stays in memory while it is small.
+        Returns the file, positioned at the start.
     """
     rootpath = pathlib.Path(root)
     exclude = ['.git']
-    archive = BytesIO()
+    archive = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_SIZE)
     total_size = 0
     with ZipFile(archive, 'w') as zip_archive:
         # Walk once to find and exclude any python virtual envs
@@ -194,32 +208,100 @@ def zip_dir(root, max_content_size=math.inf):
                 full_name = pathlib.Path(dirpath) / name
                 total_size += os.path.getsize(full_name)
                 if total_size > max_content_size:
+                    archive.close()
                     raise SizeLimitExceeded
 
                 fileinfo = ZipInfo(str(full_name.relative_to(rootpath)))
-                with open(full_name, 'rb') as f:
-                    zip_archive.writestr(fileinfo, f.read(), ZIP_DEFLATED)
-    return archive.getbuffer()
+                fileinfo.compress_type = ZIP_DEFLATED
+                with open(full_name, 'rb') as src, zip_archive.open(fileinfo, 'w') as dest:
+                    shutil.copyfileobj(src, dest)
+    archive.seek(0)
+    return archive
 
 
 _VERSION_MESSAGE = """WARNING: You are using {package_name} version {this_version}; however, version {newest_version} is available.
 You should consider upgrading via the 'pip install -U {package_name}' command."""
 
 
+VERSION_CACHE_NAME = 'pypi-version.json'
+VERSION_CHECK_TTL = 24 * 60 * 60
+# How long exit waits for a running version check to write the cache
+VERSION_CHECK_EXIT_WAIT = 0.5
+_PYPI_SIMPLE_URL = 'https://pypi.org/simple/{package_name}/'
+_PYPI_SIMPLE_JSON = 'application/vnd.pypi.simple.v1+json'
+
+
+def _parse_release(version):
+    """
+        Parse a final release version like '0.1.42' into a tuple of ints.
+        Returns None for anything else (pre-releases, dev builds, etc)
+    """
+    if not re.fullmatch(r'\d+(\.\d+)*', version):
+        return None
+    return tuple(int(part) for part in version.split('.'))
+
+def fetch_newest_version(package_name, timeout=3):
+    """
+        Ask PyPI for the newest final release of `package_name`.
+        Uses the JSON flavor of the simple index, which lists version strings
+        without the per-release metadata of the full JSON API.
+    """
+    # pylint: disable=import-outside-toplevel
+    import urllib.request
+    from .context import get_ssl_context
+
+    url = _PYPI_SIMPLE_URL.format(package_name=package_name)
+    request = urllib.request.Request(url, headers={'Accept': _PYPI_SIMPLE_JSON})
+    with urllib.request.urlopen(request, timeout=timeout, context=get_ssl_context()) as response:
+        data = json.load(response)
+    releases = [version for version in data['versions'] if _parse_release(version)]
+    return max(releases, key=_parse_release, default=None)
+
+def _refresh_version_cache(package_name):
+    """
+        Fetch the newest version and cache it. Failures are cached too, so an
+        offline machine retries once per TTL rather than on every command.
+    """
+    try:
+        newest_version = fetch_newest_version(package_name)
+    except Exception:  # pylint: disable=broad-except
+        newest_version = None
+    write_cache(VERSION_CACHE_NAME, {'package': package_name, 'newest_version': newest_version})
+
+def _skip_version_check():
+    if os.getenv('LAGER_NO_VERSION_CHECK'):
+        return True
+    return get_ci_environment() != CIEnvironment.HOST and not sys.stderr.isatty()
+
 def check_version(package_name, current_version):
     """
     Check whether `package_name` has a version available that is newer than `current_version`
+
+    Only the cached result is consulted; when it is missing or older than
+    VERSION_CHECK_TTL a daemon thread refreshes it for the next invocation.
+    At exit the thread gets up to VERSION_CHECK_EXIT_WAIT seconds to finish, so
+    short commands still write the cache. Skipped in non-interactive CI.
     """
-    url = 'https://pypi.org/pypi/{package_name}/json'.format(package_name=package_name)
-    this_version = StrictVersion(current_version)
-    try:
-        data = requests.get(url, timeout=(3, 3)).json()
-        newest_version = max(StrictVersion(key) for key in data["releases"].keys())
-        if this_version < newest_version:
-            formatted_message = _VERSION_MESSAGE.format(
-                package_name=package_name,
-                this_version=this_version,
-                newest_version=newest_version)
-            click.secho(formatted_message, err=True, fg='yellow')
-    except Exception as exc:
-        pass
+    if _skip_version_check():
+        return
+
+    cached, age = read_cache(VERSION_CACHE_NAME)
+    if not isinstance(cached, dict) or cached.get('package') != package_name:
+        cached, age = None, None
+    if age is None or not 0 <= age < VERSION_CHECK_TTL:
+        thread = threading.Thread(
+            target=_refresh_version_cache, args=(package_name,),
+            name='lager-version-check', daemon=True)
+        thread.start()
+        atexit.register(thread.join, VERSION_CHECK_EXIT_WAIT)
+    if cached is None or not cached.get('newest_version'):
+        return
+
+    newest_version = cached['newest_version']
+    this_version = _parse_release(current_version)
+    if this_version is not None and this_version < _parse_release(newest_version):
+        formatted_message = _VERSION_MESSAGE.format(
+            package_name=package_name,
+            this_version=current_version,
+            newest_version=newest_version)
+        click.secho(formatted_message, err=True, fg='yellow')
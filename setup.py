@@ -38,6 +38,7 @@ if __name__ == "__main__":
         license='AGPLv3',
         python_requires=">=3.6",
         packages=setuptools.find_packages(),
+        package_data={'lager_cli.bench': ['startup_thresholds.json']},
         install_requires='''
             async-generator == 1.10
             bson == 0.5.10
@@ -67,7 +68,7 @@ if __name__ == "__main__":
         ''',
         entry_points={
             'console_scripts': [
-                'lager=lager_cli.cli:cli',
+                'lager=lager_cli.__main__:main',
             ],
         }
     )
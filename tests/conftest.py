@@ -3,6 +3,7 @@
 """
 import sys
 import os
+import subprocess
 import contextlib
 import functools
 import trio
@@ -19,6 +20,8 @@ import pytest
 #pylint: disable=invalid-name,unused-argument,redefined-outer-name
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 
+from lager_cli.bench.mockapi import MockLagerAPI  # pylint: disable=wrong-import-position
+
 @pytest.fixture
 def make_server():
     """
@@ -98,3 +101,48 @@ def download_server(download_urls):
         await websocket.send_message(message)
         await websocket.aclose(reason='EOF')
     return handler_fn
+
+@pytest.fixture
+def mock_api():
+    """
+        A running local stand-in for the Lager API; ``mock_api.env()`` points lager at it
+    """
+    with MockLagerAPI() as api:
+        yield api
+
+def _lager_popen_args(api, tmp_path, args):
+    root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    env = {
+        **os.environ, **api.env(),
+        'LAGER_CONFIG_FILE_DIR': str(tmp_path), 'LAGER_CACHE_DIR': str(tmp_path / 'cache'),
+        'LAGER_NO_VERSION_CHECK': '1', 'LAGER_NO_AGENT': '1',
+    }
+    return [sys.executable, '-m', 'lager_cli', *args], {'cwd': root, 'env': env}
+
+@pytest.fixture
+def lager(tmp_path):
+    """
+        Run `python -m lager_cli` against a MockLagerAPI, with its own config and cache
+        directories: ``lager(api, 'gpio', 'input', '3')``
+    """
+    def run(api, *args):
+        argv, kwargs = _lager_popen_args(api, tmp_path, args)
+        return subprocess.run(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
+    return run
+
+@pytest.fixture
+def lager_background(tmp_path):
+    """
+        Like ``lager``, but start the command in the background and return its Popen;
+        it is killed at the end of the test
+    """
+    processes = []
+
+    def start(api, *args):
+        argv, kwargs = _lager_popen_args(api, tmp_path, args)
+        processes.append(subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs))
+        return processes[-1]
+    yield start
+    for process in processes:
+        process.kill()
+        process.communicate()
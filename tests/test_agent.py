@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+import subprocess
+import pytest
+from lager_cli.agent.client import forward, agent_request, describe_forwarded
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+@pytest.fixture
+def running_agent(tmp_path, monkeypatch):
+    monkeypatch.setenv('LAGER_CONFIG_FILE_DIR', str(tmp_path))
+    monkeypatch.setenv('LAGER_AGENT_SOCKET', str(tmp_path / 'agent.sock'))
+    monkeypatch.delenv('LAGER_NO_AGENT', raising=False)
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'lager_cli', 'agent', 'start', '--foreground', '--idle-timeout', '30'],
+        cwd=ROOT,
+    )
+    try:
+        for _ in range(200):
+            if agent_request({'type': 'status'}) is not None:
+                break
+            time.sleep(0.05)
+        yield tmp_path
+        agent_request({'type': 'stop'})
+        proc.wait(10)
+    finally:
+        proc.kill()
+
+def test_invocation_runs_in_agent(running_agent, capfd):
+    assert forward(['set', 'default', 'gateway', 'abc']) == 0
+    assert 'gateway_id = abc' in (running_agent / '.lager').read_text()
+
+    assert forward(['set', 'default', 'no-such-setting']) == 2
+    assert 'No such command' in capfd.readouterr().err
+    assert agent_request({'type': 'status'})['invocations'] == 2
+
+def test_unsafe_commands_stay_local(running_agent):
+    assert forward(['login']) is None
+    assert forward(['--debug', 'python', 'script.py']) is None
+    assert forward(['flash', '--hexfile', 'app.hex']) is None
+    assert forward(['connect', '--device', 'nrf52']) is None
+    assert forward(['canbus', 'dump', '--gateway', 'abc', 'can0']) is None
+    assert forward(['canbus']) is None
+    assert 'canbus dump' not in describe_forwarded() and 'canbus send' in describe_forwarded()
@@ -0,0 +1,44 @@
+import sys
+import json
+from click.testing import CliRunner
+from lager_cli.cli import cli
+from lager_cli.batch.commands import parse_lines, parse_yaml, group_steps
+from lager_cli.invoke import capture_output
+
+def test_parse_and_group():
+    steps = parse_lines('# setup\nlager gpio output 3 HIGH\nadc read 1 &\nadc read 2 &\ncanbus send 0 123#DEAD\n')
+    assert [step.argv for step in steps][-1] == ['canbus', 'send', '0', '123#DEAD']
+    assert [[step.index for step in stage] for stage in group_steps(steps)] == [[0], [1, 2], [3]]
+
+    steps = parse_yaml('steps:\n  - gpio output 3 HIGH\n  - run: [adc, read, "1"]\n    name: adc\n    parallel: true\n')
+    assert steps[1].argv == ['adc', 'read', '1'] and steps[1].name == 'adc' and steps[1].parallel
+
+def test_batch_reports_each_step(tmp_path, monkeypatch):
+    monkeypatch.setenv('LAGER_CONFIG_FILE_DIR', str(tmp_path))
+    monkeypatch.setenv('LAGER_SECRET_TOKEN', 'secret')
+    script = 'set default gateway abc\nset default serial-device /dev/ttyUSB0\nset default nope\ngpio output 3 HIGH\n'
+    result = CliRunner().invoke(cli, ['--no-version-check', 'batch', '-'], input=script)
+    assert result.exit_code == 1
+
+    report = json.loads(result.stdout)
+    assert (report['steps'], report['completed'], report['failed']) == (4, 3, 1)
+    assert [step['exit_code'] for step in report['results']] == [0, 0, 2]
+    assert 'No such command' in report['results'][2]['stderr']
+    assert 'gateway_id = abc' in (tmp_path / '.lager').read_text()
+
+def test_capture_restores_streams():
+    stdout, stderr = sys.stdout, sys.stderr
+    with capture_output() as outer:
+        print('outer')
+        with capture_output() as inner:
+            print('inner')
+        assert sys.stdout is not stdout
+    assert (sys.stdout, sys.stderr) == (stdout, stderr)
+    assert outer.getvalue()[0] == 'outer\n' and inner.getvalue()[0] == 'inner\n'
+
+def test_long_running_steps_rejected(tmp_path, monkeypatch):
+    monkeypatch.setenv('LAGER_CONFIG_FILE_DIR', str(tmp_path))
+    monkeypatch.setenv('LAGER_SECRET_TOKEN', 'secret')
+    for script, command in (('uart\n', 'uart'), ('canbus dump --gateway abc 0\n', 'canbus dump')):
+        result = CliRunner().invoke(cli, ['--no-version-check', 'batch', '-'], input=script)
+        assert result.exit_code == 2 and f'`lager {command}` cannot run in a batch' in result.output
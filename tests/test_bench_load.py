@@ -0,0 +1,31 @@
+import itertools
+import pytest
+from lager_cli.bench.load import Target, parse_mix, render_report, run_load, schedule
+from lager_cli.bench.mockapi import MockLagerAPI
+
+def test_mix_and_schedule():
+    mix = parse_mix('uart=2,flash')
+    assert mix == {'uart': 2, 'flash': 1}
+    assert list(itertools.islice(schedule(mix, 0), 4)) == ['uart', 'uart', 'flash', 'uart']
+    assert list(itertools.islice(schedule(mix, 2), 2)) == ['flash', 'uart']
+    with pytest.raises(ValueError):
+        parse_mix('uart=0')
+
+@pytest.mark.parametrize('mode', ['trio', 'subprocess'])
+def test_load_against_mock(mode):
+    with MockLagerAPI() as api:
+        env = api.env()
+        target = Target(env['LAGER_HOST'], env['LAGER_WS_HOST'], env['LAGER_SECRET_TOKEN'], 'mock-gateway')
+        report = run_load(target, clients=3, iterations=1, mode=mode, image_size=4096)
+
+    assert report['errors'] == 0, report['error_samples']
+    assert {kind: stats['ops'] for kind, stats in report['workloads'].items()} == {'uart': 1, 'python': 1, 'flash': 1}
+    assert report['workloads']['flash']['sent_mb'] == 4096 / 2 ** 20
+    assert all(stats['received_mb'] > 0 for stats in report['workloads'].values())
+    assert [client['ops'] for client in report['per_client']] == [1, 1, 1]
+    if mode == 'subprocess':
+        assert all(client['cpu_s'] > 0 and client['peak_rss_mb'] > 0 for client in report['per_client'])
+    assert 'p99 ms' in render_report(report)
+    assert sorted(request.path.rsplit('/', 1)[-1] for request in api.requests if request.method == 'POST') == [
+        'flash-duck', 'run-python', 'uart-duck',
+    ]
@@ -0,0 +1,40 @@
+import json
+import fnmatch
+from lager_cli.bench.startup import (
+    StartupCase, run_benchmark, check_thresholds, default_cases, parse_importtime, DEFAULT_THRESHOLDS,
+)
+
+def test_parse_importtime():
+    stderr = '\n'.join([
+        'import time: self [us] | cumulative | imported package',
+        'import time:       120 |        120 |     json.decoder',
+        'import time:       300 |        420 |   json',
+        'Usage: lager [OPTIONS]',
+    ])
+    assert parse_importtime(stderr) == [('json.decoder', 120, 120, 2), ('json', 300, 420, 1)]
+
+def test_benchmark_against_mock_api():
+    cases = [StartupCase('set --help', ['set', '--help']), StartupCase('gpio input', ['gpio', 'input', '--gateway', '1', '3'])]
+    report = run_benchmark(cases, runs=1, cold_runs=0)
+    results = {result['name']: result for result in report['results']}
+    assert results['gpio input']['exit_codes'] == [0]
+    assert results['set --help']['imports']['lager_cli_cli_ms'] > 0
+    assert not any(entry['module'] == 'requests' for entry in results['set --help']['imports']['slowest'])
+
+    with open(DEFAULT_THRESHOLDS) as f:
+        assert check_thresholds(report, json.load(f)) == []
+    violations = check_thresholds(report, [{'match': 'gpio *', 'warm_ms': 0.001}])
+    assert len(violations) == 1 and violations[0].startswith('gpio input: warm_ms')
+
+def test_default_thresholds():
+    # One case per rule: the first default case each rule applies to
+    with open(DEFAULT_THRESHOLDS) as f:
+        thresholds = json.load(f)
+    cases = {}
+    for case in default_cases():
+        rule = next(rule for rule in thresholds if fnmatch.fnmatchcase(case.name, rule['match']))
+        cases.setdefault(rule['match'], case)
+    assert sorted(cases) == sorted(rule['match'] for rule in thresholds)
+
+    report = run_benchmark(list(cases.values()), runs=1, cold_runs=1)
+    assert check_thresholds(report, thresholds) == []
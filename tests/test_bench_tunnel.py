@@ -0,0 +1,34 @@
+from lager_cli.bench.rsp import PacketParser, GdbserverStub, make_packet, escape_binary
+from lager_cli.bench.tunnel import run_benchmark, memory_reads, single_steps, flash_writes
+
+def test_packet_parser_split_across_chunks():
+    parser = PacketParser()
+    packet = make_packet(b'm20000000,4')
+    assert parser.feed(b'+' + packet[:5]) == []
+    assert parser.feed(packet[5:] + make_packet(b's')) == [b'm20000000,4', b's']
+
+def test_stub_replies():
+    stub = GdbserverStub()
+    assert stub.feed(make_packet(b'm0,4')) == b'+' + make_packet(b'00010203')
+    assert stub.feed(make_packet(b'vFlashWrite:0:' + escape_binary(b'#$}*'))) == b'+' + make_packet(b'OK')
+
+async def test_loopback_benchmark():
+    def make_workloads():
+        return [
+            ('memory-read', memory_reads(1024, 8192)),
+            ('single-step', single_steps(10)),
+            ('flash-write', flash_writes(8192, 1024)),
+        ]
+    results = await run_benchmark(('cloud', 'mux', 'local'), make_workloads)
+    counts = [(result.mode, result.name, len(result.latencies)) for result in results]
+    assert counts == [
+        ('cloud', 'memory-read', 8),
+        ('cloud', 'single-step', 10),
+        ('cloud', 'flash-write', 10),
+        ('mux', 'memory-read', 8),
+        ('mux', 'single-step', 10),
+        ('mux', 'flash-write', 10),
+        ('local', 'memory-read', 8),
+        ('local', 'single-step', 10),
+        ('local', 'flash-write', 10),
+    ]
@@ -0,0 +1,81 @@
+import json
+import time
+import threading
+import http.server
+import trio
+import pytest
+from lager_cli.client import AsyncLagerClient
+from lager_cli.exceptions import GatewayNotFoundError, LagerAPIError, LagerRequestTimeout, GatewayTimeoutError
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'null')
+        gateway = self.path.split('/')[4]
+        if gateway == 'missing':
+            self._reply(404, {})
+        elif gateway == 'slow':
+            time.sleep(0.5)
+            self._reply(200, {})
+        elif gateway == 'offline':
+            self._reply(422, {'error': {'code': 'gateway_timeout_error', 'description': 'Gateway timed out'}})
+        elif gateway == 'nocan':
+            self._reply(422, {'error': {'code': 'canbus_up_failed', 'description': '{"stderr": "no can0"}'}})
+        else:
+            self._reply(200, {'gateway': gateway, 'request': request, 'auth': self.headers['Authorization']})
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def api_host():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+
+async def test_concurrent_requests_share_pool(api_host):
+    async with AsyncLagerClient({'type': 'Bearer', 'token': 'abc'}, host=api_host, max_connections=4) as client:
+        results = {}
+
+        async def toggle(gateway):
+            resp = await client.gpio_output(gateway, 3, 'HIGH')
+            results[gateway] = resp.json()
+
+        for _ in range(3):
+            async with trio.open_nursery() as nursery:
+                for i in range(8):
+                    nursery.start_soon(toggle, f'gw{i}')
+
+        assert results['gw5'] == {'gateway': 'gw5', 'request': {'gpio': 3, 'level': 'HIGH'}, 'auth': 'Bearer abc'}
+        assert client.pool.opened <= 4
+
+async def test_errors_map_to_exceptions(api_host):
+    async with AsyncLagerClient({'type': 'Bearer', 'token': 'abc'}, host=api_host) as client:
+        with pytest.raises(GatewayNotFoundError, match='missing'):
+            await client.reset_dut('missing', halt=False)
+        with pytest.raises(GatewayTimeoutError):
+            await client.reset_dut('offline', halt=False)
+        with pytest.raises(LagerAPIError) as excinfo:
+            await client.can_up('nocan', 500000, [0])
+        assert excinfo.value.code == 'canbus_up_failed'
+        assert excinfo.value.details == {'stderr': 'no can0'}
+        with pytest.raises(LagerRequestTimeout):
+            await client.request('POST', 'gateway/slow/hello', timeout=0.1)
+
+async def test_shared_endpoints(api_host):
+    async with AsyncLagerClient({'type': 'Bearer', 'token': 'abc'}, host=api_host) as client:
+        addresses = [{'start_addr': 0, 'length': 0x1000}, {'start_addr': 0x4000, 'length': 0x1000}]
+        resp = await client.erase_dut('gw0', addresses)
+        assert json.loads(await resp.aread())['request'] == addresses
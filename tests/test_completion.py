@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+import pytest
+from lager_cli.cache import write_cache
+from lager_cli.completion import build_command_tree, get_completions
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+@pytest.fixture
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv('LAGER_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setenv('LAGER_CONFIG_FILE_DIR', str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def values(tree, line):
+    *args, incomplete = line.split(' ')
+    return [value for value, _help in get_completions(tree, args, incomplete)]
+
+def test_commands_options_and_choices(cache_dir):
+    tree = build_command_tree()
+    assert values(tree, 'gp') == ['gpio']
+    assert values(tree, 'gpio ') == ['input', 'output', 'set', 'trigger']
+    assert values(tree, 'connect --device stm32f4') == ['stm32f4x']
+    assert values(tree, 'connect --interface st') == ['stlink', 'stlink-dap']
+    assert '--all' in values(tree, 'reset --')
+
+def test_complete_from_cache_without_importing_cli(cache_dir):
+    project = cache_dir / 'project'
+    project.mkdir()
+    (project / '.lager').write_text('[DEVENV]\ncmd.build = make\ncmd.bench = make bench\n')
+    env = dict(os.environ, _LAGER_COMPLETE='complete_zsh')
+
+    def complete(line):
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-m', 'lager_cli'], cwd=ROOT, check=True,
+            env=dict(env, COMP_WORDS=line, COMP_CWORD=str(len(line.split(' ')) - 1)),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+        return proc.stdout.decode().splitlines(), proc.stderr.decode()
+
+    build_command_tree()
+    write_cache('gateways.json', {'account': 'x', 'gateways': [{'id': 7, 'name': 'bench-1'}]})
+
+    lines, imports = complete('lager reset --gateway ben')
+    assert lines == ['bench-1', '7']
+    imported = {line.split('|')[-1].strip() for line in imports.splitlines()}
+    assert not {'click', 'lager_cli.cli', 'requests'} & imported
+
+    proc = subprocess.run(
+        [sys.executable, '-m', 'lager_cli'], cwd=project, check=True, stdout=subprocess.PIPE,
+        env=dict(env, PYTHONPATH=ROOT, _LAGER_COMPLETE='complete', COMP_WORDS='lager exec b', COMP_CWORD='2'),
+    )
+    assert proc.stdout.decode().splitlines() == ['bench', 'build']
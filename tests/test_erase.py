@@ -0,0 +1,51 @@
+from lager_cli.bench.mockapi import MockLagerAPI, Reply
+from test_flash_images import make_elf, make_hex
+
+def erase_requests(api):
+    return [request.json() for request in api.requests if request.path.endswith('erase-duck')]
+
+def test_erase_for_image(lager, tmp_path):
+    app = tmp_path / 'app.hex'
+    app.write_bytes(make_hex(0x08004000, b'\x01' * 0x5000))
+    boot = tmp_path / 'boot.elf'
+    boot.write_bytes(make_elf([(0x08000000, b'\x02' * 100)]))
+    data = tmp_path / 'data.bin'
+    data.write_bytes(b'\x03' * 10)
+
+    with MockLagerAPI() as api:
+        proc = lager(api, 'erase', '--gateway', '1', '--device', 'stm32f4x', '--for-image', str(app),
+                     '--for-image', str(boot), '--for-image', f'{data},0x08060000')
+        assert proc.returncode == 0, proc.stderr
+        assert erase_requests(api) == [[
+            {'start_addr': 0x08000000, 'length': 0x4000 * 3},
+            {'start_addr': 0x08060000, 'length': 0x20000},
+        ]]
+
+        assert lager(api, 'erase', '--gateway', '1', '0x08000000', '0x1000').returncode == 0
+        assert erase_requests(api)[-1] == {'start_addr': 0x08000000, 'length': 0x1000}
+
+        proc = lager(api, 'erase', '--gateway', '1', '--for-image', str(app))
+        assert proc.returncode == 1 and b'--for-image needs the target device type' in proc.stderr
+
+def test_erase_falls_back_to_one_range_per_request(lager, tmp_path):
+    boot = tmp_path / 'boot.hex'
+    boot.write_bytes(make_hex(0x08000000, b'\x01' * 0x100))
+    data = tmp_path / 'data.hex'
+    data.write_bytes(make_hex(0x08060000, b'\x02' * 0x100))
+
+    with MockLagerAPI() as api:
+        erase = api.routes[('POST', 'erase-duck')]
+        def single_range_only(mock, gateway, request):
+            if isinstance(request.json(), list):
+                return Reply({'error': 'addresses must be an object'}, status=400)
+            return erase(mock, gateway, request)
+        api.routes[('POST', 'erase-duck')] = single_range_only
+
+        proc = lager(api, 'erase', '--gateway', '1', '--device', 'stm32f4x', '--for-image', str(boot),
+                     '--for-image', str(data))
+        assert proc.returncode == 0, proc.stderr
+        assert erase_requests(api) == [
+            [{'start_addr': 0x08000000, 'length': 0x4000}, {'start_addr': 0x08060000, 'length': 0x20000}],
+            {'start_addr': 0x08000000, 'length': 0x4000},
+            {'start_addr': 0x08060000, 'length': 0x20000},
+        ]
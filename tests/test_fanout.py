@@ -0,0 +1,55 @@
+import json
+import threading
+import http.server
+import pytest
+from click.testing import CliRunner
+from lager_cli.cli import cli
+
+GATEWAYS = [{'name': 'rack-a1', 'id': 11}, {'name': 'rack-a2', 'id': 12}, {'name': 'bench', 'id': 13}]
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply(200, json.dumps({'gateways': GATEWAYS}).encode())
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        gateway = self.path.split('/')[4]
+        if gateway == 'missing':
+            self._reply(404, b'{}')
+        else:
+            self._reply(200, f'reset {gateway}\n'.encode())
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def api(monkeypatch, tmp_path):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv('LAGER_HOST', f'http://127.0.0.1:{server.server_address[1]}')
+    monkeypatch.setenv('LAGER_SECRET_TOKEN', 'secret')
+    monkeypatch.setenv('LAGER_CONFIG_FILE_DIR', str(tmp_path))
+    yield
+    server.shutdown()
+
+def test_single_gateway_output_unchanged(api):
+    result = CliRunner().invoke(cli, ['--no-version-check', 'reset', '--gateway', 'bench'])
+    assert (result.exit_code, result.output) == (0, 'reset 13\n')
+
+def test_glob_and_explicit_gateways(api):
+    args = ['--no-version-check', 'reset', '--gateway', 'rack-*', '--gateway', 'missing', '--jobs', '2']
+    result = CliRunner(mix_stderr=False).invoke(cli, args)
+    assert result.exit_code == 1
+    assert '[rack-a1] reset 11\n' in result.stdout
+    assert '[rack-a2] reset 12\n' in result.stdout
+    assert "[missing] You don't have a gateway with id `missing`" in result.stderr
+    rows = [line.split()[:2] for line in result.stdout.splitlines() if line.startswith(('rack', 'missing'))]
+    assert rows == [['rack-a1', '0'], ['rack-a2', '0'], ['missing', '1']]
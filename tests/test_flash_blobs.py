@@ -0,0 +1,111 @@
+import hashlib
+import os
+from lager_cli.bench.mockapi import MockLagerAPI, Reply
+from lager_cli.flash.blobs import file_digest
+
+def posted(api):
+    return [request for request in api.requests if request.method == 'POST']
+
+def test_upload_skipped_when_gateway_has_image(lager, tmp_path):
+    image = tmp_path / 'app.bin'
+    image.write_bytes(os.urandom(50_000))
+    digest = hashlib.sha256(image.read_bytes()).hexdigest()
+    args = ('flash', '--gateway', '1', '--binfile', f'{image},0x8000000', '--binfile', f'{image},0x8100000')
+
+    with MockLagerAPI() as api:
+        assert lager(api, *args).returncode == 0
+        assert [request.path.split('/api/v1/gateway/1/')[1] for request in posted(api)] == [
+            'blobs/query', f'blobs?sha256={digest}', 'flash-duck',
+        ]
+        assert api.blobs['1'] == {digest: image.read_bytes()}
+        assert ('binfile_sha256', digest.encode()) in posted(api)[-1].form()
+
+        del api.requests[:]
+        proc = lager(api, '--debug', *args)
+        assert proc.returncode == 0
+        assert b'uploaded 0 bytes, skipped 50,000 bytes' in proc.stderr
+        assert [len(request.body) < 2000 for request in posted(api)] == [True, True]
+
+        del api.requests[:]
+        assert lager(api, *args, '--always-upload').returncode == 0
+        assert [len(request.body) > 100_000 for request in posted(api)] == [True]
+
+def test_fallback_without_blob_support(lager, tmp_path):
+    image = tmp_path / 'app.hex'
+    image.write_bytes(b':00000001FF\n')
+    with MockLagerAPI() as api:
+        del api.routes[('POST', 'blobs/query')]
+        assert lager(api, 'flash', '--gateway', '1', '--hexfile', str(image), '--no-convert').returncode == 0
+        assert ('hexfile', b':00000001FF\n') in posted(api)[-1].form()
+
+def test_digest_cache(monkeypatch, tmp_path):
+    monkeypatch.setenv('LAGER_CACHE_DIR', str(tmp_path / 'cache'))
+    image = tmp_path / 'image.bin'
+    image.write_bytes(b'one')
+    assert file_digest(str(image)) == hashlib.sha256(b'one').hexdigest()
+    monkeypatch.setattr('lager_cli.flash.blobs._hash_file', lambda path: 'cached')
+    assert file_digest(str(image)) == hashlib.sha256(b'one').hexdigest()
+    image.write_bytes(b'three')
+    assert file_digest(str(image)) == 'cached'
+
+def test_pipelined_flash_one_request_per_image(lager, tmp_path):
+    images = []
+    for name, size in (('boot.bin', 4096), ('app.bin', 50_000), ('data.bin', 1000)):
+        (tmp_path / name).write_bytes(os.urandom(size))
+        images.append(tmp_path / name)
+    args = ['flash', '--gateway', '1', '--pipeline']
+    for image, address in zip(images, ('0x8000000', '0x8004000', '0x8080000')):
+        args += ['--binfile', f'{image},{address}']
+
+    with MockLagerAPI() as api:
+        proc = lager(api, *args)
+        assert proc.returncode == 0, proc.stderr
+        flashes = [request.form() for request in posted(api) if request.path.endswith('flash-duck')]
+        assert [form[:2] for form in flashes] == [
+            [('binfile_sha256', file_digest(str(image)).encode()), ('binfile_address', str(address).encode())]
+            for image, address in zip(images, (0x8000000, 0x8004000, 0x8080000))
+        ]
+        assert set(api.blobs['1']) == {file_digest(str(image)) for image in images}
+        assert b'[3/3] Flashing data.bin @ 0x08080000' in proc.stderr
+        assert b'50,000 bytes  transfer' in proc.stderr
+        assert b'Flashed 3 images in' in proc.stderr
+
+        del api.routes[('POST', 'blobs/query')]
+        del api.requests[:]
+        assert lager(api, *args).returncode == 0
+        assert len([request for request in posted(api) if request.path.endswith('flash-duck')]) == 1
+
+def test_unsupported_gateway_remembered(lager, tmp_path):
+    image = tmp_path / 'app.bin'
+    image.write_bytes(os.urandom(1000))
+    args = ('flash', '--gateway', '1', '--binfile', f'{image},0x8000000')
+    with MockLagerAPI() as api:
+        api.routes[('POST', 'blobs/query')] = lambda mock, gateway, request: Reply(
+            {'error': {'code': 'gateway_timeout_error', 'description': 'Gateway timed out'}}, status=422)
+        assert lager(api, *args).returncode == 0
+        api.routes[('POST', 'blobs/query')] = lambda mock, gateway, request: Reply({}, status=404)
+        assert lager(api, *args).returncode == 0
+        assert lager(api, *args).returncode == 0
+        assert [request.path.rsplit('/', 1)[-1] for request in posted(api)] == [
+            'query', 'flash-duck', 'query', 'flash-duck', 'flash-duck',
+        ]
+
+def test_evicted_blob_uploaded_with_flash(lager, tmp_path):
+    image = tmp_path / 'app.bin'
+    image.write_bytes(os.urandom(1000))
+    with MockLagerAPI() as api:
+        api.routes[('POST', 'blobs/query')] = lambda mock, gateway, request: Reply(
+            {'present': request.json()['sha256']})
+        proc = lager(api, 'flash', '--gateway', '1', '--binfile', f'{image},0x8000000')
+        assert proc.returncode == 0, proc.stderr
+        assert b'uploading the images with the flash request' in proc.stderr
+        flashes = [request.form() for request in posted(api) if request.path.endswith('flash-duck')]
+        assert len(flashes) == 2
+        assert ('binfile', image.read_bytes()) in flashes[1]
+
+        del api.requests[:]
+        proc = lager(api, 'flash', '--gateway', '1', '--pipeline', '--binfile', f'{image},0x8000000')
+        assert proc.returncode == 0, proc.stderr
+        assert [request.path.split('/api/v1/gateway/1/')[1].split('?')[0] for request in posted(api)] == [
+            'blobs/query', 'flash-duck', 'blobs', 'flash-duck',
+        ]
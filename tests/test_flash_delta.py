@@ -0,0 +1,73 @@
+import os
+from lager_cli.bench.mockapi import MockLagerAPI
+from lager_cli.flash.sectors import join_shared_sectors, merge_ranges, sectors, touched_sectors
+
+def test_sector_maps():
+    layout = sectors('stm32f4x')
+    assert layout[:5] == [(0x08000000, 0x4000), (0x08004000, 0x4000), (0x08008000, 0x4000), (0x0800C000, 0x4000),
+                          (0x08010000, 0x10000)]
+    assert layout[12] == (0x08100000, 0x4000)
+    assert touched_sectors('stm32f4x', [(0x08003FFF, b'ab')]) == [(0x08000000, 0x4000), (0x08004000, 0x4000)]
+    assert merge_ranges([(0x800, 0x800), (0, 0x800), (0x2000, 0x800)]) == [(0, 0x1000), (0x2000, 0x800)]
+
+def test_join_shared_sectors():
+    segments = [(0x08000000, b'code'), (0x08003FF0, b'cfg'), (0x08004000, b'next'), (0x08100000, b'bank2')]
+    assert join_shared_sectors(segments, 'stm32f4x') == [
+        (0x08000000, b'code' + b'\xff' * (0x3FF0 - 4) + b'cfg'), (0x08004000, b'next'), (0x08100000, b'bank2'),
+    ]
+    # Without a sector map, anything closer than the largest sector of any device is joined
+    assert [address for address, _data in join_shared_sectors(segments)] == [0x08000000, 0x08100000]
+
+def test_delta_flash_programs_changed_sectors_only(lager, tmp_path):
+    image = tmp_path / 'app.bin'
+    data = bytearray(os.urandom(3 * 2048 - 100))
+    image.write_bytes(data)
+    args = ('flash', '--gateway', '1', '--binfile', f'{image},0x08000000', '--delta', '--device', 'stm32f0x')
+
+    def actions(api):
+        return [request.path.rsplit('/', 1)[-1] for request in api.requests if request.method == 'POST']
+
+    with MockLagerAPI() as api:
+        proc = lager(api, *args)
+        assert proc.returncode == 0, proc.stderr
+        assert b'3 of 3 sectors changed (6,144 of 6,144 bytes)' in proc.stderr
+        erase = [request.json() for request in api.requests if request.path.endswith('erase-duck')]
+        assert erase == [{'start_addr': 0x08000000, 'length': 6144}]
+
+        data[2048 + 10] ^= 0xFF
+        image.write_bytes(data)
+        del api.requests[:]
+        proc = lager(api, *args)
+        assert b'1 of 3 sectors changed (2,048 of 6,144 bytes)' in proc.stderr
+        assert [request.json() for request in api.requests if request.path.endswith('erase-duck')] == [
+            {'start_addr': 0x08000800, 'length': 2048},
+        ]
+        # The changed sector, then the whole image for the gateway to check against the DUT
+        blobs = [request.body for request in api.requests if '/blobs?' in request.path]
+        assert blobs == [bytes(data[2048:4096]), bytes(data)]
+        program, check = [request.form() for request in api.requests if request.path.endswith('flash-duck')]
+        assert ('binfile_address', b'134219776') in program and ('preverify', b'False') in program
+        assert ('binfile_address', b'134217728') in check and ('preverify', b'True') in check
+
+        del api.requests[:]
+        proc = lager(api, *args)
+        assert b'0 of 3 sectors changed' in proc.stderr
+        assert actions(api) == ['query', 'flash-duck']
+
+        assert lager(api, 'flash', '--gateway', '1', '--binfile', f'{image},0x08000000').returncode == 0
+        del api.requests[:]
+        proc = lager(api, *args)
+        assert b'3 of 3 sectors changed' in proc.stderr
+
+def test_debugger_and_python_forget_delta_state(lager, tmp_path):
+    image = tmp_path / 'app.bin'
+    image.write_bytes(os.urandom(2048))
+    args = ('flash', '--gateway', '1', '--binfile', f'{image},0x08000000', '--delta', '--device', 'stm32f0x')
+    script = tmp_path / 'script.py'
+    script.write_text('print(1)')
+
+    with MockLagerAPI() as api:
+        assert lager(api, *args).returncode == 0
+        assert b'0 of 1 sectors changed' in lager(api, *args).stderr
+        assert lager(api, 'python', '--gateway', '1', str(script)).returncode == 0
+        assert b'1 of 1 sectors changed' in lager(api, *args).stderr
@@ -0,0 +1,80 @@
+import struct
+import pytest
+from lager_cli.bench.mockapi import MockLagerAPI
+from lager_cli.flash.images import ImageFormatError, Segment, parse_elf, parse_hex
+
+def record(record_type, address, payload):
+    body = bytes([len(payload), address >> 8, address & 0xFF, record_type]) + payload
+    return ':' + (body + bytes([-sum(body) & 0xFF])).hex().upper()
+
+def make_hex(base, data, width=16):
+    lines = []
+    upper = None
+    for offset in range(0, len(data), width):
+        address = base + offset
+        if address >> 16 != upper:
+            upper = address >> 16
+            lines.append(record(0x04, 0, upper.to_bytes(2, 'big')))
+        lines.append(record(0x00, address & 0xFFFF, data[offset:offset + width]))
+    lines.append(record(0x01, 0, b''))
+    return ('\n'.join(lines) + '\n').encode()
+
+def make_elf(segments):
+    phoff = 52
+    data_offset = phoff + 32 * len(segments)
+    headers = b''
+    payload = b''
+    for paddr, data in segments:
+        headers += struct.pack('<IIIIIIII', 1, data_offset + len(payload), paddr + 0x20000000, paddr,
+                               len(data), len(data), 5, 4)
+        payload += data
+    ident = b'\x7fELF' + bytes([1, 1, 1]) + bytes(9)
+    header = ident + struct.pack('<HHIIIIIHHHHHH', 2, 40, 1, 0, phoff, 0, 0, 52, 32, len(segments), 0, 0, 0)
+    return header + headers + payload
+
+def test_parse_hex_merges_records():
+    data = bytes(range(256)) * 4
+    text = make_hex(0x08000000, data[:512]).replace(b':00000001FF\n', b'') + make_hex(0x08000200, data[512:])
+    assert parse_hex(text) == [Segment(0x08000000, data)]
+
+    corrupted = make_hex(0x08000000, data).replace(b':10000000', b':10000001', 1)
+    with pytest.raises(ImageFormatError, match='line 2: checksum mismatch'):
+        parse_hex(corrupted)
+    with pytest.raises(ImageFormatError, match='end-of-file'):
+        parse_hex(make_hex(0x08000000, b'ab').replace(b':00000001FF\n', b''))
+
+def test_parse_elf_load_segments():
+    elf = make_elf([(0x08000000, b'\x01' * 16), (0x08000010, b'\x02' * 8), (0x08004000, b'\x03' * 4)])
+    assert parse_elf(elf) == [
+        Segment(0x08000000, b'\x01' * 16 + b'\x02' * 8),
+        Segment(0x08004000, b'\x03' * 4),
+    ]
+
+def test_flash_uploads_hex_as_binary(lager, tmp_path):
+    image = tmp_path / 'app.hex'
+    image.write_bytes(make_hex(0x08000000, bytes(range(256)) * 64))
+    elf = tmp_path / 'boot.elf'
+    elf.write_bytes(make_elf([(0x0800F000, b'boot')]))
+    with MockLagerAPI() as api:
+        proc = lager(api, 'flash', '--gateway', '1', '--hexfile', str(image), '--elffile', str(elf), '--always-upload')
+        assert proc.returncode == 0, proc.stderr
+        form = [(name, len(value)) for name, value in api.requests[-1].form()]
+        assert form[:4] == [('binfile', 16384), ('binfile', 4), ('binfile_address', 9), ('binfile_address', 9)]
+        assert api.requests[-1].form()[2:4] == [('binfile_address', b'134217728'), ('binfile_address', b'134279168')]
+
+        image.write_bytes(image.read_bytes().replace(b':10000000', b':10000001', 1))
+        proc = lager(api, 'flash', '--gateway', '1', '--hexfile', str(image))
+        assert proc.returncode == 1
+        assert b'app.hex: line 2: checksum mismatch' in proc.stderr
+
+def test_segments_sharing_a_sector_flashed_together(lager, tmp_path):
+    image = tmp_path / 'app.hex'
+    # Code and config words in the same 16 KiB sector, with a gap between them
+    image.write_bytes(make_hex(0x08000000, b'\x01' * 32)[:-12] + make_hex(0x08003FF0, b'\x02' * 16))
+    with MockLagerAPI() as api:
+        proc = lager(api, 'flash', '--gateway', '1', '--hexfile', str(image), '--device', 'stm32f4x',
+                     '--always-upload')
+        assert proc.returncode == 0, proc.stderr
+        form = api.requests[-1].form()
+        assert [name for name, _value in form][:2] == ['binfile', 'binfile_address']
+        assert form[0][1] == b'\x01' * 32 + b'\xff' * (0x3FF0 - 32) + b'\x02' * 16
@@ -0,0 +1,54 @@
+import pytest
+import trio
+from lager_cli.gdbserver.forward import AdaptiveReceiveSize, BoundedBuffer, forward
+
+def test_adaptive_receive_size():
+    size = AdaptiveReceiveSize(minimum=4, maximum=16)
+    size.observe(4)
+    size.observe(8)
+    size.observe(16)
+    assert size.size == 16
+    size.observe(1)
+    assert size.size == 8
+
+async def test_full_buffer_blocks_producer():
+    buffer = BoundedBuffer(capacity=8)
+    await buffer.put(b'12345678')
+    with trio.move_on_after(0.1) as scope:
+        await buffer.put(b'9')
+    assert scope.cancelled_caught
+    assert await buffer.get() == b'12345678'
+
+async def test_forward_preserves_order():
+    chunks = [bytes([i]) * 100 for i in range(50)]
+    source = iter(chunks)
+    received = []
+
+    async def receive():
+        return next(source, b'')
+
+    async def send(data):
+        await trio.sleep(0)
+        received.append(data)
+
+    await forward(receive, send, buffer_size=512)
+    assert b''.join(received) == b''.join(chunks)
+
+async def test_forward_drains_before_peer_error():
+    chunks = [b'$qSupported#37', b'$OK#9a']
+    source = iter(chunks)
+    received = []
+
+    async def receive():
+        data = next(source, None)
+        if data is None:
+            raise trio.BrokenResourceError
+        return data
+
+    async def send(data):
+        await trio.sleep(0.01)
+        received.append(data)
+
+    with pytest.raises(trio.BrokenResourceError):
+        await forward(receive, send)
+    assert b''.join(received) == b''.join(chunks)
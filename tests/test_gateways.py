@@ -0,0 +1,76 @@
+import json
+import threading
+import http.server
+import pytest
+from click.testing import CliRunner
+from lager_cli.cli import cli
+
+GATEWAYS = [{'name': 'rack-a1', 'id': 11}, {'name': 'bench', 'id': 13}]
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests = []
+
+    def _reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.requests.append(('GET', self.path))
+        self._reply(200, json.dumps({'gateways': GATEWAYS}).encode())
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.requests.append(('POST', self.path))
+        self._reply(200, f'reset {self.path.split("/")[4]}\n'.encode())
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def api(monkeypatch, tmp_path):
+    Handler.requests = []
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv('LAGER_HOST', f'http://127.0.0.1:{server.server_address[1]}')
+    monkeypatch.setenv('LAGER_SECRET_TOKEN', 'secret')
+    monkeypatch.setenv('LAGER_CONFIG_FILE_DIR', str(tmp_path))
+    monkeypatch.setenv('LAGER_CACHE_DIR', str(tmp_path / 'cache'))
+    yield Handler.requests
+    server.shutdown()
+
+def lager(*args):
+    return CliRunner(mix_stderr=False).invoke(cli, ['--no-version-check', *args])
+
+def test_names_resolve_from_cache(api):
+    assert lager('reset', '--gateway', 'bench').stdout == 'reset 13\n'
+    assert lager('reset', '--gateway', 'rack-a1').stdout == 'reset 11\n'
+    assert api == [('GET', '/api/v1/gateway/list'), ('POST', '/api/v1/gateway/13/reset-duck'),
+                   ('POST', '/api/v1/gateway/11/reset-duck')]
+
+def test_unknown_gateway_refreshes_once_then_asks_api(api):
+    lager('list', 'gateways')
+    assert lager('reset', '--gateway', 'shared-rig').stdout == 'reset shared-rig\n'
+    assert [method for method, _path in api] == ['GET', 'GET', 'POST']
+
+def test_refresh_and_invalidation(api):
+    assert 'bench' in lager('list', 'gateways').stdout
+    lager('list', 'gateways')
+    lager('list', 'gateways', '--refresh')
+    lager('logout')
+    lager('list', 'gateways')
+    assert len(api) == 3
+
+def test_ids_and_defaults_skip_validation(api, monkeypatch):
+    assert lager('reset', '--gateway', '99').stdout == 'reset 99\n'
+    assert api == [('POST', '/api/v1/gateway/99/reset-duck')]
+
+    monkeypatch.setenv('LAGER_GATEWAY', 'shared-rig')
+    assert lager('reset').stdout == 'reset shared-rig\n'
+    assert [method for method, _path in api] == ['POST', 'GET', 'GET', 'POST']
+
+def test_bad_cache_ttl_falls_back(api, monkeypatch):
+    monkeypatch.setenv('LAGER_GATEWAY_CACHE_TTL', 'ten minutes')
+    assert lager('reset', '--gateway', 'bench').stdout == 'reset 13\n'
@@ -0,0 +1,61 @@
+import json
+import sys
+import subprocess
+import sqlite3
+from lager_cli.bench.mockapi import MockLagerAPI, unity_output
+from lager_cli.history.commands import load_runs, percentile, trends
+from lager_cli.history.store import RunRecord, connect, write_runs
+
+def test_percentile():
+    assert percentile([3, 1, 2, 4], 0.5) == 2.5
+    assert percentile([5], 0.99) == 5
+    assert percentile(range(101), 0.9) == 90
+
+def test_regression_flagged(tmp_path):
+    connection = connect(str(tmp_path / 'history.sqlite3'))
+    records = []
+    for i in range(10):
+        record = RunRecord('flash', gateway=1, image_hash='ab' * 32)
+        record.started_at = 1000 + i
+        record.finish(0)
+        record.duration = 10.0 if i < 5 else 14.0
+        record.phases = {'upload': 1.0, 'program': record.duration - 1.0}
+        records.append(record)
+    write_runs(connection, records)
+
+    rows = {row['metric']: row for row in trends(load_runs(connection, gateway='1'), False, 5, 0.2, 500)}
+    assert set(rows) == {'total', 'phase:upload', 'phase:program'}
+    assert rows['total']['regressed'] and round(rows['total']['change'], 2) == 0.4
+    assert rows['phase:program']['regressed']
+    assert not rows['phase:upload']['regressed']
+    assert load_runs(connection, command='python') == []
+
+def test_runs_recorded(lager, tmp_path):
+    image = tmp_path / 'app.bin'
+    image.write_bytes(b'\x01' * 4096)
+    with MockLagerAPI(job_output_factory=lambda: unity_output(passed=2, failed=1)) as api:
+        assert lager(api, 'flash', '--gateway', '1', '--binfile', f'{image},0x08000000').returncode == 0
+        assert lager(api, 'testrun', '--gateway', '1', '--serial-port', '/dev/ttyACM0',
+                     '--binfile', f'{image},0x08000000').returncode == 1
+        proc = lager(api, 'history', '--tests', '--json-output')
+        assert proc.returncode == 0, proc.stderr
+
+    connection = sqlite3.connect(str(tmp_path / 'cache' / 'history.sqlite3'))
+    runs = connection.execute('SELECT command, gateway, image_hash, exit_code, bytes_sent, bytes_received FROM runs').fetchall()
+    assert [run[:2] + run[3:4] for run in runs] == [('flash', '1', 0), ('testrun', '1', 1)]
+    assert runs[0][2] == runs[1][2] and len(runs[0][2]) == 64
+    # The testrun reuses the blob the flash uploaded
+    assert runs[0][4] >= 4096 and 0 < runs[1][4] < 4096
+    assert all(run[5] > 0 for run in runs)
+    phases = {name for (name,) in connection.execute('SELECT name FROM phases WHERE run_id = 2')}
+    assert phases == {'halt', 'uart', 'upload', 'flash', 'reset', 'output'}
+    tests = connection.execute('SELECT name, result FROM tests ORDER BY rowid').fetchall()
+    assert tests == [('test_case_0', 'PASS'), ('test_case_1', 'PASS'), ('test_case_2', 'FAIL')]
+
+    metrics = {(row['command'], row['metric']) for row in json.loads(proc.stdout)['trends']}
+    assert ('flash', 'phase:program') in metrics
+    assert ('testrun', 'test:test_case_2') in metrics
+
+def test_cli_import_skips_sqlite3():
+    code = "import sys, lager_cli.cli; sys.exit('sqlite3' in sys.modules)"
+    assert subprocess.run([sys.executable, '-c', code], check=False).returncode == 0
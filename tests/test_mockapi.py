@@ -0,0 +1,40 @@
+import time
+import requests
+import lager_trio_websocket as trio_websocket
+from lager_cli.bench.mockapi import MockLagerAPI, python_output, unity_output, random_bytes, text_lines
+from lager_cli.bench.rsp import make_packet
+
+def test_python_and_job_output(lager, tmp_path):
+    script = tmp_path / 'script.py'
+    script.write_text('print("hi")\n')
+
+    def output():
+        return python_output(stdout=[b'hello\n'], stderr=[b'oops\n'], exit_code=3)
+
+    with MockLagerAPI(python_output_factory=output, job_output_factory=lambda: unity_output(2, 1)) as api:
+        proc = lager(api, 'python', '--gateway', 'mock-gateway', str(script))
+        assert (proc.returncode, proc.stdout, proc.stderr) == (3, b'hello\n', b'oops\n')
+
+        proc = lager(api, 'uart', '--gateway', '1', '--serial-device', '/dev/ttyACM0', '--test-runner', 'unity')
+        assert b'test_case_2:FAIL' in proc.stdout
+        assert b'3 Tests 1 Failures 0 Ignored' in proc.stdout
+        assert [request.path.rsplit('/', 1)[-1] for request in api.requests if request.method == 'POST'] == [
+            'run-python', 'uart-duck',
+        ]
+
+def test_latency_and_bandwidth():
+    with MockLagerAPI(latency=0.05, bandwidth=1_000_000, flash_output_factory=lambda: random_bytes(200_000)) as api:
+        started = time.monotonic()
+        assert requests.get(f'{api.url}/api/v1/gateway/list').json()['gateways'][0]['name'] == 'mock-gateway'
+        assert time.monotonic() - started >= 0.05
+
+        started = time.monotonic()
+        resp = requests.post(f'{api.url}/api/v1/gateway/1/flash-duck', data=text_lines(100))
+        assert len(resp.content) == 200_000
+        assert time.monotonic() - started >= 0.2
+        assert len(api.requests[-1].body) == 6400
+
+async def test_gdb_tunnel_websocket(mock_api):
+    async with trio_websocket.open_websocket_url(f'{mock_api.ws_url}/ws/gateway/1/gdb-tunnel/3333') as websocket:
+        await websocket.send_message(make_packet(b'm0,4'))
+        assert await websocket.get_message() == b'+' + make_packet(b'00010203')
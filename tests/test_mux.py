@@ -0,0 +1,82 @@
+import socket
+import time
+import trio
+import lager_trio_websocket
+from lager_cli.bench.mockapi import MockLagerAPI, Reply
+from lager_cli.bench.rsp import make_packet
+from lager_cli.gdbserver.mux import MuxConnection
+
+async def test_busy_stream_does_not_starve_others(make_server):
+    stalled = trio.Event()
+
+    async def accept_handler(stream, remote_port):
+        if remote_port == 1:
+            # Never read: the peer must run out of credit rather than block the connection
+            await stalled.wait()
+        else:
+            async for data in stream:
+                await stream.send_all(data)
+
+    async def handler(request):
+        websocket = await request.accept()
+        await MuxConnection(websocket, accept_handler=accept_handler, window=4096).run()
+
+    async with make_server(handler) as url:
+        async with lager_trio_websocket.open_websocket_url(url) as websocket:
+            mux = MuxConnection(websocket, window=4096)
+            async with trio.open_nursery() as nursery:
+                await nursery.start(mux.run)
+                busy = await mux.open_stream(1)
+                echo = await mux.open_stream(2)
+                with trio.move_on_after(0.2):
+                    await busy.send_all(b'x' * 65536)
+                with trio.fail_after(2):
+                    await echo.send_all(b'ping')
+                    assert await echo.receive_some() == b'ping'
+                stalled.set()
+                nursery.cancel_scope.cancel()
+
+async def test_receive_after_eof(make_server):
+    async def accept_handler(stream, remote_port):
+        await stream.send_eof()
+
+    async def handler(request):
+        websocket = await request.accept()
+        await MuxConnection(websocket, accept_handler=accept_handler).run()
+
+    async with make_server(handler) as url:
+        async with lager_trio_websocket.open_websocket_url(url) as websocket:
+            mux = MuxConnection(websocket)
+            async with trio.open_nursery() as nursery:
+                await nursery.start(mux.run)
+                stream = await mux.open_stream(1)
+                with trio.fail_after(2):
+                    assert await stream.receive_some() == b''
+                    assert await stream.receive_some() == b''
+                nursery.cancel_scope.cancel()
+
+def test_tunnel_multiplex(lager_background):
+    with socket.socket() as probe:
+        probe.bind(('localhost', 0))
+        port = probe.getsockname()[1]
+
+    with MockLagerAPI() as api:
+        api.routes[('GET', 'status')] = lambda mock, gateway, request: Reply(
+            {'running': True, 'cmdline': 'openocd', 'logfile': ''})
+        proc = lager_background(api, 'tunnel', '--gateway', '1', '--multiplex', '--gdb-port', str(port))
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                client = socket.create_connection(('localhost', port), timeout=5)
+                break
+            except ConnectionRefusedError:
+                assert proc.poll() is None, proc.communicate()
+                assert time.monotonic() < deadline
+                time.sleep(0.05)
+        with client:
+            for payload in (b'm0,4', b'm20000000,4'):
+                client.sendall(make_packet(payload))
+                reply = b''
+                while reply.count(b'#') == 0 or len(reply) < reply.index(b'#') + 3:
+                    reply += client.recv(4096)
+                assert reply.startswith(b'+$')
@@ -0,0 +1,70 @@
+import os
+import socket
+import ssl
+import threading
+import certifi
+import pytest
+from lager_cli.context import ResumingSSLContext, _build_ssl_context, get_ca_path_ssl_context, get_ssl_context
+from lager_cli.session import SharedSSLContextAdapter
+
+CERT = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'certs', 'localhost.pem')
+
+@pytest.fixture
+def tls_server():
+    server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server_context.load_cert_chain(CERT)
+    listener = socket.create_server(('localhost', 0))
+    stop = threading.Event()
+
+    def serve():
+        while not stop.is_set():
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            with server_context.wrap_socket(conn, server_side=True) as tls:
+                tls.sendall(b'hello')
+                tls.recv(1)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    yield listener.getsockname()[1]
+    stop.set()
+    listener.close()
+
+def test_session_resumed_across_connections(tls_server):
+    context = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.load_verify_locations(cafile=CERT)
+    for _ in range(2):
+        with socket.create_connection(('localhost', tls_server)) as sock:
+            with context.wrap_socket(sock, server_hostname='localhost') as tls:
+                assert tls.recv(5) == b'hello'
+    assert context.session_report() == [('localhost', False), ('localhost', True)]
+    assert all(isinstance(session, ssl.SSLSession) for session in context._sessions.values())
+
+def test_cafile_and_default_paths(monkeypatch):
+    _build_ssl_context.cache_clear()
+    monkeypatch.setenv('LAGER_CAFILE_PATH', CERT)
+    context = get_ssl_context()
+    assert isinstance(context, ResumingSSLContext) and context is get_ssl_context()
+    assert context.verify_mode == ssl.CERT_REQUIRED and context.check_hostname
+    certifi_only = ssl.create_default_context(cafile=certifi.where())
+    assert context.cert_store_stats()['x509_ca'] == certifi_only.cert_store_stats()['x509_ca'] + 1
+
+    monkeypatch.delenv('LAGER_CAFILE_PATH')
+    default = get_ssl_context()
+    assert default is not context and default.verify_mode == ssl.CERT_REQUIRED
+    assert default.cert_store_stats()['x509_ca'] > 1
+    _build_ssl_context.cache_clear()
+
+def test_ca_bundle_leaves_shared_context_alone():
+    shared = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    adapter = SharedSSLContextAdapter(shared)
+    pool = adapter.poolmanager.connection_from_url('https://localhost:1')
+
+    adapter.cert_verify(pool, 'https://localhost:1/', CERT, None)
+    assert pool.ca_certs is None and pool.conn_kw['ssl_context'] is get_ca_path_ssl_context(CERT)
+    assert shared.cert_store_stats()['x509_ca'] == 0
+
+    adapter.cert_verify(pool, 'https://localhost:1/', True, None)
+    assert pool.conn_kw['ssl_context'] is shared
@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# Generous enough for slow CI machines, tight enough to catch an eager import
+# of trio, requests or one of the websocket stacks at startup.
+IMPORT_BUDGET_US = 250_000
+
+HEAVY_MODULES = {
+    'trio',
+    'lager_trio_websocket',
+    'wsproto',
+    'bson',
+    'yaml',
+    'tenacity',
+    'texttable',
+    'requests_toolbelt',
+}
+
+def import_times(*args):
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-m', 'lager_cli', *args],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True,
+    )
+    times = {}
+    for line in proc.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _self, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+@pytest.mark.parametrize('args, extra_heavy', [
+    (('set', 'default', 'gateway', '--help'), {'requests'}),
+    (('gpio', 'output', '--help'), set()),
+])
+def test_subcommand_help_skips_heavy_imports(args, extra_heavy):
+    times = import_times(*args)
+    assert not (HEAVY_MODULES | extra_heavy) & times.keys()
+    assert times['lager_cli.cli'] < IMPORT_BUDGET_US
@@ -0,0 +1,45 @@
+import json
+from lager_cli.bench.mockapi import MockLagerAPI, unity_output
+
+def actions(api):
+    return [request.path.rsplit('/', 1)[-1] for request in api.requests if request.method == 'POST']
+
+def test_testrun_pipeline(lager, tmp_path):
+    image = tmp_path / 'app.bin'
+    image.write_bytes(b'\x01' * 4096)
+
+    with MockLagerAPI(job_output_factory=lambda: unity_output(passed=2, failed=1)) as api:
+        proc = lager(api, '--debug', 'testrun', '--gateway', '1', '--serial-port', '/dev/ttyACM0',
+                     '--binfile', f'{image},0x08000000', '--pipeline')
+        assert proc.returncode == 1, proc.stderr
+        stdout = proc.stdout.decode()
+        # Job output arrived during the flash but is printed after it, and after the reset
+        assert stdout.index('Reset complete') < stdout.index('test_case_0')
+        assert stdout.rindex('Reset complete') < stdout.index('test_case_0')
+        assert '3 Tests 1 Failures 0 Ignored' in stdout
+
+        # The image went up as a blob before the flash referred to it by digest
+        assert actions(api)[-3:] == ['uart-duck', 'flash-duck', 'reset-duck']
+        assert any(action.startswith('blobs?sha256=') for action in actions(api))
+
+        stderr = proc.stderr.decode()
+        assert 'Phase timings' in stderr
+        summary = next(json.loads(line) for line in stderr.splitlines() if '"event": "phases"' in line)
+        assert list(summary['phases']) == ['halt', 'upload', 'uart', 'connect', 'flash', 'reset', 'output']
+
+def test_bad_image_rejected_before_reset(lager, tmp_path):
+    image = tmp_path / 'app.hex'
+    image.write_bytes(b'not hex\n:00000001FF\n')
+    with MockLagerAPI() as api:
+        proc = lager(api, 'testrun', '--gateway', '1', '--serial-port', '/dev/ttyACM0', '--hexfile', str(image))
+        assert proc.returncode == 1
+        assert b'Invalid image' in proc.stderr
+        assert actions(api) == []
+
+        proc = lager(api, 'testrun', '--gateway', '1', '--serial-port', '/dev/ttyACM0', '--hexfile', str(image),
+                     '--no-convert')
+        assert proc.returncode == 0, proc.stderr
+        # Sent as the hex file itself rather than converted segments
+        assert list(api.blobs['1'].values()) == [image.read_bytes()]
+        flash = next(request for request in api.requests if request.path.endswith('flash-duck'))
+        assert flash.form()[0][0] == 'hexfile_sha256'
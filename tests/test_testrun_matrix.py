@@ -0,0 +1,53 @@
+import json
+import itertools
+import textwrap
+from lager_cli.bench.mockapi import MockLagerAPI, unity_output
+
+def test_testrun_matrix(lager, tmp_path):
+    (tmp_path / 'a.bin').write_bytes(b'\x01' * 1024)
+    (tmp_path / 'b.bin').write_bytes(b'\x02' * 1024)
+    matrix = tmp_path / 'matrix.yaml'
+    matrix.write_text(textwrap.dedent(f'''
+        gateways: ['mock-gateway*']
+        retries: 1
+        options:
+          serial-port: /dev/ttyACM0
+          pipeline: true
+        images:
+          a:
+            binfile: {tmp_path / 'a.bin'},0x08000000
+          b:
+            binfile: ['{tmp_path / 'b.bin'},0x08000000']
+    '''))
+    report = tmp_path / 'report.json'
+
+    # The first job fails, every later one passes: one target passes on retry
+    runs = itertools.count()
+    output = lambda: unity_output(passed=2, failed=1 if next(runs) == 0 else 0)
+    with MockLagerAPI(job_output_factory=output) as api:
+        proc = lager(api, 'testrun', '--matrix', str(matrix), '--jobs', '2', '--report', str(report))
+        assert proc.returncode == 0, proc.stderr
+
+        jobs = [request for request in api.requests if request.path.endswith('uart-duck')]
+        assert len(jobs) == 5
+
+    stdout = proc.stdout.decode()
+    assert '[mock-gateway/a  ] test/test_main.c:10:test_case_0:PASS' in stdout
+    assert '[mock-gateway-2/b] 2 Tests 0 Failures 0 Ignored' in stdout
+    assert '1 of 4 targets passed only on retry' in stdout
+
+    result = json.loads(report.read_text())
+    assert (result['targets'], result['passed'], result['failed'], result['flaky']) == (4, 4, 0, 1)
+    assert sorted(entry['target'] for entry in result['results']) == [
+        'mock-gateway-2/a', 'mock-gateway-2/b', 'mock-gateway/a', 'mock-gateway/b']
+    flaky = next(entry for entry in result['results'] if entry['flaky'])
+    assert [attempt['exit_code'] for attempt in flaky['attempts']] == [1, 0]
+    assert flaky['attempts'][0]['results'] == {'tests': 3, 'failures': 1, 'ignored': 0}
+
+def test_testrun_matrix_rejects_unknown_options(lager, tmp_path):
+    matrix = tmp_path / 'matrix.yaml'
+    matrix.write_text('gateways: [1]\nimages:\n  a:\n    gateway: 2\n')
+    with MockLagerAPI() as api:
+        proc = lager(api, 'testrun', '--matrix', str(matrix))
+        assert proc.returncode == 2
+        assert b'`gateway` is not a testrun option that can be set per target' in proc.stderr
@@ -0,0 +1,59 @@
+import textwrap
+from lager_cli.bench.mockapi import MockLagerAPI, unity_output
+from lager_cli.testrun.shard import image_key, lpt_assign, read_durations, record_duration
+
+def test_lpt_assign():
+    durations = {'a': 7, 'b': 5, 'c': 4, 'd': 3, 'e': 3}
+    assigned, loads = lpt_assign(list(durations), ['x', 'y'], lambda job, gateway: durations[job])
+    assert assigned == {'x': ['a', 'd'], 'y': ['b', 'c', 'e']}
+    assert loads == {'x': 10, 'y': 12}
+
+    # Each job goes where it would finish soonest, so the slow gateway gets fewer
+    slow = lambda job, gateway: durations[job] * (3 if gateway == 'x' else 1)
+    assigned, loads = lpt_assign(list(durations), ['x', 'y'], slow)
+    assert assigned == {'x': ['c'], 'y': ['a', 'b', 'd', 'e']}
+    assert loads == {'x': 12, 'y': 18}
+
+def test_testrun_shard(lager, tmp_path, monkeypatch):
+    images = {}
+    for name in 'abc':
+        path = tmp_path / f'{name}.bin'
+        path.write_bytes(name.encode() * 1024)
+        images[name] = f'{path},0x08000000'
+    matrix = tmp_path / 'suite.yaml'
+    matrix.write_text(textwrap.dedent(f'''
+        gateways: [mock-gateway, mock-gateway-2]
+        options:
+          serial-port: /dev/ttyACM0
+        images:
+          a: {{binfile: '{images['a']}'}}
+          b: {{binfile: '{images['b']}'}}
+          c: {{binfile: '{images['c']}'}}
+    '''))
+
+    monkeypatch.setenv('LAGER_CACHE_DIR', str(tmp_path / 'cache'))
+    keys = {name: image_key({'binfile': value}) for name, value in images.items()}
+    for gateway in ('1', '2'):
+        record_duration(keys['a'], gateway, 100)
+    record_duration(keys['b'], '1', 60)
+    record_duration(keys['c'], '2', 50)
+
+    with MockLagerAPI(job_output_factory=lambda: unity_output(passed=2, ignored=1)) as api:
+        proc = lager(api, 'testrun', '--matrix', str(matrix), '--shard', '--report', str(tmp_path / 'report.json'))
+        assert proc.returncode == 0, proc.stderr
+
+    stderr = proc.stderr.decode()
+    assert 'mock-gateway: 1 runs, about 100s' in stderr
+    assert 'mock-gateway-2: 2 runs, about 110s' in stderr
+    assert 'Estimated wall time: 110s' in stderr
+
+    stdout = proc.stdout.decode()
+    for target in ('mock-gateway/a', 'mock-gateway-2/b', 'mock-gateway-2/c'):
+        assert f'[{target:<16}] 3 Tests 0 Failures 1 Ignored' in stdout
+    assert '9 Tests 0 Failures 3 Ignored\nOK\n' in stdout
+
+    # Every run was folded into the history of its gateway
+    durations = read_durations()
+    assert durations[keys['a']]['1']['runs'] == 2
+    assert durations[keys['b']]['2']['runs'] == 1
+    assert durations[keys['c']]['2']['runs'] == 2
@@ -0,0 +1,39 @@
+import io
+import json
+from lager_cli.bench.mockapi import MockLagerAPI
+from lager_cli.upload import encoder_fields, streaming_multipart
+from lager_cli.util import zip_dir
+
+def test_multipart_body_is_read_lazily(tmp_path):
+    image = tmp_path / 'image.bin'
+    image.write_bytes(b'x' * 100_000)
+    with open(image, 'rb') as f:
+        fields = encoder_fields([('binfile', f), ('binfile_address', 0x8000000), ('verify', True), ('skip', None)])
+        assert [(name, value[0]) for name, value in fields] == [
+            ('binfile', 'image.bin'), ('binfile_address', 'binfile_address'), ('verify', 'verify'),
+        ]
+        assert fields[1][1][1] == '134217728'
+
+        body, content_type, progress = streaming_multipart(fields, 'flash-duck')
+        assert content_type.startswith('multipart/form-data; boundary=')
+        assert f.tell() == 0
+        first = body.read(8192)
+        assert progress.sent == len(first) and 0 < f.tell() < 100_000
+        rest = body.read()
+        assert progress.sent == len(body) == len(first) + len(rest)
+        assert progress.summary()['bytes'] == len(body)
+
+def test_zip_dir_spools(tmp_path):
+    (tmp_path / 'main.py').write_text('print(1)\n')
+    archive = zip_dir(tmp_path)
+    assert not isinstance(archive, io.BytesIO) and archive.read(2) == b'PK'
+
+def test_debug_upload_summary(lager, tmp_path):
+    script = tmp_path / 'script.py'
+    script.write_text('print("hi")\n')
+    with MockLagerAPI() as api:
+        proc = lager(api, '--debug', 'python', '--gateway', '1', str(script))
+        events = [json.loads(line) for line in proc.stderr.splitlines() if line.startswith(b'{')]
+        assert [(event['event'], event['label']) for event in events] == [('upload', 'run-python')]
+        assert events[0]['bytes'] == len(api.requests[-1].body)
+        assert ('script', b'print("hi")\n') in api.requests[-1].form()
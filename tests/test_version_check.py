@@ -0,0 +1,48 @@
+import threading
+import pytest
+from lager_cli import util
+from lager_cli.cache import read_cache, write_cache
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('LAGER_CACHE_DIR', str(tmp_path))
+    monkeypatch.delenv('LAGER_NO_VERSION_CHECK', raising=False)
+    monkeypatch.setattr(util, '_skip_version_check', lambda: False)
+    return tmp_path
+
+def test_fresh_cache_warns_without_refreshing(monkeypatch, capsys):
+    write_cache(util.VERSION_CACHE_NAME, {'package': 'lager-cli', 'newest_version': '0.10.0'})
+    monkeypatch.setattr(util, 'fetch_newest_version', pytest.fail)
+    util.check_version('lager-cli', '0.9.1')
+    assert 'version 0.10.0 is available' in capsys.readouterr().err
+
+def test_missing_cache_refreshes_in_background(monkeypatch, capsys):
+    fetched = threading.Event()
+    def fetch(package_name):
+        fetched.wait(5)
+        return '1.0.0'
+    monkeypatch.setattr(util, 'fetch_newest_version', fetch)
+    util.check_version('lager-cli', '0.9.1')
+    assert capsys.readouterr().err == ''
+
+    fetched.set()
+    for thread in threading.enumerate():
+        if thread.name == 'lager-version-check':
+            thread.join()
+    value, _age = read_cache(util.VERSION_CACHE_NAME)
+    assert value == {'package': 'lager-cli', 'newest_version': '1.0.0'}
+
+def test_newest_final_release_is_numeric():
+    assert util._parse_release('0.1.10') > util._parse_release('0.1.9')
+    assert util._parse_release('0.2.0rc1') is None
+
+def test_exit_waits_briefly_for_refresh(monkeypatch):
+    registered = []
+    monkeypatch.setattr(util.atexit, 'register', lambda func, *args: registered.append((func, args)))
+    monkeypatch.setattr(util, 'fetch_newest_version', lambda package_name: '1.0.0')
+    util.check_version('lager-cli', '0.9.1')
+    [(join, args)] = registered
+    join(*args)
+    assert args == (util.VERSION_CHECK_EXIT_WAIT,)
+    value, _age = read_cache(util.VERSION_CACHE_NAME)
+    assert value == {'package': 'lager-cli', 'newest_version': '1.0.0'}